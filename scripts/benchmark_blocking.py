@@ -0,0 +1,89 @@
+# Times blocking on the example data as blocking rules are added, joining once per
+# rule with each way of deduplicating pairs found by more than one rule, and
+# joining once on exploded keys.  Run from the root of the repo:
+# python scripts/benchmark_blocking.py 10
+# The optional argument repeats the search side that many times, to make the
+# blocking joins bigger.
+import sys
+import time
+
+import duckdb
+
+from uk_address_matcher.blocking import (
+    compile_blocking_sql,
+    compile_key_blocking_sql,
+)
+from uk_address_matcher.cleaning_pipelines import (
+    clean_data_using_precomputed_rel_tok_freq,
+)
+from uk_address_matcher.splink_model import (
+    _FAST_PATH_SKIPPED_BLOCKING_RULES,
+    _fast_path_blocking_rules,
+)
+
+num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+con = duckdb.connect()
+
+p_ch = "./example_data/companies_house_addresess_postcode_overlap.parquet"
+p_fhrs = "./example_data/fhrs_addresses_sample.parquet"
+
+fhrs_cleaned = clean_data_using_precomputed_rel_tok_freq(
+    con.read_parquet(p_fhrs), con=con
+)
+con.execute("create table l as select * from fhrs_cleaned")
+ch_cleaned = clean_data_using_precomputed_rel_tok_freq(con.read_parquet(p_ch), con=con)
+con.execute("create table ch as select * from ch_cleaned")
+
+sql = f"""
+create table r as
+select * replace (ch.unique_id || '_' || i as unique_id)
+from ch, range({num_repeats}) as t(i)
+"""
+con.execute(sql)
+num_l = con.table("l").count("*").fetchone()[0]
+num_r = con.table("r").count("*").fetchone()[0]
+print(f"Blocking {num_l:,.0f} records against {num_r:,.0f}")
+
+# The rules as _performance_predict blocks on them, on integer postcode codes
+blocking_rules = _fast_path_blocking_rules(include_full_postcode_block=True)
+
+blocking_kwargs = {
+    "left_table": "l",
+    "right_table": "r",
+    "id_columns": ["unique_id"],
+    "skipped_rules": _FAST_PATH_SKIPPED_BLOCKING_RULES,
+}
+
+print("num_rules, method, seconds, num_pairs")
+num_rules_to_time = list(range(2, len(blocking_rules), 2)) + [len(blocking_rules)]
+for num_rules in num_rules_to_time:
+    rules = blocking_rules[:num_rules]
+    blocked_sql_by_method = {
+        "exclude_previous_rules": compile_blocking_sql(
+            rules, deduplication="exclude_previous_rules", **blocking_kwargs
+        ),
+        "min_match_key": compile_blocking_sql(
+            rules, deduplication="min_match_key", **blocking_kwargs
+        ),
+        "keys": compile_key_blocking_sql(rules, **blocking_kwargs),
+    }
+    for method, blocked_sql in blocked_sql_by_method.items():
+        start_time = time.time()
+        con.execute(f"create or replace table {method} as {blocked_sql}")
+        elapsed_time = time.time() - start_time
+
+        num_pairs = con.table(method).count("*").fetchone()[0]
+        print(f"{num_rules}, {method}, {elapsed_time:.3f}, {num_pairs}")
+
+    for method in list(blocked_sql_by_method)[1:]:
+        sql = f"""
+        select count(*) from (
+            (select * from exclude_previous_rules except all select * from {method})
+            union all
+            (select * from {method} except all select * from exclude_previous_rules)
+        )
+        """
+        num_differences = con.sql(sql).fetchone()[0]
+        if num_differences:
+            print(f"{num_differences} pairs differ between {method} and the original")
@@ -0,0 +1,72 @@
+# Measures how long it takes to import the package's modules in a fresh interpreter,
+# and checks that none of them pull in splink, pandas or IPython until they are used.
+# Run from the root of the repo:
+# python scripts/benchmark_import_time.py
+# An optional argument sets the budget in seconds for importing cleaning_pipelines,
+# above which the script exits with a non-zero status (default 0.5).
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+num_runs = 5
+budget_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+
+heavy_modules = ["splink", "pandas", "IPython", "pyarrow", "numpy"]
+
+modules = [
+    "uk_address_matcher.cleaning",
+    "uk_address_matcher.cleaning_pipelines",
+    "uk_address_matcher.display_results",
+    "uk_address_matcher.splink_model",
+]
+
+timing_code = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start_time
+loaded = [m for m in {heavy_modules!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded}}))
+"""
+
+env = dict(os.environ)
+env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+
+# Import duckdb once so its shared library is in the OS page cache for every run
+subprocess.run([sys.executable, "-c", "import duckdb"], check=True, env=env)
+
+results = {}
+for module in modules:
+    code = timing_code.format(module=module, heavy_modules=heavy_modules)
+    runs = []
+    for _ in range(num_runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            capture_output=True,
+            text=True,
+            env=env,
+        ).stdout
+        runs.append(json.loads(output))
+    seconds = statistics.median(r["seconds"] for r in runs)
+    loaded = runs[0]["loaded"]
+    results[module] = (seconds, loaded)
+    print(f"{module}: {seconds:.3f} seconds, heavy modules loaded: {loaded or 'none'}")
+
+failures = []
+for module, (seconds, loaded) in results.items():
+    if loaded:
+        failures.append(f"{module} imports {', '.join(loaded)}")
+
+seconds, _ = results["uk_address_matcher.cleaning_pipelines"]
+if seconds > budget_seconds:
+    failures.append(
+        f"uk_address_matcher.cleaning_pipelines took {seconds:.3f} seconds to import, "
+        f"over the budget of {budget_seconds} seconds"
+    )
+
+for failure in failures:
+    print(f"FAIL: {failure}")
+sys.exit(1 if failures else 0)
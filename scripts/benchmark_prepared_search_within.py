@@ -0,0 +1,81 @@
+# Times matching a small input against a large search side, cleaning the search side
+# on every run versus preparing it once with prepare_search_within_table.  Run from
+# the root of the repo:
+# python scripts/benchmark_prepared_search_within.py 10
+# The optional argument repeats the search side that many times, to make it bigger.
+import os
+import sys
+import tempfile
+import time
+
+import duckdb
+
+from uk_address_matcher.cleaning_pipelines import (
+    clean_data_using_precomputed_rel_tok_freq,
+)
+from uk_address_matcher.splink_model import (
+    _performance_predict,
+    prepare_search_within_table,
+)
+
+num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+p_ch = "./example_data/companies_house_addresess_postcode_overlap.parquet"
+p_fhrs = "./example_data/fhrs_addresses_sample.parquet"
+
+temp_dir = tempfile.mkdtemp()
+search_within_path = os.path.join(temp_dir, "search_within.parquet")
+prepared_path = os.path.join(temp_dir, "search_within.duckdb")
+
+con = duckdb.connect()
+sql = f"""
+copy (
+    select * replace (ch.unique_id || '_' || i as unique_id)
+    from read_parquet('{p_ch}') as ch, range({num_repeats}) as t(i)
+) to '{search_within_path}' (format parquet)
+"""
+con.execute(sql)
+num_search_within = con.read_parquet(search_within_path).count("*").fetchall()[0][0]
+
+# A small daily input
+sql = f"select * from read_parquet('{p_fhrs}') limit 500"
+con.execute(f"create table to_match as {sql}")
+print(f"Matching 500 records against {num_search_within:,.0f}")
+
+
+def predict(df_addresses_to_search_within):
+    to_match_cleaned = clean_data_using_precomputed_rel_tok_freq(
+        con.table("to_match"), con=con
+    )
+    _, predictions = _performance_predict(
+        df_addresses_to_match=to_match_cleaned,
+        df_addresses_to_search_within=df_addresses_to_search_within,
+        con=con,
+        match_weight_threshold=None,
+    )
+    sql = """
+    select unique_id_l, unique_id_r, match_key, round(match_weight, 9) as match_weight
+    from predictions
+    """
+    return con.sql(sql).fetchall()
+
+
+start_time = time.time()
+search_within = clean_data_using_precomputed_rel_tok_freq(
+    con.read_parquet(search_within_path), con=con
+)
+con.execute("create or replace table search_within as select * from search_within")
+predictions_cleaned = predict("search_within")
+print(f"Cleaning the search side every run: {time.time() - start_time:.2f} seconds")
+
+start_time = time.time()
+prepare_search_within_table(search_within_path, con=con, path=prepared_path)
+print(f"Preparing the search side: {time.time() - start_time:.2f} seconds")
+
+start_time = time.time()
+prepare_search_within_table(search_within_path, con=con, path=prepared_path)
+predictions_prepared = predict(prepared_path)
+print(f"Using the prepared search side: {time.time() - start_time:.2f} seconds")
+
+if sorted(predictions_cleaned) != sorted(predictions_prepared):
+    print("Predictions differ between the two methods")
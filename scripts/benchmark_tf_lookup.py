@@ -0,0 +1,87 @@
+# Compares the explode/join/regroup and hash lookup implementations of attaching
+# token frequencies to address tokens.  Run from the root of the repo:
+# python scripts/benchmark_tf_lookup.py 5000000
+import sys
+import time
+
+import duckdb
+
+from uk_address_matcher.cleaning import (
+    add_term_frequencies_to_address_tokens_using_hash_lookup,
+    add_term_frequencies_to_address_tokens_using_registered_df,
+    clean_address_string_first_pass,
+    clean_address_string_second_pass,
+    parse_out_numbers,
+    split_numeric_tokens_to_cols,
+    tokenise_address_without_numbers,
+    trim_whitespace_address_and_postcode,
+    upper_case_address_and_postcode,
+)
+from uk_address_matcher.run_pipeline import run_pipeline_compiled
+
+num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+
+con = duckdb.connect()
+con.register(
+    "rel_tok_freq",
+    con.read_parquet("./uk_address_matcher/data/address_token_frequencies.parquet"),
+)
+
+# Repeat the example data until we have num_rows rows
+p_ch = "./example_data/companies_house_addresess_postcode_overlap.parquet"
+ch = con.read_parquet(p_ch)
+num_repeats = -(-num_rows // ch.count("*").fetchone()[0])
+sql = f"""
+create table addresses as
+select
+    ch.unique_id || '_' || r.i as unique_id,
+    ch.source_dataset,
+    ch.address_concat,
+    ch.postcode
+from ch, range({num_repeats}) as r(i)
+limit {num_rows}
+"""
+con.execute(sql)
+
+cleaning_queue = [
+    trim_whitespace_address_and_postcode,
+    upper_case_address_and_postcode,
+    clean_address_string_first_pass,
+    parse_out_numbers,
+    clean_address_string_second_pass,
+    split_numeric_tokens_to_cols,
+    tokenise_address_without_numbers,
+]
+tokenised = run_pipeline_compiled("addresses", con=con, cleaning_queue=cleaning_queue)
+con.execute("create table tokenised as select * from tokenised")
+print(f"Benchmarking on {num_rows:,.0f} rows")
+
+results = {}
+for tf_function in [
+    add_term_frequencies_to_address_tokens_using_registered_df,
+    add_term_frequencies_to_address_tokens_using_hash_lookup,
+]:
+    name = tf_function.__name__
+    start_time = time.time()
+    res = run_pipeline_compiled("tokenised", con=con, cleaning_queue=[tf_function])
+    con.execute(f"create or replace table {name} as select * from res")
+    results[name] = time.time() - start_time
+    print(f"{name}: {results[name]:.2f} seconds")
+
+sql = """
+select count(*) from (
+    (
+        select * from add_term_frequencies_to_address_tokens_using_registered_df
+        except all
+        select * from add_term_frequencies_to_address_tokens_using_hash_lookup
+    )
+    union all
+    (
+        select * from add_term_frequencies_to_address_tokens_using_hash_lookup
+        except all
+        select * from add_term_frequencies_to_address_tokens_using_registered_df
+    )
+)
+"""
+num_differences = con.sql(sql).fetchone()[0]
+print(f"Rows differing between implementations: {num_differences}")
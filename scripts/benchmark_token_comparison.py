@@ -0,0 +1,85 @@
+# Compares implementations of the token_rel_freq_arr comparison on a table of
+# blocked pairs built from the example data.  Run from the root of the repo:
+# python scripts/benchmark_token_comparison.py
+import time
+
+import duckdb
+
+from uk_address_matcher.arr_comparisons import (
+    array_reduce_by_freq,
+    array_reduce_by_freq_using_arrow_udf,
+    array_reduce_by_freq_using_list_contains,
+    token_list_columns_sql,
+)
+from uk_address_matcher.cleaning_pipelines import (
+    clean_data_using_precomputed_rel_tok_freq,
+)
+
+con = duckdb.connect()
+
+p_ch = "./example_data/companies_house_addresess_postcode_overlap.parquet"
+p_fhrs = "./example_data/fhrs_addresses_sample.parquet"
+
+ch_cleaned = clean_data_using_precomputed_rel_tok_freq(con.read_parquet(p_ch), con=con)
+con.execute("create table ch as select * from ch_cleaned")
+fhrs_cleaned = clean_data_using_precomputed_rel_tok_freq(
+    con.read_parquet(p_fhrs), con=con
+)
+con.execute("create table fhrs as select * from fhrs_cleaned")
+
+# Blocking on postcode district gives a few million pairs with a realistic mix of
+# matching and non-matching tokens
+sql = """
+create table pairs as
+select
+    row_number() over () as pair_id,
+    l.token_rel_freq_arr as token_rel_freq_arr_l,
+    r.token_rel_freq_arr as token_rel_freq_arr_r
+from fhrs as l
+inner join ch as r
+on l.postcode_district_code = r.postcode_district_code
+"""
+con.execute(sql)
+num_pairs = con.sql("select count(*) from pairs").fetchall()[0][0]
+print(f"Benchmarking on {num_pairs:,.0f} pairs")
+
+array_type = con.table("pairs").select("token_rel_freq_arr_l").types[0]
+comparison_sql = {
+    "array_reduce_by_freq": array_reduce_by_freq("token_rel_freq_arr", 0.33),
+    "array_reduce_by_freq_using_list_contains": (
+        array_reduce_by_freq_using_list_contains("token_rel_freq_arr", 0.33)
+    ),
+    "array_reduce_by_freq_using_list_contains_precomputed": (
+        array_reduce_by_freq_using_list_contains(
+            "token_rel_freq_arr", 0.33, token_lists_precomputed=True
+        )
+    ),
+    "array_reduce_by_freq_using_arrow_udf": array_reduce_by_freq_using_arrow_udf(
+        con, "token_rel_freq_arr", array_type, 0.33
+    ),
+}
+
+for name, sql_expr in comparison_sql.items():
+    start_time = time.time()
+    sql = f"""
+    create or replace table {name} as
+    with pairs_with_token_lists as (
+        select *, {token_list_columns_sql("token_rel_freq_arr")}
+        from pairs
+    )
+    select pair_id, {sql_expr} as complex_tok
+    from pairs_with_token_lists
+    """
+    con.execute(sql)
+    print(f"{name}: {time.time() - start_time:.2f} seconds")
+
+for name in list(comparison_sql)[1:]:
+    sql = f"""
+    select count(*)
+    from array_reduce_by_freq as a
+    inner join {name} as b
+    using (pair_id)
+    where a.complex_tok is distinct from b.complex_tok
+    """
+    num_differences = con.sql(sql).fetchone()[0]
+    print(f"Pairs where {name} differs from array_reduce_by_freq: {num_differences}")
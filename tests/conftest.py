@@ -0,0 +1,99 @@
+import os
+
+import duckdb
+import pytest
+
+EXAMPLE_DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "example_data")
+FHRS_PATH = os.path.join(EXAMPLE_DATA_DIR, "fhrs_addresses_sample.parquet")
+COMPANIES_HOUSE_PATH = os.path.join(
+    EXAMPLE_DATA_DIR, "companies_house_addresess_postcode_overlap.parquet"
+)
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    yield con
+    con.close()
+
+
+@pytest.fixture
+def fhrs_addresses(con):
+    # A slice of the example data, small enough to clean quickly
+    sql = f"""
+    create table fhrs_addresses as
+    select * from read_parquet('{FHRS_PATH}')
+    order by unique_id
+    limit 500
+    """
+    con.execute(sql)
+    return con.table("fhrs_addresses")
+
+
+def assert_same_rows(con, left_sql, right_sql):
+    # Checks two queries return the same rows in any order
+    sql = f"""
+    select
+        (select count(*) from (({left_sql}) except all ({right_sql}))),
+        (select count(*) from (({right_sql}) except all ({left_sql})))
+    """
+    assert con.sql(sql).fetchall() == [(0, 0)]
+
+
+@pytest.fixture
+def example_tables(con):
+    # 200 FHRS addresses to match, and the Companies House addresses sharing their
+    # postcodes to search within
+    sql = f"""
+    create table to_match as
+    select * from read_parquet('{FHRS_PATH}')
+    order by unique_id
+    limit 200
+    """
+    con.execute(sql)
+    sql = f"""
+    create table search_within as
+    select * from read_parquet('{COMPANIES_HOUSE_PATH}')
+    where postcode in (select postcode from to_match)
+    order by unique_id
+    """
+    con.execute(sql)
+    return "to_match", "search_within"
+
+
+def clean(con, table_name, **kwargs):
+    # Cleans table_name into a table named <table_name>_cleaned
+    from uk_address_matcher.cleaning_pipelines import (
+        clean_data_using_precomputed_rel_tok_freq,
+    )
+
+    cleaned = clean_data_using_precomputed_rel_tok_freq(
+        con.table(table_name), con=con, **kwargs
+    )
+    con.execute(
+        f"create or replace table {table_name}_cleaned as select * from cleaned"
+    )
+    return f"{table_name}_cleaned"
+
+
+def predict(con, left, right, **kwargs):
+    # Scores every blocked pair, returning the pairs and their match keys and
+    # weights in a stable order
+    from uk_address_matcher.splink_model import _performance_predict
+
+    _, predictions = _performance_predict(
+        df_addresses_to_match=left,
+        df_addresses_to_search_within=right,
+        con=con,
+        match_weight_threshold=None,
+        **kwargs,
+    )
+    # Registered under its own name, since with output_dir the predictions table
+    # holds only the last partition
+    con.register("__predictions_to_check", predictions)
+    sql = """
+    select unique_id_l, unique_id_r, match_key, round(match_weight, 9) as match_weight
+    from __predictions_to_check
+    order by unique_id_l, unique_id_r
+    """
+    return con.sql(sql).fetchall()
@@ -0,0 +1,164 @@
+import pytest
+
+from uk_address_matcher.blocking import (
+    _blocking_rule_keys,
+    compile_blocking_sql,
+    compile_key_blocking_sql,
+)
+from uk_address_matcher.splink_model import (
+    _FAST_PATH_SKIPPED_BLOCKING_RULES,
+    SKIPPED_BLOCKING_RULES,
+    _fast_path_blocking_rules,
+    get_blocking_rules,
+)
+
+from conftest import clean
+
+
+def _splink_pairs_sql(blocking_rules, left_table, right_table, skipped_rules):
+    # Every pair, with the match_key Splink would give it: the position of the
+    # first rule it satisfies.  Pairs whose first rule is skipped are not output,
+    # since Splink excludes pairs found by earlier rules from later ones
+    cases = " ".join(
+        f"WHEN coalesce(({rule}), false) THEN {match_key}"
+        for match_key, rule in enumerate(blocking_rules)
+    )
+    skipped = ", ".join(
+        str(match_key)
+        for match_key, rule in enumerate(blocking_rules)
+        if rule in skipped_rules
+    )
+    skipped_condition = f"and match_key not in ({skipped})" if skipped else ""
+    return f"""
+    select unique_id_l, unique_id_r, match_key::VARCHAR as match_key
+    from (
+        select
+            l.unique_id as unique_id_l,
+            r.unique_id as unique_id_r,
+            CASE {cases} END as match_key
+        from {left_table} as l
+        cross join {right_table} as r
+    )
+    where match_key is not null {skipped_condition}
+    """
+
+
+def _blocked_pairs(con, blocking_rules, left_table, right_table, skipped_rules):
+    # The pairs found by the blocking SQL for each way of blocking, and by Splink,
+    # sorted
+    kwargs = {
+        "left_table": left_table,
+        "right_table": right_table,
+        "id_columns": ["unique_id"],
+        "skipped_rules": skipped_rules,
+    }
+    sqls = {
+        "splink": _splink_pairs_sql(
+            blocking_rules, left_table, right_table, skipped_rules
+        ),
+        "min_match_key": compile_blocking_sql(blocking_rules, **kwargs),
+        "exclude_previous_rules": compile_blocking_sql(
+            blocking_rules, deduplication="exclude_previous_rules", **kwargs
+        ),
+        "keys": compile_key_blocking_sql(blocking_rules, **kwargs),
+    }
+    return {
+        name: sorted(con.sql(f"select * from ({sql})").fetchall())
+        for name, sql in sqls.items()
+    }
+
+
+@pytest.fixture
+def small_tables(con):
+    # Records sharing values of a and b in various combinations, with nulls
+    sql = """
+    create table small_l as
+    select * from (values
+        ('l1', 1, 'x', 10), ('l2', 1, 'y', 20), ('l3', 2, 'x', null),
+        ('l4', null, 'z', 30), ('l5', 3, null, 10)
+    ) as t(unique_id, a, b, c)
+    """
+    con.execute(sql)
+    sql = """
+    create table small_r as
+    select * from (values
+        ('r1', 1, 'x', 10), ('r2', 1, 'z', 30), ('r3', 2, 'y', 20),
+        ('r4', null, 'x', 10), ('r5', 3, null, null), ('r6', 4, 'w', 40)
+    ) as t(unique_id, a, b, c)
+    """
+    con.execute(sql)
+    return "small_l", "small_r"
+
+
+_SMALL_RULES = [
+    "l.a = r.a and l.b = r.b",
+    "l.c = r.c",
+    "l.a = r.a",
+    "l.b = r.b",
+]
+
+
+@pytest.mark.parametrize("skipped_rules", [(), ("l.c = r.c",), ("l.a = r.a",)])
+def test_blocking_matches_splink(con, small_tables, skipped_rules):
+    pairs = _blocked_pairs(con, _SMALL_RULES, *small_tables, skipped_rules)
+    assert len(pairs["splink"]) > 0
+    for name in ["min_match_key", "exclude_previous_rules", "keys"]:
+        assert pairs[name] == pairs["splink"], name
+
+
+def test_model_blocking_matches_splink(con, example_tables):
+    left, right = (clean(con, table_name) for table_name in example_tables)
+    blocking_rules = get_blocking_rules(include_full_postcode_block=True)
+
+    pairs = _blocked_pairs(con, blocking_rules, left, right, SKIPPED_BLOCKING_RULES)
+    for name in ["min_match_key", "exclude_previous_rules", "keys"]:
+        assert pairs[name] == pairs["splink"], name
+
+    # Some pairs are first found by a skipped rule, so are dropped entirely
+    unskipped = _blocked_pairs(con, blocking_rules, left, right, ())
+    assert len(pairs["splink"]) < len(unskipped["splink"])
+
+
+def test_fast_path_blocking_matches_model_blocking(con, example_tables):
+    left, right = (clean(con, table_name) for table_name in example_tables)
+    # The postcode codes agree with the postcode strings, except that a postcode
+    # missing its space is compared on its components
+    for table_name in [left, right]:
+        con.execute(f"delete from {table_name} where not contains(postcode, ' ')")
+
+    sqls = [
+        _splink_pairs_sql(get_blocking_rules(), left, right, SKIPPED_BLOCKING_RULES),
+        _splink_pairs_sql(
+            _fast_path_blocking_rules(True),
+            left,
+            right,
+            _FAST_PATH_SKIPPED_BLOCKING_RULES,
+        ),
+    ]
+    model_pairs, fast_path_pairs = (sorted(con.sql(sql).fetchall()) for sql in sqls)
+    assert len(model_pairs) > 0
+    assert fast_path_pairs == model_pairs
+
+
+def test_blocking_rule_keys():
+    rule = "l.a = r.b and list_extract(r.c, 1) = list_extract(l.c, 2)"
+    # Each key is put in (left, right) order
+    assert _blocking_rule_keys(rule) == [
+        ("l.a", "r.b"),
+        ("list_extract(l.c, 2)", "list_extract(r.c, 1)"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        "l.a < r.a",
+        "l.a = r.a or l.b = r.b",
+        "l.a = r.a and levenshtein(l.b, r.b) < 2",
+        "l.a = l.b",
+        "l.a + r.a = 2",
+    ],
+)
+def test_blocking_rule_keys_rejects_non_equi_rules(rule):
+    with pytest.raises(ValueError, match="Cannot block on keys"):
+        _blocking_rule_keys(rule)
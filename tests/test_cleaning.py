@@ -0,0 +1,105 @@
+import duckdb
+
+from uk_address_matcher.cleaning import (
+    CommonEndTokens,
+    _register_token_id_udf,
+    add_postcode_components,
+)
+
+
+def _postcode_components(con, postcodes):
+    values_sql = ", ".join(f"('{p}')" for p in postcodes)
+    con.execute(
+        f"create table postcodes as select * from (values {values_sql}) as t(postcode)"
+    )
+    result = add_postcode_components(con.table("postcodes"), con)
+    return {row[0]: row[1:] for row in result.fetchall()}
+
+
+def test_postcode_components(con):
+    components = _postcode_components(
+        con,
+        [
+            "SW1A 1AA",
+            "SW1A 2AB",
+            "CM11 2HL",
+            "CM112HL",
+            "M1 1AE",
+            "B1 1AA",
+            "SW1A",
+            "GIR 0AA",
+            "GIR 1AB",
+            "N/A",
+        ],
+    )
+
+    area, district, sector, inward, unit = range(1, 6)
+    is_valid = 0
+
+    assert components["SW1A 1AA"][is_valid]
+    assert not components["N/A"][is_valid]
+    assert components["N/A"][area:] == (None,) * 5
+
+    # A partial postcode is still blocked on its outward code
+    assert not components["SW1A"][is_valid]
+    assert components["SW1A"][area:sector] == components["SW1A 1AA"][area:sector]
+    assert components["SW1A"][sector:] == (None,) * 3
+
+    # As is a non-standard postcode, on all of its parts
+    assert not components["GIR 0AA"][is_valid]
+    assert None not in components["GIR 0AA"][area:]
+    assert components["GIR 0AA"][district] == components["GIR 1AB"][district]
+    assert components["GIR 0AA"][unit] != components["GIR 1AB"][unit]
+
+    # A missing space makes no difference
+    assert components["CM112HL"] == components["CM11 2HL"]
+
+    # Codes agree exactly where the components do
+    assert components["SW1A 1AA"][district] == components["SW1A 2AB"][district]
+    assert components["SW1A 1AA"][sector] != components["SW1A 2AB"][sector]
+    assert components["SW1A 1AA"][unit] != components["SW1A 2AB"][unit]
+    assert components["SW1A 1AA"][inward] == components["B1 1AA"][inward]
+    assert components["SW1A 1AA"][inward] != components["M1 1AE"][inward]
+    assert components["SW1A 1AA"][area] != components["M1 1AE"][area]
+    assert components["M1 1AE"][district] != components["M1 1AE"][area]
+
+
+class _RecordingConnection:
+    # Records the SQL executed on a connection
+    def __init__(self, con):
+        self.con = con
+        self.executed = []
+
+    def execute(self, sql, *args):
+        self.executed.append(sql)
+        return self.con.execute(sql, *args)
+
+
+def test_common_end_tokens_are_loaded_once_per_connection(con):
+    common_end_tokens = CommonEndTokens()
+    recording = _RecordingConnection(con)
+    table_name = common_end_tokens.register(recording)
+    assert common_end_tokens.register(recording) == table_name
+    assert len(recording.executed) == 1
+    assert con.table(table_name).count("*").fetchall()[0][0] > 0
+
+    # Temporary tables are per connection, so another connection loads its own
+    other_con = duckdb.connect()
+    common_end_tokens.register(other_con)
+    assert other_con.table(table_name).count("*").fetchall()[0][0] > 0
+    other_con.close()
+
+
+def test_out_of_vocab_token_ids_are_fixed(con):
+    # The IDs are stored in prepared search tables and cleaning caches, so pin one
+    _register_token_id_udf(con, "token_ids")
+    con.execute(
+        "create table tokens as select * from (values "
+        "(['ROAD', 'ZQXJV', NULL, 'ZQXJV']), (NULL), ([]::VARCHAR[])) as t(toks)"
+    )
+    ids = [row[0] for row in con.sql("select token_ids(toks) from tokens").fetchall()]
+    road_id, oov_id, null_id, repeated_oov_id = ids[0]
+    assert road_id > 0
+    assert oov_id == repeated_oov_id == -5882462654715566480
+    assert null_id is None
+    assert ids[1:] == [None, []]
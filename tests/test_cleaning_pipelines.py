@@ -0,0 +1,146 @@
+import os
+
+import duckdb
+import pytest
+
+from uk_address_matcher.cleaning_pipelines import (
+    clean_data_in_parallel,
+    clean_data_streaming,
+    clean_data_using_precomputed_rel_tok_freq,
+)
+
+from conftest import assert_same_rows
+
+
+def _add_untokenisable_address(con):
+    # A missing address yields no tokens, so is dropped by cleaning
+    sql = """
+    insert into fhrs_addresses by name
+    select 'no_tokens' as unique_id, null as address_concat, 'SW1A 1AA' as postcode
+    """
+    con.execute(sql)
+
+
+def _num_misses(con):
+    return con.table("__address_table_misses").count("*").fetchall()[0][0]
+
+
+def test_cleaning_cache_matches_uncached_cleaning(con, fhrs_addresses, tmp_path):
+    _add_untokenisable_address(con)
+    cache_path = str(tmp_path / "cache.duckdb")
+
+    uncached = clean_data_using_precomputed_rel_tok_freq(fhrs_addresses, con=con)
+    con.execute("create table uncached as select * from uncached")
+
+    for expected_misses in [501, 0]:
+        cached = clean_data_using_precomputed_rel_tok_freq(
+            fhrs_addresses, con=con, cache_path=cache_path
+        )
+        assert _num_misses(con) == expected_misses
+        assert cached.columns == con.table("uncached").columns
+        assert_same_rows(con, "select * from uncached", "select * from cached")
+
+    assert con.table("uncached").count("*").fetchall() == [(500,)]
+
+
+def test_cleaning_cache_only_cleans_new_addresses(con, fhrs_addresses, tmp_path):
+    cache_path = str(tmp_path / "cache.duckdb")
+    clean_data_using_precomputed_rel_tok_freq(
+        fhrs_addresses, con=con, cache_path=cache_path
+    )
+
+    _add_untokenisable_address(con)
+    sql = """
+    insert into fhrs_addresses by name
+    select 'new' as unique_id, '1 NEW ROAD' as address_concat, 'SW1A 1AA' as postcode
+    """
+    con.execute(sql)
+
+    cleaned = clean_data_using_precomputed_rel_tok_freq(
+        fhrs_addresses, con=con, cache_path=cache_path
+    )
+    assert _num_misses(con) == 2
+    assert cleaned.filter("unique_id = 'new'").count("*").fetchall() == [(1,)]
+    assert cleaned.filter("unique_id = 'no_tokens'").count("*").fetchall() == [(0,)]
+
+
+def test_streaming_cleaning_matches_single_shot_cleaning(con, fhrs_addresses, tmp_path):
+    input_path = str(tmp_path / "input.parquet")
+    con.execute(f"copy fhrs_addresses to '{input_path}' (format parquet)")
+    expected = clean_data_using_precomputed_rel_tok_freq(fhrs_addresses, con=con)
+    con.execute("create table expected as select * from expected")
+
+    output_dir = tmp_path / "cleaned"
+    streamed = clean_data_streaming(
+        input_path, str(output_dir), con, rows_per_batch=100
+    )
+    con.register("streamed", streamed)
+
+    assert sorted(os.listdir(output_dir)) == [f"part_{i:05d}.parquet" for i in range(5)]
+    assert streamed.columns == con.table("expected").columns
+    assert_same_rows(con, "select * from expected", "select * from streamed")
+
+
+def test_cleaning_cache_is_detached_when_cleaning_fails(con, fhrs_addresses, tmp_path):
+    first_cache_path = str(tmp_path / "first.duckdb")
+    clean_data_using_precomputed_rel_tok_freq(
+        fhrs_addresses, con=con, cache_path=first_cache_path
+    )
+    with pytest.raises(duckdb.Error):
+        clean_data_using_precomputed_rel_tok_freq(
+            fhrs_addresses.project("unique_id, address_concat"),
+            con=con,
+            cache_path=first_cache_path,
+        )
+    sql = "select count(*) from duckdb_databases() where path like '%.duckdb'"
+    assert con.sql(sql).fetchall() == [(0,)]
+
+    # A later call uses its own cache, not the one left from the failed call
+    second_cache_path = str(tmp_path / "second.duckdb")
+    clean_data_using_precomputed_rel_tok_freq(
+        fhrs_addresses, con=con, cache_path=second_cache_path
+    )
+    assert _num_misses(con) == 500
+
+
+def test_parallel_cleaning_matches_single_process_cleaning(
+    con, fhrs_addresses, tmp_path
+):
+    _add_untokenisable_address(con)
+    input_path = str(tmp_path / "input.parquet")
+    con.execute(f"copy fhrs_addresses to '{input_path}' (format parquet)")
+    expected = clean_data_using_precomputed_rel_tok_freq(fhrs_addresses, con=con)
+    con.execute("create table expected as select * from expected")
+
+    output_dir = tmp_path / "cleaned"
+    cleaned, throughput = clean_data_in_parallel(
+        input_path, str(output_dir), con, num_workers=2
+    )
+    con.register("cleaned", cleaned)
+
+    assert not os.path.exists(output_dir / "__postcode_areas")
+    assert sum(stats["rows"] for stats in throughput) == 501
+    assert cleaned.columns == con.table("expected").columns
+    assert_same_rows(con, "select * from expected", "select * from cleaned")
+
+
+def test_hash_lookup_matches_registered_df_join(con, fhrs_addresses):
+    _add_untokenisable_address(con)
+    # Tokens missing from the token frequency table are kept by both
+    sql = """
+    insert into fhrs_addresses by name
+    select 'unknown' as unique_id, '1 ZQXJV QZVXW ROAD' as address_concat,
+        'SW1A 1AA' as postcode
+    """
+    con.execute(sql)
+
+    expected = clean_data_using_precomputed_rel_tok_freq(fhrs_addresses, con=con)
+    con.execute("create table expected as select * from expected")
+    hash_lookup = clean_data_using_precomputed_rel_tok_freq(
+        fhrs_addresses, con=con, use_hash_lookup=True
+    )
+    con.execute("create table hash_lookup as select * from hash_lookup")
+
+    assert con.table("hash_lookup").columns == con.table("expected").columns
+    assert con.table("expected").count("*").fetchall() == [(501,)]
+    assert_same_rows(con, "select * from expected", "select * from hash_lookup")
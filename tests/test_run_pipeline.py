@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from uk_address_matcher.cleaning_pipelines import (
+    CLEANING_QUEUE_ON_THE_FLY,
+    CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ,
+    _register_rel_tok_freq_table,
+    profile_clean_data_using_precomputed_rel_tok_freq,
+)
+from uk_address_matcher.run_pipeline import (
+    compile_pipeline,
+    run_pipeline,
+    run_pipeline_compiled,
+)
+
+from conftest import assert_same_rows
+
+
+@pytest.mark.parametrize(
+    "cleaning_queue",
+    [CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ, CLEANING_QUEUE_ON_THE_FLY],
+)
+def test_compiled_pipeline_matches_run_pipeline(con, fhrs_addresses, cleaning_queue):
+    _register_rel_tok_freq_table(con)
+
+    staged = run_pipeline(fhrs_addresses, con=con, cleaning_queue=cleaning_queue)
+    con.execute("create table staged as select * from staged")
+    compiled = run_pipeline_compiled(
+        "fhrs_addresses", con=con, cleaning_queue=cleaning_queue
+    )
+    con.execute("create table compiled as select * from compiled")
+
+    assert con.table("compiled").columns == con.table("staged").columns
+    assert con.table("compiled").count("*").fetchall() == [(500,)]
+    assert_same_rows(con, "select * from staged", "select * from compiled")
+
+
+def _stage_with_literal_and_comment(ddb_pyrel, con):
+    sql = """
+    -- Reads from ddb_pyrel
+    select *, 'ddb_pyrel' as label, "postcode" as "ddb_pyrel"
+    from ddb_pyrel
+    """
+    return con.sql(sql)
+
+
+def test_compile_pipeline_only_rewrites_identifiers(con, fhrs_addresses):
+    sql = compile_pipeline(
+        "fhrs_addresses", con=con, cleaning_queue=[_stage_with_literal_and_comment]
+    )
+
+    assert "-- Reads from ddb_pyrel" in sql
+    assert "from fhrs_addresses" in sql
+    result = con.sql(sql).select("label, ddb_pyrel").limit(1).fetchall()
+    assert result[0][0] == "ddb_pyrel"
+
+
+def _stage_without_input(ddb_pyrel, con):
+    return con.sql("select 1 as one")
+
+
+def test_compile_pipeline_rejects_stage_not_reading_its_input(con):
+    with pytest.raises(ValueError, match="_stage_without_input"):
+        compile_pipeline("t", con=con, cleaning_queue=[_stage_without_input])
+
+
+def test_profile_pipeline_records_each_stage(con, fhrs_addresses):
+    profile = profile_clean_data_using_precomputed_rel_tok_freq(fhrs_addresses, con)
+
+    assert [record["function"] for record in profile] == [
+        f.__name__ for f in CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ
+    ]
+    for stage, record in enumerate(profile, start=1):
+        assert set(record) == {
+            "stage",
+            "function",
+            "seconds",
+            "num_rows",
+            "num_columns",
+            "memory_added_bytes",
+            "total_memory_usage_bytes",
+        }
+        assert record["stage"] == stage
+        assert record["total_memory_usage_bytes"] >= record["memory_added_bytes"]
+    assert profile[-1]["num_rows"] == 500
+    json.dumps(profile)
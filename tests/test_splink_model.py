@@ -0,0 +1,326 @@
+import os
+
+import pytest
+
+from uk_address_matcher.splink_model import (
+    _performance_predict,
+    get_pretrained_linker,
+    prepare_search_within_table,
+)
+
+from conftest import clean, predict
+
+
+@pytest.fixture
+def cleaned_example_tables(con, example_tables):
+    return tuple(clean(con, table_name) for table_name in example_tables)
+
+
+def test_token_ids_give_same_predictions(con, example_tables, cleaned_example_tables):
+    expected = predict(con, *cleaned_example_tables)
+    assert len(expected) > 0
+
+    left, right = (clean(con, t, use_token_ids=True) for t in example_tables)
+    assert con.sql(f"select token_rel_freq_arr[1].tok from {left}").dtypes == ["BIGINT"]
+    assert predict(con, left, right) == expected
+
+
+@pytest.mark.parametrize("use_token_ids", [False, True])
+def test_arrow_token_comparison_engine_gives_same_predictions(
+    con, example_tables, use_token_ids
+):
+    left, right = (clean(con, t, use_token_ids=use_token_ids) for t in example_tables)
+    expected = predict(con, left, right)
+    assert len(expected) > 0
+    assert predict(con, left, right, token_comparison_engine="arrow") == expected
+
+
+@pytest.mark.parametrize("fuse_blocking_and_scoring", [False, True])
+def test_predicting_by_partition_gives_same_predictions(
+    con, cleaned_example_tables, tmp_path, fuse_blocking_and_scoring
+):
+    expected = predict(con, *cleaned_example_tables)
+    by_partition = predict(
+        con,
+        *cleaned_example_tables,
+        output_dir=str(tmp_path),
+        fuse_blocking_and_scoring=fuse_blocking_and_scoring,
+    )
+    assert by_partition == expected
+    assert not os.path.exists(tmp_path / "__partitions")
+
+
+def test_predicting_by_partition_with_no_pairs(con, example_tables, tmp_path):
+    # With an invalid postcode and no very unusual tokens, a record has no
+    # partition key for any group of blocking rules
+    sql = """
+    create table no_postcodes as
+    select * replace ('NOT A POSTCODE' as postcode) from to_match
+    """
+    con.execute(sql)
+    left, right = clean(con, "no_postcodes"), clean(con, "search_within")
+    sql = f"""
+    delete from {left}
+    where list_extract(very_unusual_tokens_arr, 1) is not null
+    """
+    con.execute(sql)
+    assert con.table(left).count("*").fetchall()[0][0] > 0
+
+    _, expected = _performance_predict(
+        df_addresses_to_match=left,
+        df_addresses_to_search_within=right,
+        con=con,
+        match_weight_threshold=None,
+    )
+    expected_columns = expected.columns
+    assert expected.count("*").fetchall() == [(0,)]
+
+    _, predictions = _performance_predict(
+        df_addresses_to_match=left,
+        df_addresses_to_search_within=right,
+        con=con,
+        match_weight_threshold=None,
+        output_dir=str(tmp_path),
+    )
+    assert predictions.columns == expected_columns
+    assert predictions.count("*").fetchall() == [(0,)]
+    assert os.listdir(tmp_path) == ["predictions_empty.parquet"]
+
+
+def test_row_keys_do_not_depend_on_input_order(con, cleaned_example_tables):
+    def row_keys():
+        sql = """
+        select 'left', unique_id, _row_key from __addresses_to_match_with_tf
+        union all
+        select 'right', unique_id, _row_key from __addresses_to_search_within_with_tf
+        """
+        return sorted(con.sql(sql).fetchall())
+
+    expected_predictions = predict(con, *cleaned_example_tables)
+    expected = row_keys()
+
+    for table_name in cleaned_example_tables:
+        sql = f"""
+        create table {table_name}_shuffled as
+        select * from {table_name} order by hash(unique_id)
+        """
+        con.execute(sql)
+    shuffled = [f"{table_name}_shuffled" for table_name in cleaned_example_tables]
+    assert predict(con, *shuffled) == expected_predictions
+    assert row_keys() == expected
+
+
+def test_row_keys_are_numbered_when_hashes_collide(
+    con, cleaned_example_tables, monkeypatch
+):
+    from uk_address_matcher import splink_model
+
+    expected = predict(con, *cleaned_example_tables)
+    monkeypatch.setattr(splink_model, "_HASHED_ROW_KEY_SQL", "0::BIGINT")
+    assert predict(con, *cleaned_example_tables) == expected
+
+    sql = """
+    select count(distinct _row_key) = count(*), min(_row_key), max(_row_key)
+    from __addresses_to_search_within_with_tf
+    """
+    num_rows = con.table(cleaned_example_tables[1]).count("*").fetchall()[0][0]
+    assert con.sql(sql).fetchall() == [(True, 1, num_rows)]
+
+
+def _prepared_unique_ids(con, path):
+    con.execute(f"attach '{path}' as prepared (READ_ONLY)")
+    unique_ids = con.sql("select unique_id from prepared.addresses").fetchall()
+    con.execute("detach prepared")
+    return sorted(unique_ids)
+
+
+def test_prepared_search_within_is_prepared_again_when_input_changes(
+    con, example_tables, tmp_path
+):
+    path = str(tmp_path / "search_within.duckdb")
+    sql = """
+    create table changing as
+    select * from search_within order by unique_id offset 2
+    """
+    con.execute(sql)
+    first, second = con.sql(
+        "select unique_id from search_within order by unique_id limit 2"
+    ).fetchall()
+
+    # Rows a, b, b and a, c, c have the same count and bit_xor of hashes
+    insert_twice_sql = """
+    insert into changing
+    select s.* from search_within as s, range(2) where unique_id = $unique_id
+    """
+    con.execute(insert_twice_sql, {"unique_id": first[0]})
+    prepare_search_within_table("changing", con=con, path=path)
+    expected = _prepared_unique_ids(con, path)
+    assert expected.count(first) == 2
+
+    # An unchanged input is not prepared again, so a row deleted from the
+    # prepared table stays deleted
+    con.execute(f"attach '{path}' as prepared")
+    con.execute("delete from prepared.addresses where unique_id = $1", first)
+    con.execute("detach prepared")
+    prepare_search_within_table("changing", con=con, path=path)
+    assert first not in _prepared_unique_ids(con, path)
+
+    con.execute("delete from changing where unique_id = $1", first)
+    con.execute(insert_twice_sql, {"unique_id": second[0]})
+    prepare_search_within_table("changing", con=con, path=path)
+    prepared = _prepared_unique_ids(con, path)
+    assert first not in prepared
+    assert prepared.count(second) == 2
+
+
+def test_predicting_with_each_prepared_search_within(con, example_tables, tmp_path):
+    left = clean(con, "to_match")
+    sql = """
+    create table half as
+    select * from search_within where hash(unique_id) % 2 = 0
+    """
+    con.execute(sql)
+
+    for table_name in ["search_within", "half"]:
+        path = str(tmp_path / f"{table_name}.duckdb")
+        prepare_search_within_table(table_name, con=con, path=path)
+        expected = predict(con, left, clean(con, table_name))
+        assert len(expected) > 0
+        assert predict(con, left, path) == expected
+
+        # The returned linker can still read the prepared addresses, and only the
+        # file of the latest call is attached
+        linker, _ = _performance_predict(
+            df_addresses_to_match=left,
+            df_addresses_to_search_within=path,
+            con=con,
+            match_weight_threshold=None,
+        )
+        # Splink orders the sides of each pair by source_dataset
+        splink_predictions = linker.predict().as_pandas_dataframe()
+        splink_pairs = set(
+            map(
+                frozenset,
+                zip(
+                    splink_predictions["unique_id_l"],
+                    splink_predictions["unique_id_r"],
+                ),
+            )
+        )
+        assert {frozenset((l, r)) for l, r, _, _ in expected} <= splink_pairs
+        sql = "select path from duckdb_databases() where path like '%.duckdb'"
+        assert con.sql(sql).fetchall() == [(path,)]
+
+
+def test_prepared_search_within_uses_input_version_as_fingerprint(
+    con, example_tables, tmp_path
+):
+    path = str(tmp_path / "search_within.duckdb")
+    con.execute("create table changing as select * from search_within")
+    unique_id = con.sql("select min(unique_id) from changing").fetchall()[0][0]
+
+    prepare_search_within_table("changing", con=con, path=path, input_version="1")
+    expected = _prepared_unique_ids(con, path)
+    assert (unique_id,) in expected
+
+    # Changes to the input are only picked up when the version changes
+    con.execute("delete from changing where unique_id = $1", [unique_id])
+    prepare_search_within_table("changing", con=con, path=path, input_version="1")
+    assert _prepared_unique_ids(con, path) == expected
+    prepare_search_within_table("changing", con=con, path=path, input_version="2")
+    assert (unique_id,) not in _prepared_unique_ids(con, path)
+
+
+def test_pretrained_linker_predicts_without_postcode_codes(con, cleaned_example_tables):
+    # The bundled model blocks on postcode strings, so it can still predict on
+    # addresses cleaned before the postcode codes were added
+    codes = "postcode_is_valid, " + ", ".join(
+        f"postcode_{part}_code"
+        for part in ["area", "district", "sector", "inward", "unit"]
+    )
+    left, right = (
+        con.table(table_name).select(f"* exclude ({codes})")
+        for table_name in cleaned_example_tables
+    )
+    linker = get_pretrained_linker(
+        left, right, con=con, include_full_postcode_block=True
+    )
+    predictions = linker.predict().as_pandas_dataframe()
+    splink_pairs = set(zip(predictions["unique_id_l"], predictions["unique_id_r"]))
+
+    # The fast path finds a subset of them, since it skips some rules
+    fast_path_pairs = {
+        (unique_id_l, unique_id_r)
+        for unique_id_l, unique_id_r, _, _ in predict(con, *cleaned_example_tables)
+    }
+    assert len(fast_path_pairs) > 0
+    assert fast_path_pairs <= splink_pairs
+
+
+def test_log2_token_frequencies_give_same_predictions(
+    con, example_tables, cleaned_example_tables
+):
+    expected = predict(con, *cleaned_example_tables)
+    assert len(expected) > 0
+    left, right = (
+        clean(con, t, use_log2_token_frequencies=True) for t in example_tables
+    )
+    assert predict(con, left, right, use_log2_token_frequencies=True) == expected
+
+
+# Token frequencies for the left and right addresses of a pair whose
+# token_rel_freq_arr comparison lands exactly on one of its thresholds, including
+# through a product of frequencies and through the non-agreement punishment
+_TIED_TOKEN_FREQUENCIES = [
+    ([0.01], [0.01]),
+    ([1e-4], [1e-4]),
+    ([1e-20], [1e-20]),
+    ([0.01, 0.01], [0.01, 0.01]),
+    ([0.1, 0.1], [0.1, 0.1]),
+    ([0.2, 0.05], [0.2, 0.05]),
+    ([0.01, 1.0], [0.01]),
+]
+
+
+def test_log2_token_frequencies_give_same_predictions_at_thresholds(
+    con, cleaned_example_tables
+):
+    from uk_address_matcher.cleaning import convert_token_rel_freq_to_log2
+
+    left, right = cleaned_example_tables
+    pairs = predict(con, left, right)
+    tied_pairs = []
+    for unique_id_l, unique_id_r, _, _ in pairs:
+        used = {unique_id for pair in tied_pairs for unique_id in pair}
+        if unique_id_l not in used and unique_id_r not in used:
+            tied_pairs.append((unique_id_l, unique_id_r))
+    assert len(tied_pairs) >= len(_TIED_TOKEN_FREQUENCIES) + 1
+
+    def set_frequencies(table_name, unique_id, column, rel_freqs):
+        tokens = ", ".join(
+            f"{{'tok': 'TIE{i}', 'rel_freq': {rel_freq!r}::DOUBLE}}"
+            for i, rel_freq in enumerate(rel_freqs)
+        )
+        sql = f"""
+        update {table_name} set {column} = [{tokens}] where unique_id = $unique_id
+        """
+        con.execute(sql, {"unique_id": unique_id})
+
+    for (unique_id_l, unique_id_r), (freqs_l, freqs_r) in zip(
+        tied_pairs, _TIED_TOKEN_FREQUENCIES
+    ):
+        set_frequencies(left, unique_id_l, "token_rel_freq_arr", freqs_l)
+        set_frequencies(right, unique_id_r, "token_rel_freq_arr", freqs_r)
+
+    # common_end_tokens has a single threshold, at 1e-2
+    unique_id_l, unique_id_r = tied_pairs[len(_TIED_TOKEN_FREQUENCIES)]
+    set_frequencies(left, unique_id_l, "common_end_tokens", [0.01])
+    set_frequencies(right, unique_id_r, "common_end_tokens", [0.01])
+
+    expected = predict(con, left, right)
+    log2_tables = []
+    for table_name in cleaned_example_tables:
+        log2 = convert_token_rel_freq_to_log2(con.table(table_name), con)
+        con.execute(f"create table {table_name}_log2 as select * from log2")
+        log2_tables.append(f"{table_name}_log2")
+    assert predict(con, *log2_tables, use_log2_token_frequencies=True) == expected
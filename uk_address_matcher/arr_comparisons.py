@@ -1,3 +1,6 @@
+import math
+
+
 def array_reduce_by_freq(
     token_rel_freq_array_name, nonagreement_punishment_weight=0.33
 ):
@@ -65,6 +68,300 @@ def array_reduce_by_freq(
         return calc_tf_sql
 
 
+def token_list_columns_sql(token_rel_freq_array_name):
+    # Selects the tokens of the left and right arrays as {name}_toks_l and
+    # {name}_toks_r, for the comparison functions below to read when called with
+    # token_lists_precomputed=True.  Otherwise they extract the tokens inside their
+    # filter lambdas, i.e. once per token rather than once per pair
+    name = token_rel_freq_array_name
+    return (
+        f"list_transform({name}_l, x -> x.tok) as {name}_toks_l, "
+        f"list_transform({name}_r, x -> x.tok) as {name}_toks_r"
+    )
+
+
+def _token_lists_sql(token_rel_freq_array_name, token_lists_precomputed):
+    # The SQL for the tokens of the left and right arrays
+    name = token_rel_freq_array_name
+    if token_lists_precomputed:
+        return f"{name}_toks_l", f"{name}_toks_r"
+    return (
+        f"list_transform({name}_l, x -> x.tok)",
+        f"list_transform({name}_r, x -> x.tok)",
+    )
+
+
+def array_reduce_by_freq_using_list_contains(
+    token_rel_freq_array_name,
+    nonagreement_punishment_weight=0.33,
+    token_lists_precomputed=False,
+):
+    # Gives exactly the same result as array_reduce_by_freq, multiplying the same
+    # frequencies in the same order, but much faster.
+    # array_reduce_by_freq recomputes the intersection of the two token lists
+    # inside the filter lambda, i.e. once per token.  Since every token in the left
+    # array is in the left token list, a token is in the intersection if and only
+    # if it is in the right token list, so it's enough to test that directly.
+    # If token_lists_precomputed is True, the token lists are read from the
+    # columns selected by token_list_columns_sql
+    toks_l, toks_r = _token_lists_sql(
+        token_rel_freq_array_name, token_lists_precomputed
+    )
+
+    calc_tf_sql = f"""
+    list_reduce(
+        list_prepend(
+            1.0,
+            list_transform(
+                list_filter(
+                    {token_rel_freq_array_name}_l,
+                    y -> list_contains({toks_r}, y.tok)
+                ),
+                x -> x.rel_freq
+            )
+        ),
+        (p, q) -> p * q
+    )
+    """
+
+    punish = f"""
+    list_reduce(
+        list_prepend(
+            1.0,
+            list_transform(
+                list_concat(
+                    list_filter(
+                        {token_rel_freq_array_name}_l,
+                        y -> not list_contains({toks_r}, y.tok)
+                    ),
+                    list_filter(
+                        {token_rel_freq_array_name}_r,
+                        y -> not list_contains({toks_l}, y.tok)
+                    )
+                ),
+                x -> x.rel_freq
+            )
+        ),
+        (p, q) -> p / q^{nonagreement_punishment_weight}
+    )
+    """
+    if nonagreement_punishment_weight > 0.0:
+        return f"{calc_tf_sql} *  {punish}"
+    else:
+        return calc_tf_sql
+
+
+def array_reduce_by_log2_freq(
+    token_log2_freq_array_name,
+    nonagreement_punishment_weight=0.33,
+    token_lists_precomputed=False,
+):
+    # The same calculation as array_reduce_by_freq_using_list_contains, but for
+    # token arrays whose structs hold log2_rel_freq rather than rel_freq (see
+    # cleaning.convert_token_rel_freq_to_log2), so the result is the log2 of
+    # array_reduce_by_freq's.  Products become sums and the punishment power
+    # becomes a multiplication, so there are no pow calls and no risk of
+    # underflow on long addresses.
+    # list_sum of an empty list is null, hence the coalesce to log2(1.0) = 0
+    toks_l, toks_r = _token_lists_sql(
+        token_log2_freq_array_name, token_lists_precomputed
+    )
+
+    calc_tf_sql = f"""
+    coalesce(
+        list_sum(
+            list_transform(
+                list_filter(
+                    {token_log2_freq_array_name}_l,
+                    y -> list_contains({toks_r}, y.tok)
+                ),
+                x -> x.log2_rel_freq
+            )
+        ),
+        0.0
+    )
+    """
+
+    punish = f"""
+    coalesce(
+        list_sum(
+            list_transform(
+                list_concat(
+                    list_filter(
+                        {token_log2_freq_array_name}_l,
+                        y -> not list_contains({toks_r}, y.tok)
+                    ),
+                    list_filter(
+                        {token_log2_freq_array_name}_r,
+                        y -> not list_contains({toks_l}, y.tok)
+                    )
+                ),
+                x -> x.log2_rel_freq
+            )
+        ),
+        0.0
+    )
+    """
+    if nonagreement_punishment_weight > 0.0:
+        return f"{calc_tf_sql} - {nonagreement_punishment_weight} * {punish}"
+    else:
+        return calc_tf_sql
+
+
+def _segment_reduce(ufunc, values, lengths):
+    # Reduces each segment of values with ufunc, starting from 1.0, in order.
+    # Each segment is prefixed with a 1.0 so that empty segments reduce to 1.0,
+    # as list_reduce(list_prepend(1.0, ...)) does
+    import numpy as np
+
+    starts = np.zeros(len(lengths), dtype="int64")
+    np.cumsum(lengths[:-1] + 1, out=starts[1:])
+    padded = np.ones(len(values) + len(lengths))
+    is_value = np.ones(len(padded), dtype=bool)
+    is_value[starts] = False
+    padded[is_value] = values
+    return ufunc.reduceat(padded, starts)
+
+
+def _array_reduce_by_freq_arrow(nonagreement_punishment_weight):
+    # Returns an Arrow UDF computing the same as
+    # array_reduce_by_freq_using_list_contains, one batch of pairs at a time
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    def unpack(token_rel_freq_arrays):
+        if isinstance(token_rel_freq_arrays, pa.ChunkedArray):
+            token_rel_freq_arrays = token_rel_freq_arrays.combine_chunks()
+        lengths = pc.list_value_length(token_rel_freq_arrays).fill_null(0)
+        structs = token_rel_freq_arrays.flatten()
+        return (
+            lengths.to_numpy(),
+            structs.field("tok"),
+            structs.field("rel_freq").to_numpy(zero_copy_only=False),
+        )
+
+    def power(freqs):
+        # np.power's vectorised implementation can differ from the C library pow
+        # that DuckDB uses in the last bit, so use math.pow, once per distinct
+        # frequency
+        positions, distinct_freqs = pd.factorize(freqs)
+        powers = [math.pow(f, nonagreement_punishment_weight) for f in distinct_freqs]
+        return np.array(powers, dtype="float64")[positions]
+
+    def reduce_by_freq(token_rel_freq_arrays_l, token_rel_freq_arrays_r):
+        lengths_l, toks_l, freqs_l = unpack(token_rel_freq_arrays_l)
+        lengths_r, toks_r, freqs_r = unpack(token_rel_freq_arrays_r)
+        num_pairs = len(lengths_l)
+
+        # Give each token an integer code, and combine it with the number of the
+        # pair it came from, so that membership of every token in the other side
+        # of its pair can be tested for the whole batch at once
+        toks = pa.concat_arrays([toks_l, toks_r]).dictionary_encode()
+        codes = toks.indices.to_numpy(zero_copy_only=False).astype("int64")
+        num_codes = max(len(toks.dictionary), 1)
+        pair_l = np.repeat(np.arange(num_pairs, dtype="int64"), lengths_l)
+        pair_r = np.repeat(np.arange(num_pairs, dtype="int64"), lengths_r)
+        keys_l = pair_l * num_codes + codes[: len(toks_l)]
+        keys_r = pair_r * num_codes + codes[len(toks_l) :]
+        l_in_r = pd.Series(keys_l).isin(keys_r).to_numpy()
+        r_in_l = pd.Series(keys_r).isin(keys_l).to_numpy()
+
+        # Multiplying or dividing by 1.0 is exact, so using 1.0 in place of tokens
+        # that are filtered out gives the same result as removing them
+        matched = np.where(l_in_r, freqs_l, 1.0)
+        result = _segment_reduce(np.multiply, matched, lengths_l)
+
+        if nonagreement_punishment_weight > 0.0:
+            punish_l = np.where(l_in_r, 1.0, power(freqs_l))
+            punish_r = np.where(r_in_l, 1.0, power(freqs_r))
+            # Order as list_concat would: the left tokens of each pair, then the
+            # right tokens
+            order = np.lexsort(
+                (
+                    np.repeat([0, 1], [len(pair_l), len(pair_r)]),
+                    np.concatenate([pair_l, pair_r]),
+                )
+            )
+            punish = np.concatenate([punish_l, punish_r])[order]
+            result = result * _segment_reduce(np.divide, punish, lengths_l + lengths_r)
+
+        is_null = pc.or_(
+            token_rel_freq_arrays_l.is_null(), token_rel_freq_arrays_r.is_null()
+        )
+        return pa.array(result, mask=is_null.to_numpy(zero_copy_only=False))
+
+    return reduce_by_freq
+
+
+def array_reduce_by_freq_using_arrow_udf(
+    con,
+    token_rel_freq_array_name,
+    token_rel_freq_array_type,
+    nonagreement_punishment_weight=0.33,
+):
+    # Registers a vectorised (Arrow) UDF on con which computes the same as
+    # array_reduce_by_freq_using_list_contains, bit for bit, using NumPy on whole
+    # batches of pairs rather than evaluating nested lambdas pair by pair.
+    # Returns the SQL to call it.
+    # token_rel_freq_array_type is the DuckDB type of the array column, so the UDF
+    # accepts either string tokens or integer token IDs.  Requires pandas and
+    # pyarrow.
+    import duckdb
+    from duckdb.typing import DOUBLE
+
+    udf_name = f"__array_reduce_by_freq_{token_rel_freq_array_name}"
+    try:
+        con.remove_function(udf_name)
+    except duckdb.InvalidInputException:
+        pass
+
+    con.create_function(
+        udf_name,
+        _array_reduce_by_freq_arrow(nonagreement_punishment_weight),
+        [token_rel_freq_array_type, token_rel_freq_array_type],
+        DOUBLE,
+        type="arrow",
+        null_handling="special",
+    )
+    return f"{udf_name}({token_rel_freq_array_name}_l, {token_rel_freq_array_name}_r)"
+
+
+def array_reduce_by_freq_using_engine(
+    engine,
+    con,
+    table_name,
+    token_rel_freq_array_name,
+    nonagreement_punishment_weight=0.33,
+    token_lists_precomputed=False,
+):
+    # Returns the SQL for the token frequency comparison using the chosen engine:
+    # "sql" for array_reduce_by_freq_using_list_contains, or "arrow" for
+    # array_reduce_by_freq_using_arrow_udf.  Both give identical results, but
+    # which is faster depends on the machine.
+    # table_name is a table holding token_rel_freq_array_name, from which the type
+    # of the arrays is read.  token_lists_precomputed is as for
+    # array_reduce_by_freq_using_list_contains, and unused by the arrow engine
+    if engine == "sql":
+        return array_reduce_by_freq_using_list_contains(
+            token_rel_freq_array_name,
+            nonagreement_punishment_weight,
+            token_lists_precomputed,
+        )
+    if engine == "arrow":
+        array_type = con.table(table_name).select(token_rel_freq_array_name).types[0]
+        return array_reduce_by_freq_using_arrow_udf(
+            con,
+            token_rel_freq_array_name,
+            array_type,
+            nonagreement_punishment_weight,
+        )
+    raise ValueError(
+        f"Unknown token comparison engine {engine!r}, must be 'sql' or 'arrow'"
+    )
+
+
 # Alt implementation that turns out to be much slower, I'm not sure why
 # def array_reduce_by_freq(
 #     token_rel_freq_array_name, nonagreement_punishment_weight=0.33
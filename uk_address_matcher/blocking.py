@@ -0,0 +1,286 @@
+import re
+from typing import Collection, List, Optional, Tuple
+
+
+def _pair_columns_sql(id_columns: List[str]) -> str:
+    # e.g. "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS ...
+    return ", ".join(
+        f'"{side}"."{col}" AS "{col}_{side}"' for col in id_columns for side in "lr"
+    )
+
+
+def _pair_column_names_sql(id_columns: List[str]) -> str:
+    return ", ".join(f'"{col}_{side}"' for col in id_columns for side in "lr")
+
+
+def compile_blocking_sql(
+    blocking_rules: List[str],
+    *,
+    left_table: str,
+    right_table: str,
+    id_columns: List[str],
+    skipped_rules: Collection[str] = (),
+    deduplication: str = "min_match_key",
+    columns_sql: Optional[str] = None,
+) -> str:
+    """
+    Compile a list of Splink blocking rules into a single select statement that
+    returns one row per candidate pair.
+
+    Each rule becomes an inner join of left_table (aliased l) to right_table
+    (aliased r) on the rule, and the joins are combined with UNION ALL.  The
+    match_key of a pair is the position of the rule that found it, as a string,
+    as in Splink.
+
+    A pair may be found by several rules.  With deduplication="min_match_key" the
+    pairs from all rules are grouped and the lowest match_key is kept, so each
+    rule costs one join regardless of how many rules precede it.  With
+    deduplication="exclude_previous_rules" each rule instead excludes the pairs
+    found by every earlier rule, as Splink does, which re-evaluates every earlier
+    rule for every pair and so grows quadratically with the number of rules.
+
+    Rules in skipped_rules generate no pairs.  They keep their position, so
+    match_keys are the same whichever rules are skipped, and pairs they would have
+    found are still excluded from later rules, so both deduplication methods give
+    the same pairs.
+
+    Args:
+        blocking_rules (List[str]): The blocking rules, e.g. the
+            blocking_rules_to_generate_predictions of a Splink settings dict.
+        left_table (str): The name of the table or CTE of left records.
+        right_table (str): The name of the table or CTE of right records.
+        id_columns (List[str]): Columns identifying a record, which are output
+            with _l and _r suffixes, e.g. ["source_dataset", "unique_id"].
+        skipped_rules (Collection[str], optional): Rules to generate no pairs
+            from. Defaults to ().
+        deduplication (str, optional): "min_match_key" or
+            "exclude_previous_rules". Defaults to "min_match_key".
+        columns_sql (str, optional): If given, the columns to output for each
+            pair in place of the id_columns, as SQL in terms of l and r.  Only
+            supported with "exclude_previous_rules", since pairs are not grouped.
+            Defaults to None.
+
+    Returns:
+        str: A select statement with columns for each id_column on each side, or
+            columns_sql, followed by match_key.
+    """
+    if deduplication not in ("min_match_key", "exclude_previous_rules"):
+        raise ValueError(
+            "deduplication must be 'min_match_key' or 'exclude_previous_rules', "
+            f"got {deduplication!r}"
+        )
+    if columns_sql is not None and deduplication != "exclude_previous_rules":
+        raise ValueError(
+            "columns_sql can only be used with deduplication='exclude_previous_rules'"
+        )
+
+    pair_columns = columns_sql or _pair_columns_sql(id_columns)
+
+    branches = []
+    for match_key, rule in enumerate(blocking_rules):
+        if rule in skipped_rules:
+            continue
+
+        if deduplication == "min_match_key":
+            match_key_sql = f"{match_key} as match_key"
+            excluded_rules = [
+                r for r in blocking_rules[:match_key] if r in skipped_rules
+            ]
+        else:
+            match_key_sql = f"'{match_key}' as match_key"
+            excluded_rules = blocking_rules[:match_key]
+
+        where_sql = ""
+        if excluded_rules:
+            excluded_sql = " OR ".join(
+                f"coalesce(({excluded_rule}),false)" for excluded_rule in excluded_rules
+            )
+            where_sql = f"where NOT ({excluded_sql})"
+
+        branch_sql = f"""
+        select {pair_columns}, {match_key_sql}
+        from {left_table} as l
+        inner join {right_table} as r
+        on ({rule})
+        {where_sql}
+        """
+        branches.append(branch_sql)
+
+    if not branches:
+        raise ValueError("At least one blocking rule must generate pairs")
+
+    union_sql = "\nUNION ALL\n".join(branches)
+    if deduplication == "exclude_previous_rules":
+        return union_sql
+
+    pair_column_names = _pair_column_names_sql(id_columns)
+
+    # A single join cannot produce the same pair twice, so needs no grouping
+    if len(branches) == 1:
+        return f"""
+        select {pair_column_names}, match_key::VARCHAR as match_key
+        from ({union_sql})
+        """
+
+    return f"""
+    select {pair_column_names}, min(match_key)::VARCHAR as match_key
+    from ({union_sql})
+    group by {pair_column_names}
+    """
+
+
+def _blocking_rule_keys(rule: str) -> List[Tuple[str, str]]:
+    # Splits a blocking rule of the form "l.a = r.b and f(l.c) = f(r.d)" into its
+    # (left expression, right expression) pairs
+    keys = []
+    for condition in re.split(r"\s+and\s+", rule.strip(), flags=re.IGNORECASE):
+        sides = condition.split(" = ")
+        if len(sides) == 2:
+            left_sql, right_sql = (side.strip() for side in sides)
+            if re.search(r"\br\.", left_sql) and re.search(r"\bl\.", right_sql):
+                left_sql, right_sql = right_sql, left_sql
+            if not re.search(r"\br\.", left_sql) and not re.search(r"\bl\.", right_sql):
+                keys.append((left_sql, right_sql))
+                continue
+        raise ValueError(
+            f"Cannot block on keys using the rule {rule!r}: every condition must be "
+            "an equality between an expression of l and an expression of r"
+        )
+    return keys
+
+
+def _key_hash_sql(expressions: List[str]) -> str:
+    # Null if any expression is null, since such a record would not match in a join
+    is_null_sql = " OR ".join(f"({e}) IS NULL" for e in expressions)
+    return f"CASE WHEN {is_null_sql} THEN NULL ELSE hash({', '.join(expressions)}) END"
+
+
+def _exploded_keys_sql(
+    table: str,
+    alias: str,
+    rule_keys: List[List[Tuple[str, str]]],
+    id_columns: List[str],
+    skipped_rule_ids: List[int],
+) -> str:
+    # One row per record and rule, with the hash of the record's key for the rule,
+    # plus the hashes of the record's keys for the skipped rules.  alias is "l" or
+    # "r", and says which side of each rule's equalities to use
+    side = 0 if alias == "l" else 1
+    id_columns_sql = ", ".join(f'"{col}"' for col in id_columns)
+    skipped_columns_sql = "".join(f", __skipped_{i}" for i in skipped_rule_ids)
+
+    # Every key is hashed in a single scan of the table.  Unpivoting the hashes
+    # with a projection per rule is much faster in DuckDB than unnesting a list of
+    # keys per record
+    key_hashes_sql = ", ".join(
+        f"{_key_hash_sql([k[side] for k in keys])} as "
+        + (f"__skipped_{i}" if i in skipped_rule_ids else f"__key_{i}")
+        for i, keys in enumerate(rule_keys)
+    )
+    branches = [f"""
+        select {id_columns_sql}{skipped_columns_sql}, {i} as rule_id,
+            __key_{i} as key_hash
+        from __key_hashes
+        where __key_{i} is not null
+        """ for i in range(len(rule_keys)) if i not in skipped_rule_ids]
+    union_sql = "\nUNION ALL\n".join(branches)
+    return f"""
+    with __key_hashes as materialized (
+        select {", ".join(f'{alias}."{col}"' for col in id_columns)}, {key_hashes_sql}
+        from {table} as {alias}
+    )
+    {union_sql}
+    """
+
+
+def compile_key_blocking_sql(
+    blocking_rules: List[str],
+    *,
+    left_table: str,
+    right_table: str,
+    id_columns: List[str],
+    skipped_rules: Collection[str] = (),
+) -> str:
+    """
+    As compile_blocking_sql, but finds the pairs for every rule with a single join.
+
+    Each rule must be a conjunction of equalities between an expression of l and
+    an expression of r.  Each record on each side emits one row per rule,
+    holding the rule's position and a hash of the record's side of the
+    equalities, and the two sides are joined once on (rule position, hash).
+    Each table is scanned once to hash every key, and the hashes are joined
+    with a single hash join, rather than scanning both tables and building a
+    hash table for every rule.  Pairs found by several rules keep the lowest
+    match_key.
+
+    Pairs that skipped rules would have found are excluded from later rules, as
+    in compile_blocking_sql, by comparing hashes of the skipped rules' keys.
+
+    The expressions compared by a rule must have the same type on both sides so
+    they hash alike.  A hash collision can produce a pair that the rules would
+    not; with 64 bit hashes this is vanishingly rare, and the pair is scored
+    like any other.
+
+    Args:
+        blocking_rules (List[str]): The blocking rules, e.g. the
+            blocking_rules_to_generate_predictions of a Splink settings dict.
+        left_table (str): The name of the table or CTE of left records.
+        right_table (str): The name of the table or CTE of right records.
+        id_columns (List[str]): Columns identifying a record, which are output
+            with _l and _r suffixes, e.g. ["source_dataset", "unique_id"].
+        skipped_rules (Collection[str], optional): Rules to generate no pairs
+            from. Defaults to ().
+
+    Returns:
+        str: A select statement with columns for each id_column on each side,
+            followed by match_key.
+    """
+    rule_keys = [_blocking_rule_keys(rule) for rule in blocking_rules]
+    skipped_rule_ids = [i for i, r in enumerate(blocking_rules) if r in skipped_rules]
+    if len(skipped_rule_ids) == len(blocking_rules):
+        raise ValueError("At least one blocking rule must generate pairs")
+
+    left_keys_sql = _exploded_keys_sql(
+        left_table, "l", rule_keys, id_columns, skipped_rule_ids
+    )
+    right_keys_sql = _exploded_keys_sql(
+        right_table, "r", rule_keys, id_columns, skipped_rule_ids
+    )
+
+    excluded_sql = " OR ".join(
+        f"coalesce(l.__skipped_{i} = r.__skipped_{i} and {i} < l.rule_id, false)"
+        for i in skipped_rule_ids
+    )
+    where_sql = f"where NOT ({excluded_sql})" if excluded_sql else ""
+
+    pair_column_names = _pair_column_names_sql(id_columns)
+    return f"""
+    select {pair_column_names}, min(match_key)::VARCHAR as match_key
+    from (
+        select {_pair_columns_sql(id_columns)}, l.rule_id as match_key
+        from ({left_keys_sql}) as l
+        inner join ({right_keys_sql}) as r
+        on l.rule_id = r.rule_id and l.key_hash = r.key_hash
+        {where_sql}
+    )
+    group by {pair_column_names}
+    """
+
+
+def salt_sql(id_columns: List[str], salting_partitions: int) -> str:
+    """
+    SQL for a salt from 1 to salting_partitions for each pair output by
+    compile_blocking_sql or compile_key_blocking_sql.
+
+    The salt is a hash of the pair's ids, so pairs are spread evenly across the
+    partitions but a pair gets the same salt on every run.
+
+    Args:
+        id_columns (List[str]): The id_columns passed when compiling the blocking
+            SQL.
+        salting_partitions (int): The number of partitions.
+
+    Returns:
+        str: A SQL expression.
+    """
+    return f"hash({_pair_column_names_sql(id_columns)}) % {salting_partitions} + 1"
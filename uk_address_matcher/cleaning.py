@@ -1,5 +1,8 @@
+import hashlib
 import importlib.resources as pkg_resources
+import weakref
 
+import duckdb
 from duckdb import DuckDBPyConnection, DuckDBPyRelation
 
 from .regexes import (
@@ -349,6 +352,86 @@ def add_term_frequencies_to_address_tokens_using_registered_df(
     return con.sql(sql)
 
 
+def _register_tok_rel_freq_lookup_udf(con: DuckDBPyConnection, udf_name: str) -> None:
+    # Imported here as these are only needed for the hash lookup
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from duckdb.typing import DOUBLE, VARCHAR
+
+    rel_tok_freq = con.table("rel_tok_freq").select("token, rel_freq").df()
+    # A pandas Index builds its hash table once, on first lookup, and then reuses it
+    # for every batch DuckDB passes to the UDF
+    token_index = pd.Index(rel_tok_freq["token"])
+    if not token_index.is_unique:
+        raise ValueError("Tokens in the rel_tok_freq table must be unique")
+
+    # Tokens not in the index get position -1, so the last element is the default
+    rel_freqs = np.append(rel_tok_freq["rel_freq"].to_numpy(dtype="float64"), 5e-5)
+
+    def lookup_rel_freqs(token_lists):
+        if isinstance(token_lists, pa.ChunkedArray):
+            token_lists = token_lists.combine_chunks()
+        tokens = token_lists.flatten()
+        positions = token_index.get_indexer(tokens.to_numpy(zero_copy_only=False))
+        structs = pa.StructArray.from_arrays(
+            [tokens, pa.array(rel_freqs[positions])], names=["tok", "rel_freq"]
+        )
+        offsets = pc.subtract(token_lists.offsets, token_lists.offsets[0])
+        return pa.ListArray.from_arrays(offsets, structs, mask=token_lists.is_null())
+
+    try:
+        con.remove_function(udf_name)
+    except duckdb.InvalidInputException:
+        pass
+
+    return_type = duckdb.list_type(
+        duckdb.struct_type({"tok": VARCHAR, "rel_freq": DOUBLE})
+    )
+    con.create_function(
+        udf_name,
+        lookup_rel_freqs,
+        [duckdb.list_type(VARCHAR)],
+        return_type,
+        type="arrow",
+    )
+
+
+def add_term_frequencies_to_address_tokens_using_hash_lookup(
+    ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
+) -> DuckDBPyRelation:
+    """
+    Produces the same token_rel_freq_arr as
+    add_term_frequencies_to_address_tokens_using_registered_df, but annotates each
+    token list in place using a vectorised (Arrow) UDF that looks tokens up in a
+    hash index of the registered rel_tok_freq table, rather than exploding the
+    tokens, joining, regrouping and joining back on unique_id.
+
+    Requires pandas and pyarrow.
+
+    Args:
+        ddb_pyrel (DuckDBPyRelation): The relation to process.
+        con (DuckDBPyConnection): The DuckDB connection.
+
+    Returns:
+        DuckDBPyRelation: The modified table with token_rel_freq_arr in place of
+            address_without_numbers_tokenised.
+    """
+    _register_tok_rel_freq_lookup_udf(con, "__tok_rel_freq_lookup")
+
+    # The explode/regroup implementation drops rows with no tokens, so do the same
+    sql = """
+    select
+        * exclude (address_without_numbers_tokenised),
+        __tok_rel_freq_lookup(address_without_numbers_tokenised)
+            as token_rel_freq_arr
+    from ddb_pyrel
+    where len(address_without_numbers_tokenised) > 0
+    """
+    return con.sql(sql)
+
+
 def first_unusual_token(
     ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
 ) -> DuckDBPyRelation:
@@ -389,6 +472,123 @@ def use_first_unusual_token_if_no_numeric_token(
     return con.sql(sql)
 
 
+# Characters which may appear in a postcode, in the order used to encode them
+_POSTCODE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+_VALID_POSTCODE_REGEX = "^[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}$"
+
+# Looser than the parts of _VALID_POSTCODE_REGEX, so partial postcodes like 'SW1A'
+# and non-standard ones like 'GIR 0AA' still get codes for the parts they have
+_VALID_OUTWARD_CODE_REGEX = "^[A-Z][A-Z0-9]{1,3}$"
+_VALID_INWARD_CODE_REGEX = "^[0-9][A-Z]{2}$"
+
+
+def _postcode_component_code_sql(component_sql: str) -> str:
+    # Reads the component as a bijective base-37 number, with each character worth
+    # its 1-based position in _POSTCODE_ALPHABET.  Since no character is worth zero
+    # this gives a distinct integer for every distinct string, so comparing codes
+    # is equivalent to comparing the strings
+    return f"""
+    list_reduce(
+        list_transform(
+            str_split({component_sql}, ''),
+            c -> instr('{_POSTCODE_ALPHABET}', c)
+        ),
+        (code, c) -> code * 37 + c
+    )
+    """
+
+
+def add_postcode_components(
+    ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
+) -> DuckDBPyRelation:
+    """
+    Validates the postcode and adds its components as integer codes, so that
+    blocking on part of a postcode is an equi-join on a small precomputed integer
+    rather than calling split_part on both sides of every join.
+
+    Whitespace is removed before validation, so a postcode missing its space, like
+    'CM112HL', is treated as 'CM11 2HL'.  Where the postcode is not a valid UK
+    postcode, postcode_is_valid is false and its outward and inward codes are
+    taken from either side of its first space, so a partial postcode like 'SW1A'
+    or a non-standard one like 'GIR 0AA' is still blocked on the parts it has.
+    Codes for parts which do not look like an outward or inward code are null.
+
+    For a postcode like 'SW1A 1AA' the codes are for:
+    - postcode_area_code: SW
+    - postcode_district_code: SW1A (the outward code)
+    - postcode_sector_code: SW1A 1
+    - postcode_inward_code: 1AA
+    - postcode_unit_code: SW1A 1AA (the full postcode)
+
+    Args:
+        ddb_pyrel (DuckDBPyRelation): The input relation.
+        con (DuckDBPyConnection): The DuckDB connection.
+
+    Returns:
+        DuckDBPyRelation: The input relation with postcode_is_valid and the five
+            postcode codes added.
+    """
+    area = _postcode_component_code_sql("regexp_extract(__outward, '^[A-Z]+')")
+    district = _postcode_component_code_sql("__outward")
+    sector = _postcode_component_code_sql("__outward || left(__inward, 1)")
+    inward = _postcode_component_code_sql("__inward")
+    unit = _postcode_component_code_sql("__outward || __inward")
+
+    # As in classify_unusual_tokens, the input is registered under an alias so the
+    # CTE cannot be rebound to the wrong relation by run_pipeline
+    con.register("ddb_pyrel_alias4", ddb_pyrel)
+    sql = f"""
+    with normalised as (
+        select
+            *,
+            regexp_replace(postcode, '\\s', '', 'g') as __pc
+        from ddb_pyrel_alias4
+    ),
+    validated as (
+        select
+            *,
+            coalesce(regexp_matches(__pc, '{_VALID_POSTCODE_REGEX}'), false)
+                as postcode_is_valid
+        from normalised
+    ),
+    split as (
+        select
+            *,
+            case
+                when postcode_is_valid then left(__pc, length(__pc) - 3)
+                else split_part(trim(postcode), ' ', 1)
+            end as __outward,
+            case
+                when postcode_is_valid then right(__pc, 3)
+                else split_part(trim(postcode), ' ', 2)
+            end as __inward
+        from validated
+    ),
+    checked as (
+        select
+            *,
+            coalesce(regexp_matches(__outward, '{_VALID_OUTWARD_CODE_REGEX}'), false)
+                as __outward_is_valid,
+            coalesce(regexp_matches(__inward, '{_VALID_INWARD_CODE_REGEX}'), false)
+                as __inward_is_valid
+        from split
+    )
+    select
+        * exclude (__pc, __outward, __inward, __outward_is_valid, __inward_is_valid),
+        case when __outward_is_valid then {area} end::INTEGER as postcode_area_code,
+        case when __outward_is_valid then {district} end::INTEGER
+            as postcode_district_code,
+        case when __outward_is_valid and __inward_is_valid then {sector} end::INTEGER
+            as postcode_sector_code,
+        case when __inward_is_valid then {inward} end::INTEGER as postcode_inward_code,
+        case when __outward_is_valid and __inward_is_valid then {unit} end::BIGINT
+            as postcode_unit_code
+    from checked
+    """
+    return con.sql(sql)
+
+
 def final_column_order(
     ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
 ) -> DuckDBPyRelation:
@@ -422,6 +622,234 @@ def final_column_order(
     return con.sql(sql)
 
 
+_bundled_token_index = None
+
+
+def _get_bundled_token_index():
+    # Tokens from the bundled address_token_frequencies.parquet, most common first,
+    # so that a token's ID is its position in this index plus one
+    global _bundled_token_index
+    if _bundled_token_index is None:
+        import pandas as pd
+
+        with pkg_resources.path(
+            "uk_address_matcher.data", "address_token_frequencies.parquet"
+        ) as parquet_path:
+            sql = f"""
+            select token
+            from read_parquet('{parquet_path}')
+            order by rel_freq desc, token
+            """
+            con = duckdb.connect()
+            tokens = con.sql(sql).df()["token"]
+            con.close()
+        _bundled_token_index = pd.Index(tokens)
+    return _bundled_token_index
+
+
+def _out_of_vocab_token_id(token: str) -> int:
+    # A negative ID from a fixed 64 bit hash of the token, so it cannot clash with
+    # a bundled token.  The IDs are stored in prepared search tables and cleaning
+    # caches, so must not change between library versions
+    digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+    return -(int.from_bytes(digest, "little") >> 1) - 1
+
+
+def _register_token_id_udf(con: DuckDBPyConnection, udf_name: str) -> None:
+    # Imported here as these are only needed when encoding token IDs
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from duckdb.typing import BIGINT, VARCHAR
+
+    token_index = _get_bundled_token_index()
+
+    def lookup_token_ids(token_lists):
+        if isinstance(token_lists, pa.ChunkedArray):
+            token_lists = token_lists.combine_chunks()
+        flat_tokens = token_lists.flatten()
+        tokens = flat_tokens.to_numpy(zero_copy_only=False)
+        is_null = flat_tokens.is_null().to_numpy(zero_copy_only=False)
+        ids = token_index.get_indexer(tokens).astype("int64") + 1
+
+        # Tokens not in the bundled table are hashed once per distinct token
+        out_of_vocab = (ids == 0) & ~is_null
+        if out_of_vocab.any():
+            oov_tokens, inverse = np.unique(
+                tokens[out_of_vocab].astype(object), return_inverse=True
+            )
+            oov_ids = np.array(
+                [_out_of_vocab_token_id(t) for t in oov_tokens], dtype="int64"
+            )
+            ids[out_of_vocab] = oov_ids[inverse]
+
+        offsets = pc.subtract(token_lists.offsets, token_lists.offsets[0])
+        return pa.ListArray.from_arrays(
+            offsets,
+            pa.array(ids, pa.int64(), mask=is_null),
+            mask=token_lists.is_null(),
+        )
+
+    try:
+        con.remove_function(udf_name)
+    except duckdb.InvalidInputException:
+        pass
+
+    con.create_function(
+        udf_name,
+        lookup_token_ids,
+        [duckdb.list_type(VARCHAR)],
+        duckdb.list_type(BIGINT),
+        type="arrow",
+    )
+
+
+def encode_token_ids(
+    ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
+) -> DuckDBPyRelation:
+    """
+    Replaces each token in token_rel_freq_arr, common_end_tokens,
+    unusual_tokens_arr, very_unusual_tokens_arr and extremely_unusual_tokens_arr
+    with an integer ID, so that scoring compares BIGINTs rather than strings.
+
+    IDs are positions in the bundled address_token_frequencies.parquet, ordered by
+    descending rel_freq, so they are the same for every dataset and every run.
+    Tokens not in the bundled table are given a negative ID from a fixed 64 bit
+    hash (BLAKE2b) of the token, which does not depend on the library versions
+    installed.  The _readable columns keep the original tokens.
+
+    Must run after final_column_order, and both datasets being matched must be
+    encoded.  Requires pandas and pyarrow.
+
+    Args:
+        ddb_pyrel (DuckDBPyRelation): The relation to process.
+        con (DuckDBPyConnection): The DuckDB connection.
+
+    Returns:
+        DuckDBPyRelation: The relation with token IDs in place of tokens.
+    """
+    _register_token_id_udf(con, "__token_ids")
+
+    sql = """
+    with with_ids as (
+        select
+            *,
+            __token_ids(list_transform(token_rel_freq_arr, x -> x.tok))
+                as __token_rel_freq_arr_ids,
+            __token_ids(list_transform(common_end_tokens, x -> x.tok))
+                as __common_end_tokens_ids
+        from ddb_pyrel
+    )
+    select
+        * exclude (__token_rel_freq_arr_ids, __common_end_tokens_ids)
+        replace (
+            list_transform(
+                token_rel_freq_arr,
+                (x, i) -> struct_pack(
+                    tok := __token_rel_freq_arr_ids[i], rel_freq := x.rel_freq
+                )
+            ) as token_rel_freq_arr,
+            list_transform(
+                common_end_tokens,
+                (x, i) -> struct_pack(
+                    tok := __common_end_tokens_ids[i], rel_freq := x.rel_freq
+                )
+            ) as common_end_tokens,
+            __token_ids(unusual_tokens_arr) as unusual_tokens_arr,
+            __token_ids(very_unusual_tokens_arr) as very_unusual_tokens_arr,
+            __token_ids(extremely_unusual_tokens_arr) as extremely_unusual_tokens_arr
+        )
+    from with_ids
+    """
+    return con.sql(sql)
+
+
+def convert_token_rel_freq_to_log2(
+    ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
+) -> DuckDBPyRelation:
+    """
+    Replaces rel_freq in the token_rel_freq_arr and common_end_tokens structs with
+    log2_rel_freq, stored as a FLOAT, for use with scoring in log space (see
+    arr_comparisons.array_reduce_by_log2_freq).  This halves the size of the
+    frequencies and means scoring sums rather than multiplies them.  Comparisons
+    landing exactly on a comparison level's threshold are levelled as before, but
+    ones within FLOAT precision (about one part in 10^7) of it may not be.
+
+    Must be the last stage, after final_column_order and encode_token_ids.
+
+    Args:
+        ddb_pyrel (DuckDBPyRelation): The relation to process.
+        con (DuckDBPyConnection): The DuckDB connection.
+
+    Returns:
+        DuckDBPyRelation: The relation with log2 token frequencies.
+    """
+    sql = """
+    select
+        * replace (
+            list_transform(
+                token_rel_freq_arr,
+                x -> struct_pack(tok := x.tok, log2_rel_freq := log2(x.rel_freq)::FLOAT)
+            ) as token_rel_freq_arr,
+            list_transform(
+                common_end_tokens,
+                x -> struct_pack(tok := x.tok, log2_rel_freq := log2(x.rel_freq)::FLOAT)
+            ) as common_end_tokens
+        )
+    from ddb_pyrel
+    """
+    return con.sql(sql)
+
+
+class CommonEndTokens:
+    """
+    The set of tokens commonly found at the end of addresses (e.g. SOMERSET or
+    LONDON), read from the bundled common_end_tokens.csv.
+
+    The tokens are loaded into a temporary table once per connection, so they can be
+    tested for membership with a hash join rather than by scanning a list of tokens
+    for every row.
+
+    Args:
+        min_token_count (int, optional): Only tokens seen at the end of more than
+            this many addresses are included. Defaults to 3000.
+    """
+
+    def __init__(self, min_token_count: int = 3000):
+        self.min_token_count = min_token_count
+        # The connections the tokens have been loaded on, so the table is not
+        # created again on every cleaning call
+        self._registered_cons = weakref.WeakSet()
+
+    @property
+    def table_name(self) -> str:
+        return f"__common_end_tokens_{self.min_token_count}"
+
+    def register(self, con: DuckDBPyConnection) -> str:
+        """
+        Load the tokens into a temporary table on con, if they have not already been
+        loaded, and return the table name.
+        """
+        if con in self._registered_cons:
+            return self.table_name
+
+        with pkg_resources.path(
+            "uk_address_matcher.data", "common_end_tokens.csv"
+        ) as csv_path:
+            sql = f"""
+            create temporary table if not exists {self.table_name} as
+            select distinct token
+            from read_csv_auto('{csv_path}')
+            where token_count > {self.min_token_count}
+            """
+            con.execute(sql)
+        self._registered_cons.add(con)
+        return self.table_name
+
+
+COMMON_END_TOKENS = CommonEndTokens()
+
+
 def move_common_end_tokens_to_field(
     ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
 ) -> DuckDBPyRelation:
@@ -433,18 +861,7 @@ def move_common_end_tokens_to_field(
     # For some reason this is necessary to avoid a
     # BinderException: Binder Error: Max expression depth limit of 1000 exceeded.
     con.register("ddb_pyrel_alias2", ddb_pyrel)
-    with pkg_resources.path(
-        "uk_address_matcher.data", "common_end_tokens.csv"
-    ) as csv_path:
-        sql = f"""
-        select array_agg(token) as end_tokens_to_remove
-        from read_csv_auto("{csv_path}")
-        where token_count > 3000
-        """
-    common_end_tokens = con.sql(sql)
-
-    # Not sure why this is needed
-    con.register("common_end_tokens", common_end_tokens)
+    end_tokens_table = COMMON_END_TOKENS.register(con)
 
     end_tokens_as_array = """
     list_transform(common_end_tokens, x -> x.tok)
@@ -462,23 +879,37 @@ def move_common_end_tokens_to_field(
     )
     """
 
+    # Only the last three tokens are candidates, so look each of them up with a
+    # hash join.  Out of range positions are null so never match.
+    # __is_end_token[3] is the flag for the last token, [2] the penultimate etc.
     sql = f"""
     with
 
-    joined as (
-        select *
-    from ddb_pyrel_alias2
-    cross join common_end_tokens
+    flagged as (
+    select
+        d.*,
+        [
+            e3.token is not null,
+            e2.token is not null,
+            e1.token is not null
+        ] as __is_end_token
+    from ddb_pyrel_alias2 as d
+    left join {end_tokens_table} as e3
+        on d.token_rel_freq_arr[-3].tok = e3.token
+    left join {end_tokens_table} as e2
+        on d.token_rel_freq_arr[-2].tok = e2.token
+    left join {end_tokens_table} as e1
+        on d.token_rel_freq_arr[-1].tok = e1.token
     ),
 
     end_tokens_included as (
     select
-    * exclude (end_tokens_to_remove),
+    * exclude (__is_end_token),
     list_filter(token_rel_freq_arr[-3:],
-        x ->  list_contains(end_tokens_to_remove, x.tok)
+        (x, i) -> __is_end_token[i + 3 - len(token_rel_freq_arr[-3:])]
     )
     as common_end_tokens
-    from joined
+    from flagged
     )
 
     select
@@ -521,3 +952,86 @@ def separate_unusual_tokens(
     FROM ddb_pyrel
     """
     return con.sql(sql)
+
+
+def classify_unusual_tokens(
+    ddb_pyrel: DuckDBPyRelation, con: DuckDBPyConnection
+) -> DuckDBPyRelation:
+    """
+    Equivalent to running first_unusual_token,
+    use_first_unusual_token_if_no_numeric_token and separate_unusual_tokens in
+    turn, producing identical output, but sorting each token array once rather than
+    once per frequency band.
+
+    If there is no numeric token, the first unusual token (rel_freq < 0.001) is
+    used as numeric_token_1 and removed from token_rel_freq_arr.  The remaining
+    tokens are then sorted by rel_freq and split into unusual_tokens_arr,
+    very_unusual_tokens_arr and extremely_unusual_tokens_arr.
+
+    Args:
+        ddb_pyrel (DuckDBPyRelation): The relation to process.
+        con (DuckDBPyConnection): The DuckDB connection.
+
+    Returns:
+        DuckDBPyRelation: The modified table with the three token band arrays.
+    """
+    # Referring to ddb_pyrel directly inside the CTE lets DuckDB rebind it to the
+    # wrong relation when run_pipeline stacks the stages
+    con.register("ddb_pyrel_alias3", ddb_pyrel)
+    sql = """
+    with
+
+    -- Tokens are never null, so [1] gives the same result as list_any_value
+    -- without the cost of running it as a list aggregate
+    with_first_unusual_token as (
+    select
+        *,
+        list_filter(token_rel_freq_arr, x -> x.rel_freq < 0.001)[1]
+            as __first_unusual_token
+    from ddb_pyrel_alias3
+    ),
+
+    numeric_token_1_filled as (
+    select
+        * exclude (numeric_token_1, token_rel_freq_arr, __first_unusual_token),
+        case
+            when numeric_token_1 is null then __first_unusual_token.tok
+            else numeric_token_1
+            end as numeric_token_1,
+
+    case
+        when numeric_token_1 is null
+        then list_filter(token_rel_freq_arr, x -> coalesce(x.tok != __first_unusual_token.tok, true))
+        else token_rel_freq_arr
+    end
+    as token_rel_freq_arr
+    from with_first_unusual_token
+    ),
+
+    sorted as (
+    select
+        *,
+        list_select(
+            token_rel_freq_arr,
+            list_grade_up(list_transform(token_rel_freq_arr, x -> x.rel_freq))
+        ) as __sorted_token_rel_freq_arr
+    from numeric_token_1_filled
+    )
+
+    SELECT
+        * exclude (__sorted_token_rel_freq_arr),
+        list_transform(list_filter(
+            __sorted_token_rel_freq_arr,
+            x -> x.rel_freq < 1e-4 and x.rel_freq >= 5e-5
+        ), x-> x.tok) AS unusual_tokens_arr,
+        list_transform(list_filter(
+            __sorted_token_rel_freq_arr,
+            x -> x.rel_freq < 5e-5 and x.rel_freq >= 1e-7
+        ), x-> x.tok) AS very_unusual_tokens_arr,
+        list_transform(list_filter(
+            __sorted_token_rel_freq_arr,
+            x -> x.rel_freq < 1e-7
+        ), x-> x.tok) AS extremely_unusual_tokens_arr
+    FROM sorted
+    """
+    return con.sql(sql)
@@ -1,52 +1,304 @@
+import hashlib
 import importlib.resources as pkg_resources
+import math
+import os
+import shutil
+import time
+from typing import Callable, Dict, List, Tuple
+
+import duckdb
 
 from duckdb import DuckDBPyConnection, DuckDBPyRelation
 
+from uk_address_matcher import cleaning, regexes
 from uk_address_matcher.cleaning import (
+    add_postcode_components,
     add_term_frequencies_to_address_tokens,
+    add_term_frequencies_to_address_tokens_using_hash_lookup,
     add_term_frequencies_to_address_tokens_using_registered_df,
+    classify_unusual_tokens,
     clean_address_string_first_pass,
     clean_address_string_second_pass,
+    convert_token_rel_freq_to_log2,
     derive_original_address_concat,
+    encode_token_ids,
     extract_numeric_1_alt,
     final_column_order,
-    first_unusual_token,
     move_common_end_tokens_to_field,
     parse_out_flat_positional,
     parse_out_numbers,
-    separate_unusual_tokens,
     split_numeric_tokens_to_cols,
     tokenise_address_without_numbers,
     trim_whitespace_address_and_postcode,
     upper_case_address_and_postcode,
-    use_first_unusual_token_if_no_numeric_token,
 )
-from uk_address_matcher.run_pipeline import run_pipeline
+from uk_address_matcher.run_pipeline import (
+    compile_pipeline,
+    profile_pipeline,
+    run_pipeline_compiled,
+)
+
+CLEANING_QUEUE_ON_THE_FLY = [
+    trim_whitespace_address_and_postcode,
+    upper_case_address_and_postcode,
+    clean_address_string_first_pass,
+    derive_original_address_concat,
+    parse_out_flat_positional,
+    extract_numeric_1_alt,
+    parse_out_numbers,
+    clean_address_string_second_pass,
+    split_numeric_tokens_to_cols,
+    tokenise_address_without_numbers,
+    add_term_frequencies_to_address_tokens,
+    move_common_end_tokens_to_field,
+    classify_unusual_tokens,
+    add_postcode_components,
+    final_column_order,
+]
+
+CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ = [
+    trim_whitespace_address_and_postcode,
+    upper_case_address_and_postcode,
+    clean_address_string_first_pass,
+    derive_original_address_concat,
+    parse_out_flat_positional,
+    extract_numeric_1_alt,
+    parse_out_numbers,
+    clean_address_string_second_pass,
+    split_numeric_tokens_to_cols,
+    tokenise_address_without_numbers,
+    add_term_frequencies_to_address_tokens_using_registered_df,
+    move_common_end_tokens_to_field,
+    classify_unusual_tokens,
+    add_postcode_components,
+    final_column_order,
+]
+
+# As above, but attaching token frequencies with a hash lookup rather than an
+# explode/join/regroup.  Requires pandas and pyarrow
+CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ_HASH_LOOKUP = [
+    (
+        add_term_frequencies_to_address_tokens_using_hash_lookup
+        if f is add_term_frequencies_to_address_tokens_using_registered_df
+        else f
+    )
+    for f in CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ
+]
+
+
+def _register_rel_tok_freq_table(
+    con: DuckDBPyConnection, rel_tok_freq_table: DuckDBPyRelation = None
+) -> None:
+    # Load the default term frequency table if none is provided
+    if rel_tok_freq_table is None:
+        with pkg_resources.path(
+            "uk_address_matcher.data", "address_token_frequencies.parquet"
+        ) as default_tf_path:
+            rel_tok_freq_table = con.read_parquet(str(default_tf_path))
+
+    con.register("rel_tok_freq", rel_tok_freq_table)
+
+
+def _address_file_reader_sql(path: str) -> str:
+    if path.lower().endswith((".csv", ".csv.gz", ".tsv", ".txt")):
+        return f"read_csv_auto('{path}')"
+    return f"read_parquet('{path}')"
+
+
+def _clean_batch_to_parquet(
+    con: DuckDBPyConnection,
+    batch_sql: str,
+    output_path: str,
+    parameters: Dict = None,
+) -> int:
+    # Materialise the rows selected by batch_sql, with any parameters it binds,
+    # clean them and write the result to output_path, returning the number of
+    # input rows
+    con.execute(
+        f"create or replace temporary table __address_table as {batch_sql}",
+        parameters,
+    )
+    row_count = con.sql("select count(*) from __address_table").fetchone()[0]
+
+    cleaned_sql = compile_pipeline(
+        "__address_table",
+        con=con,
+        cleaning_queue=CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ,
+    )
+    con.sql(cleaned_sql).write_parquet(output_path)
+    con.execute("drop table if exists __address_table")
+    return row_count
+
+
+# Cleaning is a function of address_concat and postcode only, so this is all a cache
+# entry needs to be keyed on.  chr(30) distinguishes nulls from empty strings
+_CACHE_KEY_SQL = """
+md5_number(
+    coalesce(address_concat, chr(30)) || chr(31) || coalesce(postcode, chr(30))
+)
+"""
+
+
+# Bumped whenever the columns of the cache table change
+_CACHE_LAYOUT_VERSION = 2
+
+
+def _cleaning_cache_version(
+    con: DuckDBPyConnection, cleaning_queue: List[Callable]
+) -> str:
+    # Changes to any of the inputs to cleaning must invalidate the cache
+    hasher = hashlib.sha256()
+    for module in [cleaning, regexes]:
+        with open(module.__file__, "rb") as f:
+            hasher.update(f.read())
+
+    with pkg_resources.path(
+        "uk_address_matcher.data", "common_end_tokens.csv"
+    ) as csv_path:
+        hasher.update(csv_path.read_bytes())
+
+    hasher.update(",".join(f.__name__ for f in cleaning_queue).encode())
+    hasher.update(str(_CACHE_LAYOUT_VERSION).encode())
+
+    # Hashes are summed rather than combined with bit_xor, under which duplicate
+    # rows cancel
+    sql = "select count(*), sum(hash(token, rel_freq)::HUGEINT) from rel_tok_freq"
+    hasher.update(str(con.sql(sql).fetchone()).encode())
+
+    return hasher.hexdigest()[:16]
+
+
+def _clean_using_cache(
+    *,
+    con: DuckDBPyConnection,
+    cache_path: str,
+    cleaning_queue: List[Callable],
+) -> DuckDBPyRelation:
+    # Cleans __address_table, cleaning only addresses missing from the cache at
+    # cache_path and adding them to it
+    version = _cleaning_cache_version(con, cleaning_queue)
+
+    # Any cache still attached under the same name is detached first, and the
+    # cache is always detached afterwards, so a different cache_path from an
+    # earlier call is never read in its place
+    con.execute("DETACH DATABASE IF EXISTS __cleaning_cache")
+    con.execute(f"ATTACH '{cache_path}' AS __cleaning_cache")
+    try:
+        sql = """
+        select count(*) from duckdb_tables()
+        where database_name = '__cleaning_cache' and table_name = 'cleaned_addresses'
+        """
+        cache_exists = con.sql(sql).fetchone()[0] > 0
+
+        if cache_exists:
+            sql = """
+            select any_value(cleaning_version)
+            from __cleaning_cache.cleaned_addresses
+            """
+            cached_version = con.sql(sql).fetchone()[0]
+            if cached_version is not None and cached_version != version:
+                con.execute("drop table __cleaning_cache.cleaned_addresses")
+                cache_exists = False
+
+        sql = f"""
+        create or replace temporary table __address_table_keyed as
+        select *, {_CACHE_KEY_SQL} as __cache_key
+        from __address_table
+        """
+        con.execute(sql)
+
+        if cache_exists:
+            misses_condition = """
+            where not exists (
+                select 1 from __cleaning_cache.cleaned_addresses as c
+                where c.cache_key = k.__cache_key
+            )
+            """
+        else:
+            misses_condition = ""
+
+        sql = f"""
+        create or replace temporary table __address_table_misses as
+        select * from __address_table_keyed as k
+        {misses_condition}
+        """
+        con.execute(sql)
+
+        misses_cleaned_sql = compile_pipeline(
+            "__address_table_misses", con=con, cleaning_queue=cleaning_queue
+        )
+        sql = f"""
+        create or replace temporary table __address_table_misses_cleaned as
+        {misses_cleaned_sql}
+        """
+        con.execute(sql)
+        misses_cleaned = con.table("__address_table_misses_cleaned")
+
+        # Columns not derived from address_concat and postcode are passed through
+        # cleaning unchanged, so are taken from the input rather than the cache
+        passthrough_cols = set(con.table("__address_table").columns) - {
+            "address_concat",
+            "postcode",
+        }
+        output_cols = [c for c in misses_cleaned.columns if c != "__cache_key"]
+        derived_cols = [c for c in output_cols if c not in passthrough_cols]
+        derived_cols_expr = ", ".join(f'"{c}"' for c in derived_cols)
+
+        # Addresses that yield no tokens are dropped by cleaning.  They are cached as
+        # a marker row with no cleaned values, so they are not cleaned again every
+        # run
+        new_entries_sql = f"""
+        select distinct on (__cache_key)
+            __cache_key as cache_key,
+            '{version}' as cleaning_version,
+            false as is_dropped,
+            {derived_cols_expr}
+        from __address_table_misses_cleaned
+        union all by name
+        select distinct
+            __cache_key as cache_key,
+            '{version}' as cleaning_version,
+            true as is_dropped
+        from __address_table_misses
+        where __cache_key not in (
+            select __cache_key from __address_table_misses_cleaned
+        )
+        """
+        if cache_exists:
+            sql = f"""
+            insert into __cleaning_cache.cleaned_addresses by name
+            {new_entries_sql}
+            """
+        else:
+            sql = f"""
+            create table __cleaning_cache.cleaned_addresses as
+            {new_entries_sql}
+            """
+        con.execute(sql)
+
+        # Every input row now has an entry in the cache
+        select_expr = ", ".join(
+            f'c."{c}"' if c in derived_cols else f'k."{c}"' for c in output_cols
+        )
+        sql = f"""
+        create or replace temporary table __address_table_from_cache as
+        select {select_expr}
+        from __address_table_keyed as k
+        inner join __cleaning_cache.cleaned_addresses as c
+        on k.__cache_key = c.cache_key
+        where not c.is_dropped
+        """
+        con.execute(sql)
+    finally:
+        con.execute("DETACH __cleaning_cache")
+
+    return con.table("__address_table_from_cache")
 
 
 def clean_data_on_the_fly(
     address_table: DuckDBPyRelation,
     con: DuckDBPyConnection,
 ) -> DuckDBPyRelation:
-    cleaning_queue = [
-        trim_whitespace_address_and_postcode,
-        upper_case_address_and_postcode,
-        clean_address_string_first_pass,
-        derive_original_address_concat,
-        parse_out_flat_positional,
-        extract_numeric_1_alt,
-        parse_out_numbers,
-        clean_address_string_second_pass,
-        split_numeric_tokens_to_cols,
-        tokenise_address_without_numbers,
-        add_term_frequencies_to_address_tokens,
-        move_common_end_tokens_to_field,
-        first_unusual_token,
-        use_first_unusual_token_if_no_numeric_token,
-        separate_unusual_tokens,
-        final_column_order,
-    ]
-
     # If the following create temp table is not included
     # and `address_table` is created from like
     # select * from read_parquet() order by random()
@@ -57,10 +309,9 @@ def clean_data_on_the_fly(
     select * from __address_table_in
     """
     con.execute(sql)
-    input_table = con.table("__address_table")
 
-    res = run_pipeline(
-        input_table, con=con, cleaning_queue=cleaning_queue, print_intermediate=False
+    res = run_pipeline_compiled(
+        "__address_table", con=con, cleaning_queue=CLEANING_QUEUE_ON_THE_FLY
     )
 
     con.register("__address_table_res", res)
@@ -72,20 +323,68 @@ def clean_data_on_the_fly(
     return con.table("__address_table_cleaned")
 
 
+def _precomputed_rel_tok_freq_cleaning_queue(
+    use_hash_lookup: bool, use_token_ids: bool, use_log2_token_frequencies: bool
+) -> List[Callable]:
+    # The cleaning queue used by clean_data_using_precomputed_rel_tok_freq
+    if use_hash_lookup:
+        cleaning_queue = CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ_HASH_LOOKUP
+    else:
+        cleaning_queue = CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ
+
+    if use_token_ids:
+        cleaning_queue = cleaning_queue + [encode_token_ids]
+
+    if use_log2_token_frequencies:
+        cleaning_queue = cleaning_queue + [convert_token_rel_freq_to_log2]
+
+    return cleaning_queue
+
+
 def clean_data_using_precomputed_rel_tok_freq(
     address_table: DuckDBPyRelation,
     con: DuckDBPyConnection,
     rel_tok_freq_table: DuckDBPyRelation = None,
+    cache_path: str = None,
+    use_hash_lookup: bool = False,
+    use_token_ids: bool = False,
+    use_log2_token_frequencies: bool = False,
 ) -> DuckDBPyRelation:
+    """
+    Clean address_table using a precomputed token frequency table.
 
-    # Load the default term frequency table if none is provided
-    if rel_tok_freq_table is None:
-        with pkg_resources.path(
-            "uk_address_matcher.data", "address_token_frequencies.parquet"
-        ) as default_tf_path:
-            rel_tok_freq_table = con.read_parquet(str(default_tf_path))
+    If cache_path is provided, cleaned results are cached in a DuckDB file at that
+    path, keyed by a hash of (address_concat, postcode).  Only addresses not already
+    in the cache are cleaned.  The cache is cleared automatically whenever the
+    cleaning code, the common end tokens or the token frequency table change.
 
-    con.register("rel_tok_freq", rel_tok_freq_table)
+    Args:
+        address_table (DuckDBPyRelation): The addresses to clean.
+        con (DuckDBPyConnection): The DuckDB connection.
+        rel_tok_freq_table (DuckDBPyRelation, optional): Token frequency table. Defaults
+            to the bundled address_token_frequencies.parquet.
+        cache_path (str, optional): Path to a DuckDB file to use as a cleaning cache.
+            Defaults to None (no caching).
+        use_hash_lookup (bool, optional): Attach token frequencies with a vectorised
+            hash lookup, which is faster on large inputs but requires pandas and
+            pyarrow.  The output is identical. Defaults to False.
+        use_token_ids (bool, optional): Replace tokens in the token arrays with
+            integer IDs (see encode_token_ids), which makes scoring cheaper.  Both
+            datasets being matched must be cleaned with the same setting.  Requires
+            pandas and pyarrow. Defaults to False.
+        use_log2_token_frequencies (bool, optional): Store token frequencies as
+            log2 values (see convert_token_rel_freq_to_log2).  Both datasets being
+            matched must be cleaned with the same setting, and scored with
+            use_log2_token_frequencies=True. Defaults to False.
+
+    Returns:
+        DuckDBPyRelation: The cleaned addresses.
+    """
+    cleaning_queue = _precomputed_rel_tok_freq_cleaning_queue(
+        use_hash_lookup, use_token_ids, use_log2_token_frequencies
+    )
+
+    _register_rel_tok_freq_table(con, rel_tok_freq_table)
 
     # If the following create temp table is not included
     # and `address_table` is created from like
@@ -97,28 +396,15 @@ def clean_data_using_precomputed_rel_tok_freq(
     select * from __address_table_in
     """
     con.execute(sql)
-    input_table = con.table("__address_table")
-
-    cleaning_queue = [
-        trim_whitespace_address_and_postcode,
-        upper_case_address_and_postcode,
-        clean_address_string_first_pass,
-        derive_original_address_concat,
-        parse_out_flat_positional,
-        extract_numeric_1_alt,
-        parse_out_numbers,
-        clean_address_string_second_pass,
-        split_numeric_tokens_to_cols,
-        tokenise_address_without_numbers,
-        add_term_frequencies_to_address_tokens_using_registered_df,
-        move_common_end_tokens_to_field,
-        first_unusual_token,
-        use_first_unusual_token_if_no_numeric_token,
-        separate_unusual_tokens,
-        final_column_order,
-    ]
 
-    res = run_pipeline(input_table, con=con, cleaning_queue=cleaning_queue)
+    if cache_path is None:
+        res = run_pipeline_compiled(
+            "__address_table", con=con, cleaning_queue=cleaning_queue
+        )
+    else:
+        res = _clean_using_cache(
+            con=con, cache_path=cache_path, cleaning_queue=cleaning_queue
+        )
 
     con.register("__address_table_res", res)
     sql = """
@@ -127,3 +413,274 @@ def clean_data_using_precomputed_rel_tok_freq(
     """
     con.execute(sql)
     return con.table("__address_table_cleaned")
+
+
+def profile_clean_data_using_precomputed_rel_tok_freq(
+    address_table: DuckDBPyRelation,
+    con: DuckDBPyConnection,
+    rel_tok_freq_table: DuckDBPyRelation = None,
+    use_hash_lookup: bool = False,
+) -> List[Dict]:
+    """
+    Run the same cleaning as clean_data_using_precomputed_rel_tok_freq one stage at
+    a time, returning the per-stage profile produced by profile_pipeline.
+
+    Args:
+        address_table (DuckDBPyRelation): The addresses to clean.
+        con (DuckDBPyConnection): The DuckDB connection.
+        rel_tok_freq_table (DuckDBPyRelation, optional): Token frequency table. Defaults
+            to the bundled address_token_frequencies.parquet.
+        use_hash_lookup (bool, optional): Profile the hash lookup variant of the token
+            frequency stage. Defaults to False.
+
+    Returns:
+        List[Dict]: One dict per cleaning function, which can be written out with
+            json.dump.
+    """
+    if use_hash_lookup:
+        cleaning_queue = CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ_HASH_LOOKUP
+    else:
+        cleaning_queue = CLEANING_QUEUE_PRECOMPUTED_REL_TOK_FREQ
+
+    _register_rel_tok_freq_table(con, rel_tok_freq_table)
+
+    con.register("__address_table_in", address_table)
+    sql = """
+    create or replace temporary table __address_table as
+    select * from __address_table_in
+    """
+    con.execute(sql)
+
+    _, profile = profile_pipeline(
+        "__address_table", con=con, cleaning_queue=cleaning_queue
+    )
+    return profile
+
+
+def clean_data_streaming(
+    input_path: str,
+    output_dir: str,
+    con: DuckDBPyConnection,
+    *,
+    rows_per_batch: int = 1_000_000,
+    rel_tok_freq_table: DuckDBPyRelation = None,
+) -> DuckDBPyRelation:
+    """
+    Clean a larger-than-memory parquet or CSV file in batches using the precomputed
+    token frequency table, writing each cleaned batch to a parquet file in
+    output_dir.  Only one batch is held in memory at a time, so peak memory is
+    bounded by rows_per_batch rather than the size of the input.
+
+    Rows are assigned to batches by a hash of unique_id, so all rows sharing a
+    unique_id are cleaned together.  The input is split into its batches in a
+    single pass, written to a temporary directory in output_dir, and each batch
+    is then cleaned from its own files.  A CSV input is also parsed once up front
+    to count its rows.
+
+    Args:
+        input_path (str): Path (or glob) of the parquet or CSV input.  Must contain
+            the same columns as the input to clean_data_using_precomputed_rel_tok_freq.
+        output_dir (str): Directory to write the cleaned parquet files to.  Files are
+            named part_00000.parquet, part_00001.parquet etc. and existing files with
+            the same name are overwritten.
+        con (DuckDBPyConnection): The DuckDB connection.
+        rows_per_batch (int, optional): Approximate number of rows to clean at a
+            time. Defaults to 1,000,000.
+        rel_tok_freq_table (DuckDBPyRelation, optional): Token frequency table. Defaults
+            to the bundled address_token_frequencies.parquet.
+
+    Returns:
+        DuckDBPyRelation: The cleaned data, read back from the files written.
+    """
+    _register_rel_tok_freq_table(con, rel_tok_freq_table)
+
+    os.makedirs(output_dir, exist_ok=True)
+    source_sql = _address_file_reader_sql(input_path)
+    row_count = con.sql(f"select count(*) from {source_sql}").fetchone()[0]
+    num_batches = max(1, math.ceil(row_count / rows_per_batch))
+
+    batches_dir = os.path.join(output_dir, "__batches")
+    if os.path.exists(batches_dir):
+        shutil.rmtree(batches_dir)
+    sql = f"""
+    copy (
+        select hash(unique_id) % {num_batches} as __batch, *
+        from {source_sql}
+    ) to '{batches_dir}' (format parquet, partition_by (__batch))
+    """
+    con.execute(sql)
+
+    output_paths = []
+    for batch_number in range(num_batches):
+        batch_dir = os.path.join(batches_dir, f"__batch={batch_number}")
+        if os.path.exists(batch_dir):
+            batch_sql = f"""
+            select * exclude (__batch)
+            from read_parquet('{batch_dir}/*.parquet', hive_partitioning = true)
+            """
+        else:
+            # An empty batch still gets a file, with the columns of the input
+            batch_sql = f"select * from {source_sql} limit 0"
+        output_path = os.path.join(output_dir, f"part_{batch_number:05d}.parquet")
+        _clean_batch_to_parquet(con, batch_sql, output_path)
+        output_paths.append(output_path)
+
+    shutil.rmtree(batches_dir, ignore_errors=True)
+    return con.read_parquet(output_paths)
+
+
+# The postcode area is the leading one or two letters of the postcode, e.g. 'SW'
+_POSTCODE_AREA_SQL = (
+    "coalesce(regexp_extract(upper(trim(postcode)), '^[A-Z]{1,2}'), '')"
+)
+
+
+def _clean_postcode_area_worker(
+    partition_path: str,
+    output_path: str,
+    postcode_area: str,
+    rel_tok_freq_path: str,
+    threads_per_worker: int,
+) -> Dict:
+    # Runs in a worker process, so must open its own connection
+    start_time = time.time()
+    con = duckdb.connect()
+    con.execute(f"SET threads = {threads_per_worker}")
+    _register_rel_tok_freq_table(
+        con, con.read_parquet(rel_tok_freq_path) if rel_tok_freq_path else None
+    )
+
+    # Reads only this postcode area's files, written by clean_data_in_parallel
+    batch_sql = """
+    select * exclude (__postcode_area)
+    from read_parquet($partition_path, hive_partitioning = true)
+    """
+    row_count = _clean_batch_to_parquet(
+        con, batch_sql, output_path, {"partition_path": partition_path}
+    )
+    con.close()
+
+    return {
+        "worker_pid": os.getpid(),
+        "postcode_area": postcode_area,
+        "rows": row_count,
+        "seconds": time.time() - start_time,
+    }
+
+
+def clean_data_in_parallel(
+    input_path: str,
+    output_dir: str,
+    con: DuckDBPyConnection,
+    *,
+    num_workers: int = None,
+    threads_per_worker: int = 1,
+    rel_tok_freq_path: str = None,
+) -> Tuple[DuckDBPyRelation, List[Dict]]:
+    """
+    Clean a parquet or CSV file using a pool of worker processes, each with its own
+    DuckDB connection, to make full use of machines with many cores.
+
+    The input is partitioned by postcode area (e.g. 'SW', 'B') in a single pass,
+    written to a temporary directory in output_dir.  Each area is cleaned by one
+    worker, which reads only that area's files, using the precomputed token
+    frequency table, and is written to its own parquet file in output_dir.  Areas
+    are scheduled largest first so that workers finish at roughly the same time.
+
+    Args:
+        input_path (str): Path (or glob) of the parquet or CSV input.  Must contain
+            the same columns as the input to clean_data_using_precomputed_rel_tok_freq.
+        output_dir (str): Directory to write the cleaned parquet files to, one per
+            postcode area.
+        con (DuckDBPyConnection): The DuckDB connection used to partition the input
+            and read back the results.
+        num_workers (int, optional): Number of worker processes. Defaults to the
+            number of CPUs divided by threads_per_worker.
+        threads_per_worker (int, optional): DuckDB threads used by each worker.
+            Defaults to 1.
+        rel_tok_freq_path (str, optional): Path to a parquet token frequency table.
+            Defaults to the bundled address_token_frequencies.parquet.
+
+    Returns:
+        Tuple[DuckDBPyRelation, List[Dict]]: The cleaned data, read back from the files
+            written, and the throughput of each worker process as a list of dicts
+            with keys worker_pid, postcode_areas, rows, seconds and rows_per_second.
+    """
+    if num_workers is None:
+        num_workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    partitions_dir = os.path.join(output_dir, "__postcode_areas")
+    if os.path.exists(partitions_dir):
+        shutil.rmtree(partitions_dir)
+    sql = f"""
+    copy (
+        select {_POSTCODE_AREA_SQL} as __postcode_area, *
+        from {_address_file_reader_sql(input_path)}
+    ) to '{partitions_dir}' (format parquet, partition_by (__postcode_area))
+    """
+    con.execute(sql)
+
+    # Each area's size is taken from its files, so is known without reading them
+    partition_sizes = {}
+    if os.path.exists(partitions_dir):
+        for dir_name in os.listdir(partitions_dir):
+            partition_dir = os.path.join(partitions_dir, dir_name)
+            postcode_area = dir_name.split("=", 1)[1]
+            partition_sizes[postcode_area] = sum(
+                os.path.getsize(os.path.join(partition_dir, f))
+                for f in os.listdir(partition_dir)
+            )
+    postcode_areas = sorted(partition_sizes, key=partition_sizes.get, reverse=True)
+
+    # Imported here so that cleaning-only callers don't pay for them at import time
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Spawn rather than fork, since forking a process with DuckDB threads running
+    # is not safe
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as pool:
+        futures = []
+        for postcode_area in postcode_areas:
+            file_name = f"postcode_area_{postcode_area or 'UNKNOWN'}.parquet"
+            futures.append(
+                pool.submit(
+                    _clean_postcode_area_worker,
+                    os.path.join(
+                        partitions_dir, f"__postcode_area={postcode_area}", "*.parquet"
+                    ),
+                    os.path.join(output_dir, file_name),
+                    postcode_area,
+                    rel_tok_freq_path,
+                    threads_per_worker,
+                )
+            )
+        task_results = [f.result() for f in futures]
+    shutil.rmtree(partitions_dir, ignore_errors=True)
+
+    worker_stats = {}
+    for result in task_results:
+        stats = worker_stats.setdefault(
+            result["worker_pid"],
+            {
+                "worker_pid": result["worker_pid"],
+                "postcode_areas": [],
+                "rows": 0,
+                "seconds": 0.0,
+            },
+        )
+        stats["postcode_areas"].append(result["postcode_area"])
+        stats["rows"] += result["rows"]
+        stats["seconds"] += result["seconds"]
+
+    throughput = list(worker_stats.values())
+    for stats in throughput:
+        stats["rows_per_second"] = stats["rows"] / stats["seconds"]
+
+    output_paths = [
+        os.path.join(output_dir, f"postcode_area_{a or 'UNKNOWN'}.parquet")
+        for a in postcode_areas
+    ]
+    return con.read_parquet(output_paths), throughput
@@ -1,8 +1,3 @@
-import pandas as pd
-from splink.linker import Linker
-from splink.splink_dataframe import SplinkDataFrame
-
-
 def display_columns(df, suffix):
     cols = list(df.columns)
     cols_with_suffix = [
@@ -21,6 +16,8 @@ def display_columns(df, suffix):
 
 
 def display_l_r(df):
+    import pandas as pd
+
     a = display_columns(df, "_l")
     b = display_columns(df, "_r")
     return pd.concat([a, b])
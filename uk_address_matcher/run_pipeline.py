@@ -1,4 +1,6 @@
-from typing import Callable, List, Optional
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
 from duckdb import DuckDBPyConnection, DuckDBPyRelation
 
@@ -44,3 +46,232 @@ def run_pipeline(
             df_filtered.show(max_rows=10, max_width=10000, max_col_width=10000)
 
     return ddb_pyrel
+
+
+class _CapturedSql:
+    # Stands in for the DuckDBPyRelation a cleaning function would return
+    def __init__(self, sql: str):
+        self.sql = sql
+
+
+class _StageInput:
+    # Stands in for the DuckDBPyRelation passed into a cleaning function
+    pass
+
+
+class _CapturingConnection:
+    """
+    Wraps a DuckDBPyConnection so that calling a cleaning function records the SQL
+    it would run rather than binding a new relation.
+
+    Any relation the function registers under an alias of its input is recorded so
+    the alias can be rewritten to point at the previous stage.  Other registrations
+    (e.g. small lookup tables) are passed through to the real connection, as are
+    all other attribute accesses.
+    """
+
+    def __init__(self, con: DuckDBPyConnection, stage_input: _StageInput):
+        self._con = con
+        self._stage_input = stage_input
+        self.input_aliases = []
+
+    def sql(self, query: str) -> _CapturedSql:
+        return _CapturedSql(query)
+
+    def register(self, view_name: str, python_object):
+        if python_object is self._stage_input:
+            self.input_aliases.append(view_name)
+        elif isinstance(python_object, _CapturedSql):
+            self._con.register(view_name, self._con.sql(python_object.sql))
+        else:
+            self._con.register(view_name, python_object)
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+# String literals, quoted identifiers and comments, in which the input alias of a
+# stage is not rewritten
+_SQL_LITERALS_AND_COMMENTS = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL
+)
+
+
+def _replace_identifiers(
+    sql: str, names: List[str], replacement: str
+) -> Tuple[str, int]:
+    # Replaces each of names where it is used as an unquoted identifier in sql,
+    # returning the new SQL and the number of replacements made
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(n) for n in names) + r")\b")
+    parts = []
+    num_replacements = 0
+    position = 0
+    for match in _SQL_LITERALS_AND_COMMENTS.finditer(sql):
+        code, n = pattern.subn(lambda _: replacement, sql[position : match.start()])
+        parts.extend([code, sql[match.start() : match.end()]])
+        num_replacements += n
+        position = match.end()
+    code, n = pattern.subn(lambda _: replacement, sql[position:])
+    parts.append(code)
+    return "".join(parts), num_replacements + n
+
+
+def compile_pipeline(
+    input_table_name: str,
+    *,
+    con: DuckDBPyConnection,
+    cleaning_queue: List[Callable],
+) -> str:
+    """
+    Compile a cleaning_queue into a single flat SQL query.
+
+    Rather than stacking one relation per cleaning function (each of which DuckDB
+    binds in full as it is created), each function is called once against a
+    capturing connection to obtain its SQL, and the stages are chained together as
+    CTEs of one query.  This means the whole pipeline is bound and optimised once,
+    so DuckDB can push projections down through every stage, dropping columns as
+    soon as no later stage needs them, and eliminate repeated subexpressions across
+    stage boundaries.
+
+    Cleaning functions must follow the convention used throughout cleaning.py:
+    the input relation is referred to in the SQL either by the parameter name
+    `ddb_pyrel`, or by a name it is registered under with con.register.  These
+    names are rewritten wherever they are used as identifiers, but not in string
+    literals, quoted identifiers or comments, and a function whose SQL does not
+    refer to its input raises a ValueError.
+
+    Args:
+        input_table_name (str): The name of the table or view to clean.
+        con (DuckDBPyConnection): The DuckDB connection.
+        cleaning_queue (List[Callable]): A list of functions that implement SQL
+            transforms, as passed to run_pipeline.
+
+    Returns:
+        str: A single SQL select statement that applies every transform in turn.
+    """
+    ctes = []
+    previous_name = input_table_name
+
+    for i, cleaning_function in enumerate(cleaning_queue):
+        stage_input = _StageInput()
+        capturing_con = _CapturingConnection(con, stage_input)
+        captured = cleaning_function(stage_input, capturing_con)
+
+        if not isinstance(captured, _CapturedSql):
+            raise TypeError(
+                f"Cannot compile {cleaning_function.__name__}: cleaning functions must "
+                "return the result of con.sql()"
+            )
+
+        stage_sql, num_replacements = _replace_identifiers(
+            captured.sql, ["ddb_pyrel"] + capturing_con.input_aliases, previous_name
+        )
+        if num_replacements == 0:
+            raise ValueError(
+                f"Cannot compile {cleaning_function.__name__}: its SQL does not refer "
+                "to its input as ddb_pyrel or a name registered with con.register"
+            )
+
+        stage_name = f"__stage_{i + 1}_{cleaning_function.__name__}"
+        ctes.append(f"{stage_name} AS (\n{stage_sql}\n)")
+        previous_name = stage_name
+
+    if not ctes:
+        return f"SELECT * FROM {input_table_name}"
+
+    ctes_sql = ",\n".join(ctes)
+    return f"WITH\n{ctes_sql}\nSELECT * FROM {previous_name}"
+
+
+def run_pipeline_compiled(
+    input_table_name: str,
+    *,
+    con: DuckDBPyConnection,
+    cleaning_queue: List[Callable],
+) -> DuckDBPyRelation:
+    """
+    As run_pipeline, but compiles the cleaning_queue into a single query using
+    compile_pipeline before running it.  Use run_pipeline with print_intermediate
+    to debug individual stages.
+
+    Args:
+        input_table_name (str): The name of the table or view to clean.
+        con (DuckDBPyConnection): The DuckDB connection.
+        cleaning_queue (List[Callable]): A list of functions that implement SQL
+            transforms.
+
+    Returns:
+        DuckDBPyRelation: The data frame after all transforms have been applied.
+    """
+    sql = compile_pipeline(input_table_name, con=con, cleaning_queue=cleaning_queue)
+    return con.sql(sql)
+
+
+def profile_pipeline(
+    input_table_name: str,
+    *,
+    con: DuckDBPyConnection,
+    cleaning_queue: List[Callable],
+) -> Tuple[DuckDBPyRelation, List[Dict]]:
+    """
+    As run_pipeline_compiled, but materialises the output of each cleaning function
+    in turn and records how much it cost.  Because every stage reads from the
+    materialised output of the previous one, the timings are for that stage alone,
+    but the total will be higher than for run_pipeline_compiled, which lets DuckDB
+    optimise across stages.
+
+    For each cleaning function a dict is recorded with its position, name, wall
+    time in seconds, row count and output column count, along with the memory
+    DuckDB used to materialise its output (memory_added_bytes) and the total
+    memory DuckDB was using afterwards (total_memory_usage_bytes), which includes
+    the previous stage and anything else on the connection.  Only the current and
+    previous stage are held in memory at once.  The list is plain Python so can be written
+    out with json.dump, or loaded into DuckDB for analysis.
+
+    Args:
+        input_table_name (str): The name of the table or view to clean.
+        con (DuckDBPyConnection): The DuckDB connection.
+        cleaning_queue (List[Callable]): A list of functions that implement SQL
+            transforms.
+
+    Returns:
+        Tuple[DuckDBPyRelation, List[Dict]]: The data frame after all transforms have
+            been applied, and the per-stage profile.
+    """
+    profile = []
+    previous_name = input_table_name
+    memory_sql = "select sum(memory_usage_bytes)::BIGINT from duckdb_memory()"
+
+    for i, cleaning_function in enumerate(cleaning_queue, start=1):
+        stage_name = f"__profile_stage_{i}"
+
+        memory_before = con.sql(memory_sql).fetchone()[0]
+        start_time = time.perf_counter()
+        # Compiling the stage against the previous table name, rather than calling
+        # cleaning_function on a relation, means `ddb_pyrel` in the stage's SQL
+        # cannot be rebound to a different relation in the caller's scope
+        stage_sql = compile_pipeline(
+            previous_name, con=con, cleaning_queue=[cleaning_function]
+        )
+        con.execute(f"create or replace temporary table {stage_name} as {stage_sql}")
+        elapsed = time.perf_counter() - start_time
+
+        stage_table = con.table(stage_name)
+        memory_after = con.sql(memory_sql).fetchone()[0]
+        profile.append(
+            {
+                "stage": i,
+                "function": cleaning_function.__name__,
+                "seconds": round(elapsed, 4),
+                "num_rows": stage_table.count("*").fetchone()[0],
+                "num_columns": len(stage_table.columns),
+                "memory_added_bytes": memory_after - memory_before,
+                "total_memory_usage_bytes": memory_after,
+            }
+        )
+
+        if previous_name != input_table_name:
+            con.execute(f"drop table if exists {previous_name}")
+        previous_name = stage_name
+
+    return con.table(previous_name), profile
@@ -1,11 +1,190 @@
+import functools
+import glob
+import hashlib
 import importlib.resources as pkg_resources
 import json
+import math
+import os
 import re
+import shutil
 import time
-from typing import List
+from typing import TYPE_CHECKING, FrozenSet, List, Optional, Tuple, Union
 
 from duckdb import DuckDBPyConnection, DuckDBPyRelation
-from splink.duckdb.linker import DuckDBLinker
+
+from uk_address_matcher.arr_comparisons import (
+    array_reduce_by_freq_using_engine,
+    array_reduce_by_log2_freq,
+    token_list_columns_sql,
+)
+from uk_address_matcher.blocking import (
+    _blocking_rule_keys,
+    compile_blocking_sql,
+    compile_key_blocking_sql,
+    salt_sql,
+)
+from uk_address_matcher.cleaning_pipelines import (
+    _cleaning_cache_version,
+    _precomputed_rel_tok_freq_cleaning_queue,
+    _register_rel_tok_freq_table,
+    clean_data_using_precomputed_rel_tok_freq,
+)
+
+# Splink is slow to import, so is only imported when a linker is built
+if TYPE_CHECKING:
+    from splink.duckdb.linker import DuckDBLinker
+
+
+@functools.lru_cache(maxsize=None)
+def _read_settings_json() -> str:
+    with pkg_resources.path(
+        "uk_address_matcher.data", "splink_model.json"
+    ) as settings_path:
+        return settings_path.read_text()
+
+
+def _load_settings() -> dict:
+    # The file is read once, but each caller gets its own copy of the settings,
+    # since they are modified before being passed to splink
+    return json.loads(_read_settings_json())
+
+
+def _load_numeric_tf_table(
+    con: DuckDBPyConnection, precomputed_numeric_tf_table: DuckDBPyRelation = None
+) -> str:
+    # Loads the numeric token frequencies into a temporary table and returns its
+    # name.  The bundled frequencies are only loaded once per connection
+    if precomputed_numeric_tf_table is None:
+        with pkg_resources.path(
+            "uk_address_matcher.data", "numeric_token_frequencies.parquet"
+        ) as default_tf_path:
+            sql = f"""
+            create temporary table if not exists __numeric_token_frequencies as
+            select numeric_token, tf_numeric_token
+            from read_parquet('{default_tf_path}')
+            """
+            con.execute(sql)
+        return "__numeric_token_frequencies"
+
+    con.register("__numeric_token_frequencies_in", precomputed_numeric_tf_table)
+    sql = """
+    create or replace temporary table __numeric_token_frequencies_custom as
+    select numeric_token, tf_numeric_token
+    from __numeric_token_frequencies_in
+    """
+    con.execute(sql)
+    return "__numeric_token_frequencies_custom"
+
+
+def _create_numeric_tf_lookups(
+    con: DuckDBPyConnection, precomputed_numeric_tf_table: DuckDBPyRelation = None
+) -> str:
+    # Creates the term frequency lookups for numeric_token_1, numeric_token_2 and
+    # numeric_token_3, each a view renaming the columns of the same table, and
+    # returns the name of the table
+    tf_table_name = _load_numeric_tf_table(con, precomputed_numeric_tf_table)
+
+    for i in range(1, 4):
+        sql = f"""
+        create or replace temporary view __tf_lookup_numeric_token_{i} as
+        select
+            numeric_token as numeric_token_{i},
+            tf_numeric_token as tf_numeric_token_{i}
+        from {tf_table_name}
+        """
+        con.execute(sql)
+    return tf_table_name
+
+
+def _register_numeric_tf_lookups(
+    linker: "DuckDBLinker",
+    con: DuckDBPyConnection,
+    precomputed_numeric_tf_table: DuckDBPyRelation = None,
+) -> str:
+    # Registers the numeric token frequencies as the term frequency lookups of the
+    # linker.  The lookups are passed to the linker by name so that splink uses
+    # them in place.  Returns the name of the numeric token frequency table
+    tf_table_name = _create_numeric_tf_lookups(con, precomputed_numeric_tf_table)
+
+    for i in range(1, 4):
+        linker.register_term_frequency_lookup(
+            f"__tf_lookup_numeric_token_{i}", f"numeric_token_{i}", overwrite=True
+        )
+    return tf_table_name
+
+
+def _numeric_tf_fingerprint(con: DuckDBPyConnection, tf_table_name: str) -> str:
+    # Changes whenever the numeric token frequencies change.  The hashes are
+    # summed rather than combined with bit_xor, under which duplicate rows cancel
+    sql = f"""
+    select count(*), sum(hash(numeric_token, tf_numeric_token)::HUGEINT)
+    from {tf_table_name}
+    """
+    return str(con.sql(sql).fetchall()[0])
+
+
+# The columns added by _with_tf_sql
+_WITH_TF_COLUMNS = [
+    "_row_key",
+    "tf_numeric_token_1",
+    "tf_numeric_token_2",
+    "tf_numeric_token_3",
+]
+
+
+# Each record is given a _row_key, a BIGINT which blocked pairs are joined back to
+# their records on, rather than on the VARCHAR unique_id.  It is a hash of the
+# unique_id, so does not depend on the order of the records and needs no sort.  If
+# two records' hashes collide, they are numbered in unique_id order instead
+_HASHED_ROW_KEY_SQL = "(hash(df.unique_id) >> 1)::BIGINT"
+_NUMBERED_ROW_KEY_SQL = "row_number() over (order by df.unique_id)"
+
+
+def _with_tf_sql(input_table_name: str, row_key_sql: str) -> str:
+    # Selects input_table_name with the term frequency of each numeric token
+    # attached, as splink does when building df_concat_with_tf.  Reads the lookups
+    # created by _create_numeric_tf_lookups
+    return f"""
+    select
+        {row_key_sql} as _row_key,
+        df.*,
+        tf1.tf_numeric_token_1,
+        tf2.tf_numeric_token_2,
+        tf3.tf_numeric_token_3
+    from {input_table_name} as df
+    left join __tf_lookup_numeric_token_1 as tf1
+    on df.numeric_token_1 = tf1.numeric_token_1
+    left join __tf_lookup_numeric_token_2 as tf2
+    on df.numeric_token_2 = tf2.numeric_token_2
+    left join __tf_lookup_numeric_token_3 as tf3
+    on df.numeric_token_3 = tf3.numeric_token_3
+    """
+
+
+def _create_table_with_tf(
+    con: DuckDBPyConnection,
+    input_table_name: str,
+    table_name: str,
+    temporary: bool = True,
+    order_by: str = None,
+):
+    # Materialises input_table_name as table_name with its term frequencies and
+    # row keys, see _with_tf_sql.  Checking the hashed keys are unique is a cheap
+    # aggregate, whereas numbering the records sorts the whole table
+    create_sql = (
+        "create or replace temporary table" if temporary else "create or replace table"
+    )
+    order_by_sql = f"order by {order_by}" if order_by else ""
+    for row_key_sql in [_HASHED_ROW_KEY_SQL, _NUMBERED_ROW_KEY_SQL]:
+        sql = f"""
+        {create_sql} {table_name} as
+        {_with_tf_sql(input_table_name, row_key_sql)}
+        {order_by_sql}
+        """
+        con.execute(sql)
+        sql = f"select count(distinct _row_key) = count(*) from {table_name}"
+        if con.sql(sql).fetchall()[0][0]:
+            return
 
 
 def get_pretrained_linker(
@@ -18,11 +197,9 @@ def get_pretrained_linker(
     salting_multiplier: int = None,
     include_full_postcode_block=False,
 ):
-    # Load the settings file
-    with pkg_resources.path(
-        "uk_address_matcher.data", "splink_model.json"
-    ) as settings_path:
-        settings_as_dict = json.load(open(settings_path))
+    from splink.duckdb.linker import DuckDBLinker
+
+    settings_as_dict = _load_settings()
 
     if additional_columns_to_retain is not None:
         settings_as_dict["additional_columns_to_retain"] = additional_columns_to_retain
@@ -32,7 +209,7 @@ def get_pretrained_linker(
         if not include_full_postcode_block:
             if (
                 isinstance(rule, dict)
-                and rule["blocking_rule"] == "l.postcode = r.postcode"
+                and rule["blocking_rule"] == FULL_POSTCODE_BLOCKING_RULE
             ):
                 continue
         if isinstance(rule, str):
@@ -65,412 +242,448 @@ def get_pretrained_linker(
     df_addresses_to_search_within_fix = con.sql(sql)
     con.register("df_addresses_to_search_within_fix", df_addresses_to_search_within_fix)
 
-    # Initialize the linker
+    # Initialize the linker.  The bundled model's settings are fixed, so Splink's
+    # validation of them, which parses every SQL string in them to look for missing
+    # columns, is skipped.  It takes about half of the linker's setup time, and a
+    # missing column still fails when the SQL is run
     linker = DuckDBLinker(
         ["df_addresses_to_match_fix", "df_addresses_to_search_within_fix"],
         settings_dict=settings_as_dict,
         connection=con,
+        validate_settings=False,
     )
 
-    # Load the default term frequency table if none is provided
-    if precomputed_numeric_tf_table is None:
-        with pkg_resources.path(
-            "uk_address_matcher.data", "numeric_token_frequencies.parquet"
-        ) as default_tf_path:
-            precomputed_numeric_tf_table = con.read_parquet(str(default_tf_path))
-
-    if precomputed_numeric_tf_table is not None:
-        for i in range(1, 4):
-            df_sql = f"""
-                select
-                    numeric_token as numeric_token_{i},
-                    tf_numeric_token as tf_numeric_token_{i}
-                from precomputed_numeric_tf_table"""
-
-            df = con.sql(df_sql).df()
-            linker.register_term_frequency_lookup(
-                df, f"numeric_token_{i}", overwrite=True
-            )
+    _register_numeric_tf_lookups(linker, con, precomputed_numeric_tf_table)
 
     return linker
 
 
-def _performance_predict(
+def _register_input_table(
+    con: DuckDBPyConnection,
+    df: Union[DuckDBPyRelation, str],
+    view_name: str,
+) -> str:
+    # Returns the name of a table or view holding df, without copying the data:
+    # a relation is registered as view_name, a path to parquet file(s) is read in
+    # place, and any other string is taken to be the name of an existing table
+    if isinstance(df, DuckDBPyRelation):
+        con.register(view_name, df)
+        return view_name
+    if df.endswith(".parquet"):
+        con.register(view_name, con.read_parquet(df))
+        return view_name
+    return df
+
+
+# prepare_search_within_table writes the prepared addresses and their fingerprint
+# to these tables of a DuckDB file, which is attached under this name
+_PREPARED_SEARCH_WITHIN_DATABASE = "__prepared_search_within"
+_PREPARED_SEARCH_WITHIN_TABLE = f"{_PREPARED_SEARCH_WITHIN_DATABASE}.addresses"
+_PREPARED_SEARCH_WITHIN_FINGERPRINT_TABLE = (
+    f"{_PREPARED_SEARCH_WITHIN_DATABASE}.fingerprint"
+)
+
+
+def _input_fingerprint(
+    con: DuckDBPyConnection,
+    df: Union[DuckDBPyRelation, str],
+    table_name: str,
+    input_version: str = None,
+) -> str:
+    # A version given by the caller is used as it is.  A path is fingerprinted by
+    # the size and modification time of each file it matches, so an unchanged
+    # input is recognised without reading it.  Anything else is fingerprinted by
+    # the sum of the hashes of its rows, as in _numeric_tf_fingerprint, which
+    # reads the whole input
+    if input_version is not None:
+        return f"version {input_version!r}"
+    if isinstance(df, str) and df.endswith(".parquet"):
+        paths = sorted(glob.glob(df))
+        return str([(p, os.path.getsize(p), os.path.getmtime(p)) for p in paths])
+    sql = f"select count(*), sum(hash(t)::HUGEINT) from {table_name} as t"
+    return str(con.sql(sql).fetchall()[0])
+
+
+def prepare_search_within_table(
+    df_addresses_to_search_within: Union[DuckDBPyRelation, str],
     *,
-    df_addresses_to_match: DuckDBPyRelation,
-    df_addresses_to_search_within: DuckDBPyRelation,
     con: DuckDBPyConnection,
+    path: str,
     precomputed_numeric_tf_table: DuckDBPyRelation = None,
-    match_weight_threshold: None,
-    additional_columns_to_retain: List[str] = None,
-    output_all_cols: bool = True,
-    include_full_postcode_block=True,
-    full_block=False,
-    print_timings=False,
-):
-    # Load the settings file
-    with pkg_resources.path(
-        "uk_address_matcher.data", "splink_model.json"
-    ) as settings_path:
-        settings_as_dict = json.load(open(settings_path))
+    rel_tok_freq_table: DuckDBPyRelation = None,
+    use_token_ids: bool = False,
+    use_log2_token_frequencies: bool = False,
+    input_version: str = None,
+) -> str:
+    """
+    Clean the addresses to search within and attach their term frequencies, saving
+    the result to a DuckDB file which can be passed to _performance_predict as
+    df_addresses_to_search_within in place of the cleaned addresses.
+
+    This is for matching many inputs against the same large set of addresses, which
+    can then be prepared once rather than on every run.  The file holds a
+    fingerprint of the addresses and of the cleaning code and token frequencies,
+    and the addresses are only prepared again if the fingerprint changes.  If
+    df_addresses_to_search_within is a path to parquet file(s), the fingerprint is
+    taken from the size and modification time of the files, so checking an
+    unchanged input does not read it.  A relation or table is hashed in full on
+    every call unless input_version is given.
+
+    Args:
+        df_addresses_to_search_within (Union[DuckDBPyRelation, str]): The addresses
+            to clean, as a relation, the name of a table, or a path to parquet
+            file(s).
+        con (DuckDBPyConnection): The DuckDB connection.
+        path (str): The path of the DuckDB file to write, ending in .duckdb.
+        precomputed_numeric_tf_table (DuckDBPyRelation, optional): Numeric token
+            frequencies, which must also be passed to _performance_predict.
+            Defaults to the bundled numeric_token_frequencies.parquet.
+        rel_tok_freq_table (DuckDBPyRelation, optional): Token frequency table.
+            Defaults to the bundled address_token_frequencies.parquet.
+        use_token_ids (bool, optional): As for
+            clean_data_using_precomputed_rel_tok_freq. Defaults to False.
+        use_log2_token_frequencies (bool, optional): As for
+            clean_data_using_precomputed_rel_tok_freq. Defaults to False.
+        input_version (str, optional): A version of the addresses, such as the
+            date they were extracted, used as their fingerprint in place of
+            reading them.  It must change whenever the addresses do. Defaults to
+            None.
+
+    Returns:
+        str: path
+    """
+    if not path.endswith(".duckdb"):
+        raise ValueError(f"path must end in .duckdb, got {path!r}")
 
-    dfs_pd = [df_addresses_to_match.df(), df_addresses_to_search_within.df()]
-    left_source_dataset = dfs_pd[0].iloc[0]["source_dataset"]
-    right_source_dataset = dfs_pd[1].iloc[0]["source_dataset"]
+    table_name = _register_input_table(
+        con, df_addresses_to_search_within, "__addresses_to_search_within_in"
+    )
+    cleaning_queue = _precomputed_rel_tok_freq_cleaning_queue(
+        False, use_token_ids, use_log2_token_frequencies
+    )
+    _register_rel_tok_freq_table(con, rel_tok_freq_table)
+    numeric_tf_table_name = _create_numeric_tf_lookups(
+        con, precomputed_numeric_tf_table
+    )
+    numeric_tf_fingerprint = _numeric_tf_fingerprint(con, numeric_tf_table_name)
 
-    # Initialize the linker
-    linker = DuckDBLinker(dfs_pd, settings_dict=settings_as_dict, connection=con)
+    # The prepared table also depends on the code in this module
+    hasher = hashlib.sha256()
+    input_fingerprint = _input_fingerprint(
+        con, df_addresses_to_search_within, table_name, input_version
+    )
+    hasher.update(input_fingerprint.encode())
+    hasher.update(_cleaning_cache_version(con, cleaning_queue).encode())
+    hasher.update(numeric_tf_fingerprint.encode())
+    with open(__file__, "rb") as f:
+        hasher.update(f.read())
+    fingerprint = hasher.hexdigest()[:16]
 
-    # Load the default term frequency table if none is provided
-    if precomputed_numeric_tf_table is None:
-        with pkg_resources.path(
-            "uk_address_matcher.data", "numeric_token_frequencies.parquet"
-        ) as default_tf_path:
-            precomputed_numeric_tf_table = con.read_parquet(str(default_tf_path))
-
-    if precomputed_numeric_tf_table is not None:
-        for i in range(1, 4):
-            df_sql = f"""
-                select
-                    numeric_token as numeric_token_{i},
-                    tf_numeric_token as tf_numeric_token_{i}
-                from precomputed_numeric_tf_table"""
-
-            df = con.sql(df_sql).df()
-            linker.register_term_frequency_lookup(
-                df, f"numeric_token_{i}", overwrite=True
-            )
-    start_time = time.time()
-    tf_table = linker._initialise_df_concat_with_tf()
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    if print_timings:
-        print(f"Initialise df_concat_with_tf took {elapsed_time:.2f} seconds")
+    con.execute(f"DETACH DATABASE IF EXISTS {_PREPARED_SEARCH_WITHIN_DATABASE}")
+    con.execute(f"ATTACH '{path}' AS {_PREPARED_SEARCH_WITHIN_DATABASE}")
 
-    if include_full_postcode_block:
-        pc_blocking_rule = """
-        UNION ALL
-        select
-                "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-                , '24' as match_key
-
-                from __splink__df_concat_with_tf_left as l
-                inner join __splink__df_concat_with_tf_right as r
-                on
-                (l.postcode = r.postcode)
-                where 1=1
-                AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((list_extract(l.extremely_unusual_tokens_arr, 1) = list_extract(r.extremely_unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((list_extract(l.extremely_unusual_tokens_arr, 1) = list_extract(r.extremely_unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-        """
-    else:
-        pc_blocking_rule = ""
+    sql = f"""
+    select count(*) from duckdb_tables()
+    where database_name = '{_PREPARED_SEARCH_WITHIN_DATABASE}'
+    and table_name = 'fingerprint'
+    """
+    if con.sql(sql).fetchall()[0][0] > 0:
+        sql = f"select fingerprint from {_PREPARED_SEARCH_WITHIN_FINGERPRINT_TABLE}"
+        if con.sql(sql).fetchall()[0][0] == fingerprint:
+            con.execute(f"DETACH {_PREPARED_SEARCH_WITHIN_DATABASE}")
+            return path
+
+    # The fingerprint is written last, so an interrupted run is not mistaken for
+    # a complete one
+    con.execute(f"drop table if exists {_PREPARED_SEARCH_WITHIN_FINGERPRINT_TABLE}")
+
+    cleaned = clean_data_using_precomputed_rel_tok_freq(
+        con.table(table_name),
+        con=con,
+        rel_tok_freq_table=rel_tok_freq_table,
+        use_token_ids=use_token_ids,
+        use_log2_token_frequencies=use_log2_token_frequencies,
+    )
+    con.register("__addresses_to_search_within_cleaned", cleaned)
+
+    # Sorting by postcode clusters records with the same blocking keys, which
+    # lets DuckDB skip most of the table when predicting by partition
+    _create_table_with_tf(
+        con,
+        "__addresses_to_search_within_cleaned",
+        _PREPARED_SEARCH_WITHIN_TABLE,
+        temporary=False,
+        order_by="postcode",
+    )
 
     sql = f"""
+    create table {_PREPARED_SEARCH_WITHIN_FINGERPRINT_TABLE} as
+    select $fingerprint as fingerprint,
+        $numeric_tf_fingerprint as numeric_tf_fingerprint
+    """
+    con.execute(
+        sql,
+        {
+            "fingerprint": fingerprint,
+            "numeric_tf_fingerprint": numeric_tf_fingerprint,
+        },
+    )
+    con.execute(f"DETACH {_PREPARED_SEARCH_WITHIN_DATABASE}")
+    return path
+
+
+# Rules which create lots of pairs but few matches, so generate no pairs
+SKIPPED_BLOCKING_RULES = frozenset(
+    [
+        "list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode",
+        "list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1",
+    ]
+)
+
+FULL_POSTCODE_BLOCKING_RULE = "l.postcode = r.postcode"
+
+
+def get_blocking_rules(include_full_postcode_block: bool = True) -> List[str]:
+    """
+    Get the blocking rules of the bundled model as SQL strings, in order, so a
+    rule's position is its match_key.  Rules in SKIPPED_BLOCKING_RULES are
+    included, since they keep their position, but generate no pairs.  The rules
+    compare postcode strings, as the bundled model does; _performance_predict
+    compares the integer postcode codes added by cleaning instead.
+
+    Args:
+        include_full_postcode_block (bool, optional): Include
+            FULL_POSTCODE_BLOCKING_RULE. Defaults to True.
+
+    Returns:
+        List[str]: The blocking rules.
+    """
+    rules = []
+    for rule in _load_settings()["blocking_rules_to_generate_predictions"]:
+        if isinstance(rule, dict):
+            rule = rule["blocking_rule"]
+        if rule == FULL_POSTCODE_BLOCKING_RULE and not include_full_postcode_block:
+            continue
+        rules.append(rule)
+    return rules
+
+
+# The model's postcode blocking conditions, and the conditions on the integer
+# postcode codes added by add_postcode_components which _performance_predict
+# blocks on instead
+_POSTCODE_CODE_BLOCKING_CONDITIONS = {
+    "split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)": (
+        "l.postcode_district_code = r.postcode_district_code"
+    ),
+    "split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)": (
+        "l.postcode_inward_code = r.postcode_inward_code"
+    ),
+    "l.postcode = r.postcode": "l.postcode_unit_code = r.postcode_unit_code",
+}
+
+
+def _fast_path_blocking_rule(rule: str) -> str:
+    # Rewrites a blocking rule from the model settings to compare postcode codes
+    # rather than strings.  The codes agree where the strings do, except that a
+    # postcode missing its space is compared on its components, and a part which
+    # does not look like part of a postcode has a null code so is not blocked on
+    for model_sql, code_sql in _POSTCODE_CODE_BLOCKING_CONDITIONS.items():
+        rule = rule.replace(model_sql, code_sql)
+    return rule
+
+
+def _fast_path_blocking_rules(include_full_postcode_block: bool) -> List[str]:
+    # The rules _performance_predict blocks on, see _fast_path_blocking_rule
+    return [
+        _fast_path_blocking_rule(rule)
+        for rule in get_blocking_rules(include_full_postcode_block)
+    ]
+
+
+_FAST_PATH_SKIPPED_BLOCKING_RULES = frozenset(
+    _fast_path_blocking_rule(rule) for rule in SKIPPED_BLOCKING_RULES
+)
+
+
+# Pairs found by a rule with either of these conditions are in the same postcode
+# area, since the area code is taken from the outward code, which is part of
+# both the district and the unit code
+_POSTCODE_AREA_BLOCKING_KEYS = [
+    ("l.postcode_district_code", "r.postcode_district_code"),
+    ("l.postcode_unit_code", "r.postcode_unit_code"),
+]
+_INWARD_CODE_BLOCKING_KEY = ("l.postcode_inward_code", "r.postcode_inward_code")
+
+
+def _blocking_rule_partitions(
+    blocking_rules: List[str], num_hash_partitions: int
+) -> List[Tuple[FrozenSet[str], str, str]]:
+    # Groups the blocking rules so that every pair found by a group's rules has
+    # the same partition key on both sides.  Returns each group's rules and the
+    # SQL for the partition key of a left and of a right record.  Rules requiring
+    # postcode district or unit agreement are partitioned by postcode area.
+    # Other rules are partitioned by a hash bucket of their inward code if they
+    # require it to agree, and otherwise of the first expression they compare
+    groups = {}
+    for rule in blocking_rules:
+        if rule in _FAST_PATH_SKIPPED_BLOCKING_RULES:
+            continue
+        keys = _blocking_rule_keys(rule)
+        if any(key in keys for key in _POSTCODE_AREA_BLOCKING_KEYS):
+            partition_keys = ("postcode_area_code", "postcode_area_code")
+        else:
+            key = (
+                _INWARD_CODE_BLOCKING_KEY
+                if _INWARD_CODE_BLOCKING_KEY in keys
+                else keys[0]
+            )
+            partition_keys = tuple(
+                f"CASE WHEN {e} IS NULL THEN NULL "
+                f"ELSE hash({e}) % {num_hash_partitions} END"
+                for e in (re.sub(r"\b[lr]\.", "", side) for side in key)
+            )
+        groups.setdefault(partition_keys, []).append(rule)
+
+    return [
+        (frozenset(rules), left_key_sql, right_key_sql)
+        for (left_key_sql, right_key_sql), rules in groups.items()
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _blocking_sql(
+    include_full_postcode_block: bool,
+    full_block: bool,
+    deduplication: str = "min_match_key",
+    engine: str = "joins",
+    salting_partitions: int = 8,
+    generating_rules: FrozenSet[str] = None,
+) -> str:
+    # Generates the SQL that creates the blocked_pairs table.  It reads the records
+    # from the __prediction_left_with_tf and __prediction_right_with_tf views, so
+    # it only depends on the options and is generated once per combination of them.
+    # engine is "joins" for a join per blocking rule (compile_blocking_sql) or
+    # "keys" for a single join on exploded keys (compile_key_blocking_sql).
+    # If generating_rules is given, only those rules generate pairs, but pairs
+    # found by earlier rules are still excluded, so the pairs found are those for
+    # which the first rule that matches is one of generating_rules.
+    # Pairs are identified by the _row_key of each record, see _with_tf_sql
+    skipped_rules = _FAST_PATH_SKIPPED_BLOCKING_RULES
+    if generating_rules is not None:
+        all_rules = _fast_path_blocking_rules(include_full_postcode_block)
+        skipped_rules = skipped_rules | (frozenset(all_rules) - generating_rules)
+
+    blocking_kwargs = {
+        "left_table": "__splink__df_concat_with_tf_left",
+        "right_table": "__splink__df_concat_with_tf_right",
+        "id_columns": ["_row_key"],
+        "skipped_rules": skipped_rules,
+    }
+    if full_block:
+        blocked_sql = compile_blocking_sql(["1=1"], **blocking_kwargs)
+    elif engine == "joins":
+        blocked_sql = compile_blocking_sql(
+            _fast_path_blocking_rules(include_full_postcode_block),
+            deduplication=deduplication,
+            **blocking_kwargs,
+        )
+    elif engine == "keys":
+        blocked_sql = compile_key_blocking_sql(
+            _fast_path_blocking_rules(include_full_postcode_block), **blocking_kwargs
+        )
+    else:
+        raise ValueError(f"blocking_engine must be 'joins' or 'keys', got {engine!r}")
+
+    salt = salt_sql(blocking_kwargs["id_columns"], salting_partitions)
+
+    return f"""
     create or replace table blocked_pairs as (
-    WITH __splink__df_concat_with_tf as (select * from {tf_table.physical_name}),
-    __splink__df_concat_with_tf_left as (
-            select * from __splink__df_concat_with_tf
-            where source_dataset = '{left_source_dataset}'
-            ),
-    __splink__df_concat_with_tf_right as (
-            select * from __splink__df_concat_with_tf
-            where source_dataset = '{right_source_dataset}'
-            ),
+    WITH __splink__df_concat_with_tf_left as (select * from __prediction_left_with_tf),
+    __splink__df_concat_with_tf_right as (select * from __prediction_right_with_tf),
     __splink__df_blocked as (
-            -- start_blocking
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '0' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '1' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '2' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '3' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '4' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '5' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '6' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '7' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode) and false --HACK BECAUSE CREATES LOTS OF PAIRS BUT FEW MATCHES
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '8' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1) and false --HACK BECAUSE CREATES LOTS OF PAIRS BUT FEW MATCHES
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '9' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '10' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '11' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '12' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '13' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '14' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '15' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '16' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '17' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '18' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '19' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '20' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '21' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '22' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (list_extract(l.extremely_unusual_tokens_arr, 1) = list_extract(r.extremely_unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false))
-             UNION ALL
-            select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '23' as match_key
-
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on
-            (list_extract(l.extremely_unusual_tokens_arr, 1) = list_extract(r.extremely_unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2))
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and list_extract(l.unusual_tokens_arr, 2) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 2) and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 1) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = list_extract(r.very_unusual_tokens_arr, 2) and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = list_extract(r.unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = split_part(r.postcode, ' ', 2)),false) OR coalesce((list_extract(l.extremely_unusual_tokens_arr, 1) = list_extract(r.extremely_unusual_tokens_arr, 1) and split_part(l.postcode, ' ', 1) = split_part(r.postcode, ' ', 1)),false))
-            {pc_blocking_rule}
-            -- end_blocking
+            {blocked_sql}
             )
 
-    select *, ceiling(random() * 8) as _salt_block from __splink__df_blocked)
+    select *, {salt} as _salt_block from __splink__df_blocked)
     """
+
+
+# The columns of each record pair used to score it
+_COMPARISON_COLUMNS = [
+    "source_dataset",
+    "unique_id",
+    "flat_positional",
+    "numeric_token_1",
+    "tf_numeric_token_1",
+    "numeric_1_alt",
+    "numeric_token_2",
+    "tf_numeric_token_2",
+    "numeric_token_3",
+    "tf_numeric_token_3",
+    "token_rel_freq_arr",
+    "common_end_tokens",
+    "original_address_concat",
+    "postcode",
+    "extremely_unusual_tokens_arr",
+    "very_unusual_tokens_arr",
+    "unusual_tokens_arr",
+]
+_COMPARISON_COLUMNS_SQL = ", ".join(
+    f'"{side}"."{col}" AS "{col}_{side}"'
+    for col in _COMPARISON_COLUMNS
+    for side in "lr"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _fused_blocking_sql(
+    include_full_postcode_block: bool,
+    full_block: bool,
+    additional_columns_to_retain: Tuple[str, ...],
+    generating_rules: FrozenSet[str] = None,
+) -> str:
+    # As _blocking_sql, but outputs every column needed to score each pair rather
+    # than just its ids, so the pairs can be scored without being materialised
+    # and joined back to the records.  Pairs cannot be grouped once they carry
+    # all their columns, so each rule excludes the pairs found by earlier rules
     if full_block:
-        # replace text between the -- start_blocking  line and the -- end_blocking line
-        # with 1=1
-        replace = """
+        blocking_rules = ["1=1"]
+    else:
+        blocking_rules = _fast_path_blocking_rules(include_full_postcode_block)
 
-        select
-            "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '1' as match_key
+    skipped_rules = _FAST_PATH_SKIPPED_BLOCKING_RULES
+    if generating_rules is not None:
+        skipped_rules = skipped_rules | (frozenset(blocking_rules) - generating_rules)
 
-            from __splink__df_concat_with_tf_left as l
-            inner join __splink__df_concat_with_tf_right as r
-            on 1=1
-        """
-        sql = re.sub(
-            r"(?s)-- start_blocking.*?-- end_blocking",
-            replace,
-            sql,
-        )
-    start_time = time.time()
-    linker._con.sql(sql)
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    if print_timings:
-        print(f"Time taken to block: {elapsed_time:.2f} seconds")
+    columns_sql = _COMPARISON_COLUMNS_SQL + "".join(
+        f", l.{col} as {col}_l, r.{col} as {col}_r"
+        for col in additional_columns_to_retain
+    )
+    return compile_blocking_sql(
+        blocking_rules,
+        left_table="__splink__df_concat_with_tf_left",
+        right_table="__splink__df_concat_with_tf_right",
+        id_columns=["source_dataset", "unique_id"],
+        skipped_rules=skipped_rules,
+        deduplication="exclude_previous_rules",
+        columns_sql=columns_sql,
+    )
 
+
+@functools.lru_cache(maxsize=None)
+def _prediction_sql(
+    *,
+    additional_columns_to_retain: Tuple[str, ...],
+    output_all_cols: bool,
+    match_weight_threshold: Optional[float],
+    use_log2_token_frequencies: bool,
+    complex_tok_expr: str,
+    common_end_tokens_expr: str,
+    salting_partitions: int,
+    fused_blocking_sql: Optional[str] = None,
+) -> str:
+    # Generates the SQL that scores blocked_pairs into the predictions table.  As
+    # with _blocking_sql, it is generated once per combination of options
     if additional_columns_to_retain:
         additional_cols_expr = ", ".join(
             [
@@ -490,6 +703,25 @@ def _performance_predict(
     else:
         final_select_expr = "match_probability, match_weight, concat_ws(' ', original_address_concat_l, postcode_l) as address_l, concat_ws(' ', original_address_concat_r, postcode_r) as address_r, unique_id_l, unique_id_r,  source_dataset_l, source_dataset_r"
 
+    # token_rel_freq_arr is bucketed by the product of matching token frequencies
+    # at powers of 100: 1e-2 for level 1 up to 1e-20 for level 10.  If the cleaned
+    # data holds log2 frequencies, compare the log2 of the product instead
+    if use_log2_token_frequencies:
+
+        def threshold(exponent):
+            return repr(math.log2(10.0**-exponent))
+
+    else:
+
+        def threshold(exponent):
+            return f"1e-{exponent}"
+
+    token_rel_freq_arr_levels = " ".join(
+        f"WHEN complex_tok < {threshold(2 * level)} THEN {level}"
+        for level in range(10, 0, -1)
+    )
+    common_end_tokens_threshold = threshold(2)
+
     if match_weight_threshold:
         match_weight_condition = f"case when match_weight > {match_weight_threshold} then 1 else 0 end as match_weight_cond"
     else:
@@ -505,155 +737,46 @@ def _performance_predict(
     else:
         qualify_expr = ""
 
+    # The pairs are scored in salting_partitions separate joins, each taking the
+    # pairs with one value of _salt_block, which was assigned in _blocking_sql.
+    # If fused_blocking_sql is given, the pairs come straight from it instead
+    blocked_sql = f"""
+    select {_COMPARISON_COLUMNS_SQL}, b.match_key as match_key,
+    {additional_cols_expr}
+    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b._row_key_l = l._row_key inner join __splink__df_concat_with_tf_right as r on b._row_key_r = r._row_key
+    """
+    salted_blocked_sql = "\n    UNION ALL\n".join(
+        f"{blocked_sql}    where b._salt_block = {salt}"
+        for salt in range(1, salting_partitions + 1)
+    )
+    if fused_blocking_sql is not None:
+        salted_blocked_sql = fused_blocking_sql
+
     sql = f"""
     create or replace table predictions as (
-    WITH __splink__df_concat_with_tf as (select * from {tf_table.physical_name}),
-    __splink__df_concat_with_tf_left as (
-            select * from __splink__df_concat_with_tf
-            where source_dataset = '{left_source_dataset}'
-
-            ),
-    __splink__df_concat_with_tf_right as (
-            select * from __splink__df_concat_with_tf
-            where source_dataset = '{right_source_dataset}'
-
-            ),
+    WITH __splink__df_concat_with_tf_left as (select * from __prediction_left_with_tf),
+    __splink__df_concat_with_tf_right as (select * from __prediction_right_with_tf),
     __splink__df_blocked as (
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 1
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 2
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 3
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 4
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 5
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 6
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 7
-    UNION ALL
-    select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
-    {additional_cols_expr}
-    from blocked_pairs as b inner join __splink__df_concat_with_tf_left as l on b.unique_id_l = l.unique_id and b.source_dataset_l = l.source_dataset inner join __splink__df_concat_with_tf_right as r on b.unique_id_r = r.unique_id and b.source_dataset_r = r.source_dataset
-    where b._salt_block = 8
+    {salted_blocked_sql}
+    ),
+    __splink__df_blocked_with_token_lists as (
+    select
+    *,
+    {token_list_columns_sql("token_rel_freq_arr")},
+    {token_list_columns_sql("common_end_tokens")}
+    from __splink__df_blocked
     ),
     __reusable as (
     select
     *,
-    list_reduce(
-            list_prepend(
-                1.0,
-                list_transform(
-                    array_filter(
-                        token_rel_freq_arr_l,
-                        y -> array_contains(
-                            array_intersect(
-                                list_transform(token_rel_freq_arr_l, x -> x.tok),
-                                list_transform(token_rel_freq_arr_r, x -> x.tok)
-                            ),
-                            y.tok
-                        )
-                    ),
-                    x -> x.rel_freq
-                )
-            ),
-            (p, q) -> p * q
-        )
-        *
-        list_reduce(
-            list_prepend(
-                1.0,
-                list_transform(
-                    list_concat(
-                        array_filter(
-                            token_rel_freq_arr_l,
-                                y -> not array_contains(
-                                        list_transform(token_rel_freq_arr_r, x -> x.tok),
-                                        y.tok
-                                    )
-                        ),
-                        array_filter(
-                            token_rel_freq_arr_r,
-                                y -> not array_contains(
-                                        list_transform(token_rel_freq_arr_l, x -> x.tok),
-                                        y.tok
-                                    )
-                        )
-                    ),
-
-                    x -> x.rel_freq
-                )
-            ),
-            (p, q) -> p / q^0.33
-
-        )
+    {complex_tok_expr}
         as complex_tok
-    from __splink__df_blocked
+    from __splink__df_blocked_with_token_lists
     ),
     __splink__df_comparison_vectors as (
-        select "source_dataset_l","source_dataset_r","unique_id_l","unique_id_r","flat_positional_l","flat_positional_r",CASE WHEN "flat_positional_l" IS NULL AND "flat_positional_r" IS NULL THEN -1 WHEN "flat_positional_l" = "flat_positional_r" THEN 1 ELSE 0 END as gamma_flat_positional,"numeric_token_1_l","numeric_token_1_r","numeric_1_alt_l","numeric_1_alt_r","numeric_token_2_l","numeric_token_2_r",CASE WHEN "numeric_token_1_l" IS NULL OR "numeric_token_1_r" IS NULL THEN -1 WHEN "numeric_token_1_l" = "numeric_token_1_r" THEN 4 WHEN "numeric_1_alt_l" = "numeric_token_1_r" OR "numeric_token_1_l" = "numeric_1_alt_r" OR "numeric_1_alt_l" = "numeric_1_alt_r" THEN 3 WHEN "numeric_token_2_l" = "numeric_token_1_r" THEN 2 WHEN "numeric_token_1_l" IS NULL OR "numeric_token_1_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_1,"tf_numeric_token_1_l","tf_numeric_token_1_r",CASE WHEN "numeric_token_2_l" IS NULL AND "numeric_token_2_r" IS NULL THEN -1 WHEN "numeric_token_2_l" = "numeric_token_2_r" THEN 3 WHEN "numeric_token_1_l" = "numeric_token_2_r" THEN 2 WHEN "numeric_token_2_l" IS NULL OR "numeric_token_2_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_2,"tf_numeric_token_2_l","tf_numeric_token_2_r","numeric_token_3_l","numeric_token_3_r",CASE WHEN "numeric_token_3_l" IS NULL AND "numeric_token_3_r" IS NULL THEN -1 WHEN "numeric_token_3_l" = "numeric_token_3_r" THEN 3 WHEN "numeric_token_2_l" = "numeric_token_3_r" THEN 2 WHEN "numeric_token_3_l" IS NULL OR "numeric_token_3_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_3,"tf_numeric_token_3_l","tf_numeric_token_3_r","token_rel_freq_arr_l","token_rel_freq_arr_r",CASE WHEN "token_rel_freq_arr_l" IS NULL OR "token_rel_freq_arr_r" IS NULL or length("token_rel_freq_arr_l") = 0 or length("token_rel_freq_arr_r") = 0 THEN -1 WHEN
-        complex_tok
-        < 1e-20 THEN 10 WHEN
-        complex_tok
-        < 1e-18 THEN 9 WHEN
-        complex_tok
-        < 1e-16 THEN 8 WHEN
-        complex_tok
-        < 1e-14 THEN 7 WHEN
-        complex_tok
-        < 1e-12 THEN 6 WHEN
-        complex_tok
-        < 1e-10 THEN 5 WHEN
-        complex_tok
-        < 1e-8 THEN 4 WHEN
-        complex_tok
-        < 1e-6 THEN 3 WHEN
-        complex_tok
-        < 1e-4 THEN 2 WHEN
-        complex_tok
-        < 1e-2 THEN 1 ELSE 0 END as gamma_token_rel_freq_arr,"common_end_tokens_l","common_end_tokens_r",CASE WHEN "common_end_tokens_l" IS NULL OR "common_end_tokens_r" IS NULL or length("common_end_tokens_l") = 0 or length("common_end_tokens_r") = 0 THEN -1 WHEN
-        list_reduce(
-            list_prepend(
-                1.0,
-                list_transform(
-                    array_filter(
-                        common_end_tokens_l,
-                        y -> array_contains(
-                            array_intersect(
-                                list_transform(common_end_tokens_l, x -> x.tok),
-                                list_transform(common_end_tokens_r, x -> x.tok)
-                            ),
-                            y.tok
-                        )
-                    ),
-                    x -> x.rel_freq
-                )
-            ),
-            (p, q) -> p * q
-        )
-        < 1e-2 THEN 1 ELSE 0 END as gamma_common_end_tokens,"original_address_concat_l","original_address_concat_r",CASE WHEN "original_address_concat_l" IS NULL OR "original_address_concat_r" IS NULL THEN -1 WHEN regexp_replace(regexp_replace(original_address_concat_l, '[[:punct:]]', '', 'g'), '\s+', ' ', 'g') = regexp_replace(regexp_replace(original_address_concat_r, '[[:punct:]]', '', 'g'), '\s+', ' ', 'g') THEN 3 WHEN levenshtein(original_address_concat_l, original_address_concat_r) < 3 THEN 2 WHEN levenshtein(original_address_concat_l, original_address_concat_r) < 10 THEN 1 ELSE 0 END as gamma_original_address_concat,"postcode_l","postcode_r",CASE WHEN "postcode_l" IS NULL AND "postcode_r" IS NULL THEN -1 WHEN postcode_l = postcode_r THEN 5 WHEN levenshtein(postcode_l, postcode_r) <= 1 THEN 4 WHEN levenshtein(postcode_l, postcode_r) <= 2 THEN 3 WHEN split_part(postcode_l, ' ', 1) = split_part(postcode_r, ' ', 1) THEN 2 WHEN split_part(postcode_l, ' ', 2) = split_part(postcode_r, ' ', 2) THEN 1 ELSE 0 END as gamma_postcode,"extremely_unusual_tokens_arr_l","extremely_unusual_tokens_arr_r","very_unusual_tokens_arr_l","very_unusual_tokens_arr_r","unusual_tokens_arr_l","unusual_tokens_arr_r",match_key,
+        select "source_dataset_l","source_dataset_r","unique_id_l","unique_id_r","flat_positional_l","flat_positional_r",CASE WHEN "flat_positional_l" IS NULL AND "flat_positional_r" IS NULL THEN -1 WHEN "flat_positional_l" = "flat_positional_r" THEN 1 ELSE 0 END as gamma_flat_positional,"numeric_token_1_l","numeric_token_1_r","numeric_1_alt_l","numeric_1_alt_r","numeric_token_2_l","numeric_token_2_r",CASE WHEN "numeric_token_1_l" IS NULL OR "numeric_token_1_r" IS NULL THEN -1 WHEN "numeric_token_1_l" = "numeric_token_1_r" THEN 4 WHEN "numeric_1_alt_l" = "numeric_token_1_r" OR "numeric_token_1_l" = "numeric_1_alt_r" OR "numeric_1_alt_l" = "numeric_1_alt_r" THEN 3 WHEN "numeric_token_2_l" = "numeric_token_1_r" THEN 2 WHEN "numeric_token_1_l" IS NULL OR "numeric_token_1_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_1,"tf_numeric_token_1_l","tf_numeric_token_1_r",CASE WHEN "numeric_token_2_l" IS NULL AND "numeric_token_2_r" IS NULL THEN -1 WHEN "numeric_token_2_l" = "numeric_token_2_r" THEN 3 WHEN "numeric_token_1_l" = "numeric_token_2_r" THEN 2 WHEN "numeric_token_2_l" IS NULL OR "numeric_token_2_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_2,"tf_numeric_token_2_l","tf_numeric_token_2_r","numeric_token_3_l","numeric_token_3_r",CASE WHEN "numeric_token_3_l" IS NULL AND "numeric_token_3_r" IS NULL THEN -1 WHEN "numeric_token_3_l" = "numeric_token_3_r" THEN 3 WHEN "numeric_token_2_l" = "numeric_token_3_r" THEN 2 WHEN "numeric_token_3_l" IS NULL OR "numeric_token_3_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_3,"tf_numeric_token_3_l","tf_numeric_token_3_r","token_rel_freq_arr_l","token_rel_freq_arr_r",CASE WHEN "token_rel_freq_arr_l" IS NULL OR "token_rel_freq_arr_r" IS NULL or length("token_rel_freq_arr_l") = 0 or length("token_rel_freq_arr_r") = 0 THEN -1 {token_rel_freq_arr_levels} ELSE 0 END as gamma_token_rel_freq_arr,"common_end_tokens_l","common_end_tokens_r",CASE WHEN "common_end_tokens_l" IS NULL OR "common_end_tokens_r" IS NULL or length("common_end_tokens_l") = 0 or length("common_end_tokens_r") = 0 THEN -1 WHEN
+        {common_end_tokens_expr}
+        < {common_end_tokens_threshold} THEN 1 ELSE 0 END as gamma_common_end_tokens,"original_address_concat_l","original_address_concat_r",CASE WHEN "original_address_concat_l" IS NULL OR "original_address_concat_r" IS NULL THEN -1 WHEN regexp_replace(regexp_replace(original_address_concat_l, '[[:punct:]]', '', 'g'), '\s+', ' ', 'g') = regexp_replace(regexp_replace(original_address_concat_r, '[[:punct:]]', '', 'g'), '\s+', ' ', 'g') THEN 3 WHEN levenshtein(original_address_concat_l, original_address_concat_r) < 3 THEN 2 WHEN levenshtein(original_address_concat_l, original_address_concat_r) < 10 THEN 1 ELSE 0 END as gamma_original_address_concat,"postcode_l","postcode_r",CASE WHEN "postcode_l" IS NULL AND "postcode_r" IS NULL THEN -1 WHEN postcode_l = postcode_r THEN 5 WHEN levenshtein(postcode_l, postcode_r) <= 1 THEN 4 WHEN levenshtein(postcode_l, postcode_r) <= 2 THEN 3 WHEN split_part(postcode_l, ' ', 1) = split_part(postcode_r, ' ', 1) THEN 2 WHEN split_part(postcode_l, ' ', 2) = split_part(postcode_r, ' ', 2) THEN 1 ELSE 0 END as gamma_postcode,"extremely_unusual_tokens_arr_l","extremely_unusual_tokens_arr_r","very_unusual_tokens_arr_l","very_unusual_tokens_arr_r","unusual_tokens_arr_l","unusual_tokens_arr_r",match_key,
         {additional_cols_expr_2}
         from __reusable
         ),
@@ -936,8 +1059,374 @@ def _performance_predict(
 
     )
         """
+    return sql
+
+
+def _predict_by_partition(
+    con: DuckDBPyConnection,
+    left_table_name: str,
+    right_table_name: str,
+    prediction_kwargs: dict,
+    *,
+    output_dir: str,
+    include_full_postcode_block: bool,
+    blocking_deduplication: str,
+    blocking_engine: str,
+    fuse_blocking_and_scoring: bool,
+    num_hash_partitions: int,
+    print_timings: bool,
+) -> DuckDBPyRelation:
+    # Runs blocking and prediction for one partition of the records at a time,
+    # writing each partition's predictions to a parquet file in output_dir.
+    # The blocking rules are grouped by _blocking_rule_partitions.  For each
+    # group, each side is written once to parquet files
+    # partitioned by partition key, so each partition is read without scanning
+    # the others, and without holding a second copy of either side in memory.
+    # Each partition key found on the left is then processed in turn.  Each
+    # group's rules exclude pairs found by rules in earlier groups, so every pair
+    # is found exactly once.
+    # Filtering by match_weight_threshold is per pair, so is unaffected.
+    # prediction_kwargs are passed to _prediction_sql
+    os.makedirs(output_dir, exist_ok=True)
+    for file_name in os.listdir(output_dir):
+        if file_name.startswith("predictions_") and file_name.endswith(".parquet"):
+            os.remove(os.path.join(output_dir, file_name))
+    partitions_dir = os.path.join(output_dir, "__partitions")
+
+    blocking_rules = _fast_path_blocking_rules(include_full_postcode_block)
+    partitions = _blocking_rule_partitions(blocking_rules, num_hash_partitions)
+
+    def predict_partition(blocking_sql, prediction_sql, side_sqls, file_name):
+        for side, side_sql in zip(["left", "right"], side_sqls):
+            sql = f"""
+            create or replace temporary table __partition_{side}_with_tf as
+            {side_sql}
+            """
+            con.execute(sql)
+            con.execute(
+                f"create or replace temporary view __prediction_{side}_with_tf as "
+                f"select * from __partition_{side}_with_tf"
+            )
+        if blocking_sql is not None:
+            con.execute(blocking_sql)
+        con.execute(prediction_sql)
+        output_path = os.path.join(output_dir, file_name)
+        con.execute(f"copy predictions to '{output_path}' (format parquet)")
+
+    start_time = time.time()
+    num_partitions_predicted = 0
+    for group_number, (rules, left_key_sql, right_key_sql) in enumerate(partitions):
+        if fuse_blocking_and_scoring:
+            blocking_sql = None
+            fused_blocking_sql = _fused_blocking_sql(
+                include_full_postcode_block,
+                False,
+                prediction_kwargs["additional_columns_to_retain"],
+                rules,
+            )
+            prediction_sql = _prediction_sql(
+                **prediction_kwargs, fused_blocking_sql=fused_blocking_sql
+            )
+        else:
+            blocking_sql = _blocking_sql(
+                include_full_postcode_block,
+                False,
+                blocking_deduplication,
+                blocking_engine,
+                prediction_kwargs["salting_partitions"],
+                rules,
+            )
+            prediction_sql = _prediction_sql(**prediction_kwargs)
+
+        if os.path.exists(partitions_dir):
+            shutil.rmtree(partitions_dir)
+        os.makedirs(partitions_dir)
+        for side, table_name, key_sql in [
+            ("left", left_table_name, left_key_sql),
+            ("right", right_table_name, right_key_sql),
+        ]:
+            sql = f"""
+            copy (
+                select {key_sql} as __partition_key, *
+                from {table_name}
+                where __partition_key is not null
+            ) to '{os.path.join(partitions_dir, side)}'
+            (format parquet, partition_by (__partition_key))
+            """
+            con.execute(sql)
+
+        # A partition with no right records has no pairs, so is skipped
+        def partition_keys(side):
+            side_dir = os.path.join(partitions_dir, side)
+            if not os.path.exists(side_dir):
+                return set()
+            return {d.split("=", 1)[1] for d in os.listdir(side_dir)}
+
+        keys = sorted(partition_keys("left") & partition_keys("right"), key=int)
+
+        for partition_key in keys:
+            side_sqls = [f"""
+                select * exclude (__partition_key) from read_parquet(
+                    '{partitions_dir}/{side}/__partition_key={partition_key}/*.parquet',
+                    hive_partitioning = true
+                )
+                """ for side in ["left", "right"]]
+            predict_partition(
+                blocking_sql,
+                prediction_sql,
+                side_sqls,
+                f"predictions_{group_number}_{partition_key}.parquet",
+            )
+        num_partitions_predicted += len(keys)
+
+        if print_timings:
+            elapsed_time = time.time() - start_time
+            print(
+                f"Predicted {len(keys)} partitions of blocking rule group "
+                f"{group_number} after {elapsed_time:.2f} seconds"
+            )
+
+    # With no pairs to predict, an empty file is written so the predictions still
+    # have their columns
+    if num_partitions_predicted == 0:
+        side_sqls = [
+            f"select * from {table_name} where false"
+            for table_name in [left_table_name, right_table_name]
+        ]
+        predict_partition(
+            blocking_sql, prediction_sql, side_sqls, "predictions_empty.parquet"
+        )
+
+    if os.path.exists(partitions_dir):
+        shutil.rmtree(partitions_dir)
+    for side in ["left", "right"]:
+        con.execute(f"drop view __prediction_{side}_with_tf")
+        con.execute(f"drop table __partition_{side}_with_tf")
+    return con.read_parquet(os.path.join(output_dir, "predictions_*.parquet"))
+
+
+def _performance_predict(
+    *,
+    df_addresses_to_match: Union[DuckDBPyRelation, str],
+    df_addresses_to_search_within: Union[DuckDBPyRelation, str],
+    con: DuckDBPyConnection,
+    precomputed_numeric_tf_table: DuckDBPyRelation = None,
+    match_weight_threshold: None,
+    additional_columns_to_retain: List[str] = None,
+    output_all_cols: bool = True,
+    include_full_postcode_block=True,
+    full_block=False,
+    print_timings=False,
+    use_log2_token_frequencies=False,
+    token_comparison_engine="sql",
+    blocking_deduplication="min_match_key",
+    blocking_engine="joins",
+    salting_partitions: int = None,
+    output_dir: str = None,
+    num_hash_partitions: int = 16,
+    fuse_blocking_and_scoring=False,
+):
+    # df_addresses_to_match and df_addresses_to_search_within may each be a
+    # relation, the name of a table, or a path to parquet file(s).  They are
+    # referenced in place rather than copied.
+    # df_addresses_to_search_within may also be the path of a DuckDB file written
+    # by prepare_search_within_table, whose prepared addresses are used in place
+    # blocking_engine is "joins" to join once per blocking rule, with pairs
+    # deduplicated using blocking_deduplication, or "keys" to find all pairs with
+    # one join on exploded blocking keys.  See blocking.py
+    # Pairs are scored in salting_partitions joins, defaulting to one per DuckDB
+    # thread.  Each pair's partition is a hash of its ids, so runs are
+    # reproducible.
+    # If output_dir is given, the prediction is run one partition of the records
+    # at a time and each partition's predictions are written to parquet in
+    # output_dir, so memory use is bounded by the largest partition rather than
+    # the whole input.  See _predict_by_partition
+    # If fuse_blocking_and_scoring is True, pairs are scored as the blocking joins
+    # produce them, rather than being written to blocked_pairs and joined back to
+    # the records.  This only supports blocking_engine="joins", deduplicating as
+    # Splink does, and salting_partitions is unused.  See _fused_blocking_sql
+    from splink.duckdb.linker import DuckDBLinker
+
+    settings_as_dict = _load_settings()
+
+    search_within_is_prepared = isinstance(
+        df_addresses_to_search_within, str
+    ) and df_addresses_to_search_within.endswith(".duckdb")
+
+    # The prepared file is left attached when the call returns, since the
+    # returned linker reads it, as it reads the views of the other inputs.  Any
+    # file still attached under the same name is detached first, so a different
+    # prepared file from an earlier call is never read in its place
+    if search_within_is_prepared:
+        con.execute(f"DETACH DATABASE IF EXISTS {_PREPARED_SEARCH_WITHIN_DATABASE}")
+        sql = f"""
+        ATTACH '{df_addresses_to_search_within}'
+        AS {_PREPARED_SEARCH_WITHIN_DATABASE} (READ_ONLY)
+        """
+        con.execute(sql)
+        # The linker is given the addresses without their term frequencies,
+        # which it adds itself
+        sql = f"""
+        create or replace temporary view __addresses_to_search_within as
+        select * exclude ({", ".join(_WITH_TF_COLUMNS)})
+        from {_PREPARED_SEARCH_WITHIN_TABLE}
+        """
+        con.execute(sql)
+        search_within_table_name = "__addresses_to_search_within"
+    else:
+        search_within_table_name = _register_input_table(
+            con, df_addresses_to_search_within, "__addresses_to_search_within"
+        )
+
+    table_names = [
+        _register_input_table(con, df_addresses_to_match, "__addresses_to_match"),
+        search_within_table_name,
+    ]
+
+    # Initialize the linker, skipping settings validation as in get_pretrained_linker
+    linker = DuckDBLinker(
+        table_names,
+        settings_dict=settings_as_dict,
+        connection=con,
+        validate_settings=False,
+    )
+
+    numeric_tf_table_name = _register_numeric_tf_lookups(
+        linker, con, precomputed_numeric_tf_table
+    )
+
+    # Each side is materialised once with its term frequencies attached.  Splink's
+    # df_concat_with_tf would union the small left input with the large right one,
+    # only for blocking and scoring to split them again by source_dataset
+    left_table_name = "__addresses_to_match_with_tf"
+    right_table_name = "__addresses_to_search_within_with_tf"
+    start_time = time.time()
+    _create_table_with_tf(con, table_names[0], left_table_name)
+    if search_within_is_prepared:
+        sql = f"""
+        select numeric_tf_fingerprint
+        from {_PREPARED_SEARCH_WITHIN_FINGERPRINT_TABLE}
+        """
+        prepared_fingerprint = con.sql(sql).fetchall()[0][0]
+        if prepared_fingerprint != _numeric_tf_fingerprint(con, numeric_tf_table_name):
+            con.execute(f"DETACH {_PREPARED_SEARCH_WITHIN_DATABASE}")
+            raise ValueError(
+                f"{df_addresses_to_search_within} was prepared with different numeric "
+                "token frequencies, so must be prepared again using "
+                "prepare_search_within_table"
+            )
+        right_table_name = _PREPARED_SEARCH_WITHIN_TABLE
+    else:
+        _create_table_with_tf(con, table_names[1], right_table_name)
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    if print_timings:
+        print(f"Attaching term frequencies took {elapsed_time:.2f} seconds")
+
+    # The blocking and prediction SQL is cached, so everything that varies between
+    # calls is passed in through these views
+    for side, table_name in [("left", left_table_name), ("right", right_table_name)]:
+        con.execute(
+            f"create or replace temporary view __prediction_{side}_with_tf as "
+            f"select * from {table_name}"
+        )
+
+    if fuse_blocking_and_scoring and blocking_engine != "joins":
+        raise ValueError("fuse_blocking_and_scoring requires blocking_engine='joins'")
+
+    if salting_partitions is None:
+        sql = "select current_setting('threads')"
+        salting_partitions = con.sql(sql).fetchall()[0][0]
+
+    # The token comparisons can be computed in SQL or with a vectorised Arrow UDF
+    # (token_comparison_engine="arrow"), see arr_comparisons.  The SQL reads the
+    # token lists _prediction_sql selects once per pair
+    if use_log2_token_frequencies:
+        if token_comparison_engine != "sql":
+            raise ValueError(
+                "Log2 token frequencies are only supported by the 'sql' token "
+                "comparison engine"
+            )
+        complex_tok_expr = array_reduce_by_log2_freq(
+            "token_rel_freq_arr", 0.33, token_lists_precomputed=True
+        )
+        common_end_tokens_expr = array_reduce_by_log2_freq(
+            "common_end_tokens", 0.0, token_lists_precomputed=True
+        )
+    else:
+        complex_tok_expr = array_reduce_by_freq_using_engine(
+            token_comparison_engine,
+            con,
+            left_table_name,
+            "token_rel_freq_arr",
+            0.33,
+            token_lists_precomputed=True,
+        )
+        common_end_tokens_expr = array_reduce_by_freq_using_engine(
+            token_comparison_engine,
+            con,
+            left_table_name,
+            "common_end_tokens",
+            0.0,
+            token_lists_precomputed=True,
+        )
+
+    prediction_kwargs = {
+        "additional_columns_to_retain": tuple(additional_columns_to_retain or ()),
+        "output_all_cols": output_all_cols,
+        "match_weight_threshold": match_weight_threshold,
+        "use_log2_token_frequencies": use_log2_token_frequencies,
+        "complex_tok_expr": complex_tok_expr,
+        "common_end_tokens_expr": common_end_tokens_expr,
+        "salting_partitions": salting_partitions,
+    }
+
+    if output_dir is not None:
+        if full_block:
+            raise ValueError("full_block cannot be used with output_dir")
+        predictions = _predict_by_partition(
+            con,
+            left_table_name,
+            right_table_name,
+            prediction_kwargs,
+            output_dir=output_dir,
+            include_full_postcode_block=include_full_postcode_block,
+            blocking_deduplication=blocking_deduplication,
+            blocking_engine=blocking_engine,
+            fuse_blocking_and_scoring=fuse_blocking_and_scoring,
+            num_hash_partitions=num_hash_partitions,
+            print_timings=print_timings,
+        )
+        return linker, predictions
+
+    if fuse_blocking_and_scoring:
+        fused_blocking_sql = _fused_blocking_sql(
+            include_full_postcode_block,
+            full_block,
+            prediction_kwargs["additional_columns_to_retain"],
+        )
+        prediction_sql = _prediction_sql(
+            **prediction_kwargs, fused_blocking_sql=fused_blocking_sql
+        )
+    else:
+        prediction_sql = _prediction_sql(**prediction_kwargs)
+
+        sql = _blocking_sql(
+            include_full_postcode_block,
+            full_block,
+            blocking_deduplication,
+            blocking_engine,
+            salting_partitions,
+        )
+        start_time = time.time()
+        linker._con.execute(sql)
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        if print_timings:
+            print(f"Time taken to block: {elapsed_time:.2f} seconds")
+
     start_time = time.time()
-    linker._con.sql(sql)
+    linker._con.execute(prediction_sql)
     end_time = time.time()
     elapsed_time = end_time - start_time
     if print_timings:
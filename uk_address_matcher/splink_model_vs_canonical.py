@@ -1,7 +1,30 @@
+import re
 import time
 
 from duckdb import DuckDBPyConnection, DuckDBPyRelation
 
+from uk_address_matcher.arr_comparisons import (
+    array_reduce_by_freq_using_engine,
+    token_list_columns_sql,
+)
+from uk_address_matcher.blocking import (
+    compile_blocking_sql,
+    compile_key_blocking_sql,
+    salt_sql,
+)
+from uk_address_matcher.splink_model import SKIPPED_BLOCKING_RULES, get_blocking_rules
+
+
+def _canonical_blocking_rule(rule: str) -> str:
+    # Rewrites a blocking rule from the model settings to use the columns
+    # precomputed in full_blocking_canonical, e.g. le_unusual_tokens_arr_1 for
+    # list_extract(unusual_tokens_arr, 1), and the postcode columns of the
+    # canonical data
+    rule = re.sub(r"list_extract\(r\.(\w+), (\d+)\)", r"r.le_\1_\2", rule)
+    rule = rule.replace("split_part(r.postcode, ' ', 1)", "r.postcode_start")
+    rule = rule.replace("split_part(r.postcode, ' ', 2)", "r.postcode_end")
+    return rule
+
 
 def _performance_predict_against_canonical(
     *,
@@ -11,6 +34,9 @@ def _performance_predict_against_canonical(
     output_all_cols: bool = True,
     include_full_postcode_block=True,
     print_timings=True,
+    token_comparison_engine="sql",
+    blocking_engine="joins",
+    salting_partitions: int = None,
 ):
 
     sql = """
@@ -34,298 +60,40 @@ def _performance_predict_against_canonical(
     """
     con.sql(sql)
 
-    if include_full_postcode_block:
-        pc_blocking_rule = """
-        UNION ALL
-        select
-                "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-                , '24' as match_key
-
-                from new_recs_to_match as l
-                inner join full_blocking_canonical as r
-                on
-                (l.postcode = r.postcode)
-                where 1=1
-                AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((list_extract(l.extremely_unusual_tokens_arr, 1) = r.le_extremely_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((list_extract(l.extremely_unusual_tokens_arr, 1) = r.le_extremely_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-        """
+    # blocking_engine is "joins" to join once per blocking rule or "keys" to find
+    # all pairs with one join on exploded blocking keys.  See blocking.py
+    if blocking_engine == "joins":
+        compile_sql = compile_blocking_sql
+    elif blocking_engine == "keys":
+        compile_sql = compile_key_blocking_sql
     else:
-        pc_blocking_rule = ""
+        raise ValueError(
+            f"blocking_engine must be 'joins' or 'keys', got {blocking_engine!r}"
+        )
+    if salting_partitions is None:
+        sql = "select current_setting('threads')"
+        salting_partitions = con.sql(sql).fetchall()[0][0]
+
+    blocked_sql = compile_sql(
+        [
+            _canonical_blocking_rule(rule)
+            for rule in get_blocking_rules(include_full_postcode_block)
+        ],
+        left_table="new_recs_to_match",
+        right_table="full_blocking_canonical",
+        id_columns=["unique_id"],
+        skipped_rules=[_canonical_blocking_rule(r) for r in SKIPPED_BLOCKING_RULES],
+    )
 
     sql = f"""
     create or replace table blocked_pairs as (
     with
-
-
     __splink__df_blocked as (
-            -- start_blocking
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '0' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '1' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '2' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '3' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '4' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '5' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '6' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '7' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode) and false --HACK BECAUSE CREATES LOTS OF PAIRS BUT FEW MATCHES
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '8' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1) and false --HACK BECAUSE CREATES LOTS OF PAIRS BUT FEW MATCHES
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '9' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '10' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '11' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '12' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '13' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '14' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '15' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '16' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '17' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '18' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '19' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '20' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '21' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '22' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (list_extract(l.extremely_unusual_tokens_arr, 1) = r.le_extremely_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false))
-             UNION ALL
-            select
-            "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r"
-            , '23' as match_key
-
-            from new_recs_to_match as l
-            inner join full_blocking_canonical as r
-            on
-            (list_extract(l.extremely_unusual_tokens_arr, 1) = r.le_extremely_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end)
-             where 1=1
-            AND NOT (coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and list_extract(l.unusual_tokens_arr, 2) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_2 and l.postcode = r.postcode),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = r.le_very_unusual_tokens_arr_1 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((list_extract(l.very_unusual_tokens_arr, 1) = le_very_unusual_tokens_arr_2 and l.numeric_token_1 = r.numeric_token_1),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and list_extract(l.unusual_tokens_arr, 1) = r.le_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_2 = r.numeric_token_2 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.postcode = r.postcode),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.postcode = r.postcode),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_1_alt and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_1_alt = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 1) = r.postcode_start),false) OR coalesce((l.numeric_token_1 = r.numeric_token_1 and l.numeric_token_2 = r.numeric_token_2 and split_part(l.postcode, ' ', 2) = r.postcode_end),false) OR coalesce((list_extract(l.extremely_unusual_tokens_arr, 1) = r.le_extremely_unusual_tokens_arr_1 and split_part(l.postcode, ' ', 1) = r.postcode_start),false))
-            {pc_blocking_rule}
-            -- end_blocking
+            {blocked_sql}
             )
 
-    select *, ceiling(random() * 8) as _salt_block from __splink__df_blocked)
+    select *, {salt_sql(["unique_id"], salting_partitions)} as _salt_block
+    from __splink__df_blocked)
     """
 
     start_time = time.time()
@@ -366,68 +134,58 @@ def _performance_predict_against_canonical(
     else:
         qualify_expr = ""
 
-    sql = f"""
-    create or replace table predictions as (
-    WITH
+    # The token comparisons can be computed in SQL or with a vectorised Arrow UDF
+    # (token_comparison_engine="arrow"), see arr_comparisons
+    complex_tok_expr = array_reduce_by_freq_using_engine(
+        token_comparison_engine,
+        con,
+        "new_recs_to_match",
+        "token_rel_freq_arr",
+        0.33,
+        token_lists_precomputed=True,
+    )
+    common_end_tokens_expr = array_reduce_by_freq_using_engine(
+        token_comparison_engine,
+        con,
+        "new_recs_to_match",
+        "common_end_tokens",
+        0.0,
+        token_lists_precomputed=True,
+    )
 
-    __splink__df_blocked as (
+    # As in splink_model._prediction_sql, the pairs are scored in
+    # salting_partitions separate joins, each taking the pairs with one value of
+    # _salt_block
+    blocked_sql = f"""
     select  "l"."source_dataset" AS "source_dataset_l", "r"."source_dataset" AS "source_dataset_r", "l"."unique_id" AS "unique_id_l", "r"."unique_id" AS "unique_id_r", "l"."flat_positional" AS "flat_positional_l", "r"."flat_positional" AS "flat_positional_r", "l"."numeric_token_1" AS "numeric_token_1_l", "r"."numeric_token_1" AS "numeric_token_1_r", "l"."tf_numeric_token_1" AS "tf_numeric_token_1_l", "r"."tf_numeric_token_1" AS "tf_numeric_token_1_r", "l"."numeric_1_alt" AS "numeric_1_alt_l", "r"."numeric_1_alt" AS "numeric_1_alt_r", "l"."numeric_token_2" AS "numeric_token_2_l", "r"."numeric_token_2" AS "numeric_token_2_r", "l"."tf_numeric_token_2" AS "tf_numeric_token_2_l", "r"."tf_numeric_token_2" AS "tf_numeric_token_2_r", "l"."numeric_token_3" AS "numeric_token_3_l", "r"."numeric_token_3" AS "numeric_token_3_r", "l"."tf_numeric_token_3" AS "tf_numeric_token_3_l", "r"."tf_numeric_token_3" AS "tf_numeric_token_3_r", "l"."token_rel_freq_arr" AS "token_rel_freq_arr_l", "r"."token_rel_freq_arr" AS "token_rel_freq_arr_r", "l"."common_end_tokens" AS "common_end_tokens_l", "r"."common_end_tokens" AS "common_end_tokens_r", "l"."original_address_concat" AS "original_address_concat_l", "r"."original_address_concat" AS "original_address_concat_r", "l"."postcode" AS "postcode_l", "r"."postcode" AS "postcode_r", "l"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_l", "r"."extremely_unusual_tokens_arr" AS "extremely_unusual_tokens_arr_r", "l"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_l", "r"."very_unusual_tokens_arr" AS "very_unusual_tokens_arr_r", "l"."unusual_tokens_arr" AS "unusual_tokens_arr_l", "r"."unusual_tokens_arr" AS "unusual_tokens_arr_r", b.match_key as match_key,
     {additional_cols_expr}
     from blocked_pairs as b inner join new_recs_to_match as l on b.unique_id_l = l.unique_id inner join full_canonical as r on b.unique_id_r = r.unique_id
+    """
+    salted_blocked_sql = "\n    UNION ALL\n".join(
+        f"{blocked_sql}    where b._salt_block = {salt}"
+        for salt in range(1, salting_partitions + 1)
+    )
 
+    sql = f"""
+    create or replace table predictions as (
+    WITH
+
+    __splink__df_blocked as (
+    {salted_blocked_sql}
+    ),
+    __splink__df_blocked_with_token_lists as (
+    select
+    *,
+    {token_list_columns_sql("token_rel_freq_arr")},
+    {token_list_columns_sql("common_end_tokens")}
+    from __splink__df_blocked
     ),
     __reusable as (
     select
     *,
-    list_reduce(
-            list_prepend(
-                1.0,
-                list_transform(
-                    array_filter(
-                        token_rel_freq_arr_l,
-                        y -> array_contains(
-                            array_intersect(
-                                list_transform(token_rel_freq_arr_l, x -> x.tok),
-                                list_transform(token_rel_freq_arr_r, x -> x.tok)
-                            ),
-                            y.tok
-                        )
-                    ),
-                    x -> x.rel_freq
-                )
-            ),
-            (p, q) -> p * q
-        )
-        *
-        list_reduce(
-            list_prepend(
-                1.0,
-                list_transform(
-                    list_concat(
-                        array_filter(
-                            token_rel_freq_arr_l,
-                                y -> not array_contains(
-                                        list_transform(token_rel_freq_arr_r, x -> x.tok),
-                                        y.tok
-                                    )
-                        ),
-                        array_filter(
-                            token_rel_freq_arr_r,
-                                y -> not array_contains(
-                                        list_transform(token_rel_freq_arr_l, x -> x.tok),
-                                        y.tok
-                                    )
-                        )
-                    ),
-
-                    x -> x.rel_freq
-                )
-            ),
-            (p, q) -> p / q^0.33
-
-        )
+    {complex_tok_expr}
         as complex_tok
-    from __splink__df_blocked
+    from __splink__df_blocked_with_token_lists
     ),
     __splink__df_comparison_vectors as (
         select "source_dataset_l","source_dataset_r","unique_id_l","unique_id_r","flat_positional_l","flat_positional_r",CASE WHEN "flat_positional_l" IS NULL AND "flat_positional_r" IS NULL THEN -1 WHEN "flat_positional_l" = "flat_positional_r" THEN 1 ELSE 0 END as gamma_flat_positional,"numeric_token_1_l","numeric_token_1_r","numeric_1_alt_l","numeric_1_alt_r","numeric_token_2_l","numeric_token_2_r",CASE WHEN "numeric_token_1_l" IS NULL OR "numeric_token_1_r" IS NULL THEN -1 WHEN "numeric_token_1_l" = "numeric_token_1_r" THEN 4 WHEN "numeric_1_alt_l" = "numeric_token_1_r" OR "numeric_token_1_l" = "numeric_1_alt_r" OR "numeric_1_alt_l" = "numeric_1_alt_r" THEN 3 WHEN "numeric_token_2_l" = "numeric_token_1_r" THEN 2 WHEN "numeric_token_1_l" IS NULL OR "numeric_token_1_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_1,"tf_numeric_token_1_l","tf_numeric_token_1_r",CASE WHEN "numeric_token_2_l" IS NULL AND "numeric_token_2_r" IS NULL THEN -1 WHEN "numeric_token_2_l" = "numeric_token_2_r" THEN 3 WHEN "numeric_token_1_l" = "numeric_token_2_r" THEN 2 WHEN "numeric_token_2_l" IS NULL OR "numeric_token_2_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_2,"tf_numeric_token_2_l","tf_numeric_token_2_r","numeric_token_3_l","numeric_token_3_r",CASE WHEN "numeric_token_3_l" IS NULL AND "numeric_token_3_r" IS NULL THEN -1 WHEN "numeric_token_3_l" = "numeric_token_3_r" THEN 3 WHEN "numeric_token_2_l" = "numeric_token_3_r" THEN 2 WHEN "numeric_token_3_l" IS NULL OR "numeric_token_3_r" IS NULL THEN 1 ELSE 0 END as gamma_numeric_token_3,"tf_numeric_token_3_l","tf_numeric_token_3_r","token_rel_freq_arr_l","token_rel_freq_arr_r",CASE WHEN "token_rel_freq_arr_l" IS NULL OR "token_rel_freq_arr_r" IS NULL or length("token_rel_freq_arr_l") = 0 or length("token_rel_freq_arr_r") = 0 THEN -1 WHEN
@@ -451,25 +209,7 @@ def _performance_predict_against_canonical(
         < 1e-4 THEN 2 WHEN
         complex_tok
         < 1e-2 THEN 1 ELSE 0 END as gamma_token_rel_freq_arr,"common_end_tokens_l","common_end_tokens_r",CASE WHEN "common_end_tokens_l" IS NULL OR "common_end_tokens_r" IS NULL or length("common_end_tokens_l") = 0 or length("common_end_tokens_r") = 0 THEN -1 WHEN
-        list_reduce(
-            list_prepend(
-                1.0,
-                list_transform(
-                    array_filter(
-                        common_end_tokens_l,
-                        y -> array_contains(
-                            array_intersect(
-                                list_transform(common_end_tokens_l, x -> x.tok),
-                                list_transform(common_end_tokens_r, x -> x.tok)
-                            ),
-                            y.tok
-                        )
-                    ),
-                    x -> x.rel_freq
-                )
-            ),
-            (p, q) -> p * q
-        )
+        {common_end_tokens_expr}
         < 1e-2 THEN 1 ELSE 0 END as gamma_common_end_tokens,"original_address_concat_l","original_address_concat_r",CASE WHEN "original_address_concat_l" IS NULL OR "original_address_concat_r" IS NULL THEN -1 WHEN regexp_replace(regexp_replace(original_address_concat_l, '[[:punct:]]', '', 'g'), '\s+', ' ', 'g') = regexp_replace(regexp_replace(original_address_concat_r, '[[:punct:]]', '', 'g'), '\s+', ' ', 'g') THEN 3 WHEN levenshtein(original_address_concat_l, original_address_concat_r) < 3 THEN 2 WHEN levenshtein(original_address_concat_l, original_address_concat_r) < 10 THEN 1 ELSE 0 END as gamma_original_address_concat,"postcode_l","postcode_r",CASE WHEN "postcode_l" IS NULL AND "postcode_r" IS NULL THEN -1 WHEN postcode_l = postcode_r THEN 5 WHEN levenshtein(postcode_l, postcode_r) <= 1 THEN 4 WHEN levenshtein(postcode_l, postcode_r) <= 2 THEN 3 WHEN split_part(postcode_l, ' ', 1) = split_part(postcode_r, ' ', 1) THEN 2 WHEN split_part(postcode_l, ' ', 2) = split_part(postcode_r, ' ', 2) THEN 1 ELSE 0 END as gamma_postcode,"extremely_unusual_tokens_arr_l","extremely_unusual_tokens_arr_r","very_unusual_tokens_arr_l","very_unusual_tokens_arr_r","unusual_tokens_arr_l","unusual_tokens_arr_r",match_key,
         {additional_cols_expr_2}
         from __reusable